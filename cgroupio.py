@@ -0,0 +1,138 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for reading and writing cgroup and sysfs files through cached fds
+"""
+# @code
+
+import errno
+import os
+import threading
+
+from logger import LOGGER
+
+READ_BUFFER_SIZE = 65536
+# The file or its cgroup has been removed, the fd is useless from now on.
+STALE_FD_ERRNOS = (errno.ENOENT, errno.ENODEV)
+
+
+class CgroupIO:
+    """
+    Keeps one fd open per path and remembers the last value written to and
+    read from it. Writing the value which was written last time is skipped,
+    so the cache must be evicted when the file can be changed by others,
+    e.g. when its cgroup is removed and created again. The lock is held
+    across the read or write, so an fd is never closed by another thread's
+    eviction while it is in use, nor reused for a different file.
+    """
+    def __init__(self):
+        self.fd_dict = {}
+        self.written_dict = {}
+        self.read_dict = {}
+        self.lock = threading.Lock()
+
+    def __get_fd(self, path, flags):
+        """Called with self.lock held."""
+        key = (path, flags)
+        fd = self.fd_dict.get(key)
+        if fd is None:
+            fd = os.open(path, flags | os.O_CLOEXEC)
+            self.fd_dict[key] = fd
+        return fd
+
+    def evict_path(self, path):
+        with self.lock:
+            for key in [key for key in self.fd_dict if key[0] == path]:
+                os.close(self.fd_dict.pop(key))
+            self.written_dict.pop(path, None)
+            self.read_dict.pop(path, None)
+
+    @staticmethod
+    def __read_fd(fd):
+        """Called with self.lock held, reads the whole file however large, e.g. the tasks of a big VM."""
+        chunk_list = []
+        offset = 0
+        while True:
+            chunk = os.pread(fd, READ_BUFFER_SIZE, offset)
+            chunk_list.append(chunk)
+            offset += len(chunk)
+            # cgroup and proc files fill the buffer unless they reach the end.
+            if len(chunk) < READ_BUFFER_SIZE:
+                break
+        return b"".join(chunk_list).decode().rstrip("\n")
+
+    def read(self, path, cached=False):
+        """Return the content without the trailing newline, or the last content read if cached."""
+        return self.read_batch([path], cached)[0]
+
+    def read_batch(self, paths, cached=False):
+        """Like read for every path, but all files are read under one acquisition of the lock."""
+        read_paths = [path for path in paths if not cached or path not in self.read_dict]
+        path = None
+        try:
+            with self.lock:
+                for path in read_paths:
+                    self.read_dict[path] = self.__read_fd(self.__get_fd(path, os.O_RDONLY))
+        except FileNotFoundError as error:
+            LOGGER.error(str(error))
+            self.evict_path(path)
+            raise
+        except OSError as error:
+            if error.errno in STALE_FD_ERRNOS:
+                self.evict_path(path)
+            raise
+        return [self.read_dict.get(path) for path in paths]
+
+    def write(self, path, value, log=True, dedup=True):
+        """Return False if the write is skipped because the value is already in place."""
+        if dedup and self.written_dict.get(path) == value:
+            return False
+        try:
+            with self.lock:
+                os.pwrite(self.__get_fd(path, os.O_WRONLY), value.encode(), 0)
+        except FileNotFoundError as error:
+            if log:
+                LOGGER.error(str(error))
+            self.evict_path(path)
+            raise
+        except OSError as error:
+            if error.errno in STALE_FD_ERRNOS:
+                self.evict_path(path)
+            raise
+        if dedup:
+            self.written_dict[path] = value
+        return True
+
+    def evict(self, path_prefix):
+        """Close the fds and forget the values of all paths under path_prefix."""
+        path_prefix = path_prefix.rstrip("/") + "/"
+        with self.lock:
+            paths = set(key[0] for key in self.fd_dict)
+            paths.update(self.written_dict, self.read_dict)
+        for path in paths:
+            if path.startswith(path_prefix):
+                self.evict_path(path)
+
+    def evict_scope(self, scope_name):
+        """Evict the paths of a scope in every cgroup hierarchy."""
+        scope_component = "/%s/" % scope_name
+        with self.lock:
+            paths = set(key[0] for key in self.fd_dict)
+            paths.update(self.written_dict, self.read_dict)
+        for path in paths:
+            if scope_component in path:
+                self.evict_path(path)
+
+
+CGROUP_IO = CgroupIO()
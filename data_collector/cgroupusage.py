@@ -0,0 +1,98 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for reading CPU time of VMs from cgroupfs directly
+"""
+# @code
+
+import os
+
+from logger import LOGGER
+import util
+
+CGRP_ROOT_PATH = "/sys/fs/cgroup"
+CPUACCT_CGRP_PATH = "/sys/fs/cgroup/cpuacct"
+CGRP_V2_CONTROLLERS_PATH = "/sys/fs/cgroup/cgroup.controllers"
+USAGE_FILE_V1 = "cpuacct.usage_percpu"
+USAGE_FILE_V2 = "cpu.stat"
+CPUS_FILE_V2 = "cpuset.cpus.effective"
+READ_BUFFER_SIZE = 65536
+USEC_TO_NSEC = 1000
+
+
+class CgroupUsageReader:
+    def __init__(self, max_cpu_nums):
+        self.max_cpu_nums = max_cpu_nums
+        self.cgroup_v2 = os.access(CGRP_V2_CONTROLLERS_PATH, os.R_OK)
+        self.usage_fd_dict = {}
+        self.v2_cpus_dict = {}
+        LOGGER.info("Read VMs cpu time from cgroup %s" % ("v2" if self.cgroup_v2 else "v1"))
+
+    def __get_scope_path(self, domain_info):
+        if self.cgroup_v2:
+            return os.path.join(CGRP_ROOT_PATH, domain_info.cgroup_slice, domain_info.cgroup_name)
+        return os.path.join(CPUACCT_CGRP_PATH, domain_info.cgroup_slice, domain_info.cgroup_name)
+
+    def __get_usage_fd(self, domain_info):
+        usage_fd = self.usage_fd_dict.get(domain_info.cgroup_name)
+        if usage_fd is not None:
+            return usage_fd
+
+        scope_path = self.__get_scope_path(domain_info)
+        usage_fd = os.open(os.path.join(scope_path, USAGE_FILE_V2 if self.cgroup_v2 else USAGE_FILE_V1),
+                           os.O_RDONLY | os.O_CLOEXEC)
+        self.usage_fd_dict[domain_info.cgroup_name] = usage_fd
+        if self.cgroup_v2:
+            with open(os.path.join(scope_path, CPUS_FILE_V2)) as cpus_file:
+                self.v2_cpus_dict[domain_info.cgroup_name] = \
+                    [cpu for cpu in util.parse_cpu_list(cpus_file.read()) if cpu < self.max_cpu_nums]
+        return usage_fd
+
+    def get_percpu_time(self, domain_info):
+        """Raise OSError if the scope of the domain disappears."""
+        try:
+            usage_data = os.pread(self.__get_usage_fd(domain_info), READ_BUFFER_SIZE, 0).decode()
+        except OSError:
+            self.release(domain_info)
+            raise
+
+        running_time_list = [0] * self.max_cpu_nums
+        if not self.cgroup_v2:
+            for cpu, cpu_time in enumerate(usage_data.split()[:self.max_cpu_nums]):
+                running_time_list[cpu] = int(cpu_time)
+            return running_time_list
+
+        # cgroup v2 has no per-CPU accounting, spread usage over the allowed CPUs evenly.
+        total_time = 0
+        for line in usage_data.splitlines():
+            key, value = line.split()
+            if key == "usage_usec":
+                total_time = int(value) * USEC_TO_NSEC
+                break
+        cpus = self.v2_cpus_dict.get(domain_info.cgroup_name)
+        for cpu in cpus:
+            running_time_list[cpu] = total_time / len(cpus)
+        return running_time_list
+
+    def release(self, domain_info):
+        usage_fd = self.usage_fd_dict.pop(domain_info.cgroup_name, None)
+        self.v2_cpus_dict.pop(domain_info.cgroup_name, None)
+        if usage_fd is not None:
+            os.close(usage_fd)
+
+    def release_all(self):
+        for usage_fd in self.usage_fd_dict.values():
+            os.close(usage_fd)
+        self.usage_fd_dict.clear()
+        self.v2_cpus_dict.clear()
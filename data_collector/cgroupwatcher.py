@@ -0,0 +1,109 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for watching the scopes of a cgroup slice with inotify
+"""
+# @code
+
+import ctypes
+import os
+import struct
+import threading
+
+from logger import LOGGER
+
+IN_MODIFY = 0x00000002
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_FORMAT = "iIII"
+INOTIFY_EVENT_SIZE = struct.calcsize(INOTIFY_EVENT_FORMAT)
+READ_BUFFER_SIZE = 65536
+
+LIBC = ctypes.CDLL(None, use_errno=True)
+
+
+class CgroupWatcher:
+    """
+    Watches a slice for scopes being created or removed, and every scope for
+    sub-cgroups being created or its files (cgroup.events on cgroup v2) being
+    modified. The callback runs in the watcher thread with the scope name and
+    must not block.
+    """
+    def __init__(self):
+        self.inotify_fd = -1
+        self.slice_path = None
+        self.slice_wd = -1
+        self.scope_of_wd = {}
+        self.callback = None
+
+    def __add_watch(self, path, mask):
+        wd = LIBC.inotify_add_watch(self.inotify_fd, path.encode(), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "inotify_add_watch %s: %s" % (path, os.strerror(error)))
+        return wd
+
+    def __watch_scope(self, scope_name):
+        try:
+            wd = self.__add_watch(os.path.join(self.slice_path, scope_name), IN_CREATE | IN_MODIFY | IN_ONLYDIR)
+        except FileNotFoundError:
+            return
+        self.scope_of_wd[wd] = scope_name
+
+    def start_watcher(self, slice_path, callback):
+        self.inotify_fd = LIBC.inotify_init1(IN_CLOEXEC)
+        if self.inotify_fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "inotify_init1: %s" % os.strerror(error))
+        self.slice_path = slice_path
+        self.callback = callback
+        self.slice_wd = self.__add_watch(slice_path, IN_CREATE | IN_DELETE | IN_ONLYDIR)
+        with os.scandir(slice_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    self.__watch_scope(entry.name)
+
+        watcher_thread = threading.Thread(target=self.__run_watcher, name="cgroupWatcher", daemon=True)
+        watcher_thread.start()
+        LOGGER.info("Cgroup watcher started on %s" % slice_path)
+
+    def __run_watcher(self):
+        while True:
+            events = os.read(self.inotify_fd, READ_BUFFER_SIZE)
+            offset = 0
+            while offset < len(events):
+                wd, mask, _, name_len = struct.unpack_from(INOTIFY_EVENT_FORMAT, events, offset)
+                name = events[offset + INOTIFY_EVENT_SIZE:offset + INOTIFY_EVENT_SIZE + name_len].rstrip(b"\0")
+                offset += INOTIFY_EVENT_SIZE + name_len
+                self.__handle_event(wd, mask, name.decode())
+
+    def __handle_event(self, wd, mask, name):
+        if wd == self.slice_wd:
+            if not mask & IN_ISDIR:
+                return
+            if mask & IN_CREATE:
+                self.__watch_scope(name)
+                self.callback(name)
+            return
+        if mask & IN_IGNORED:
+            # The scope was removed and its watch with it.
+            self.scope_of_wd.pop(wd, None)
+            return
+        scope_name = self.scope_of_wd.get(wd)
+        if scope_name is not None:
+            self.callback(scope_name)
@@ -0,0 +1,84 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for collecting the CFS throttling statistics of low priority VMs
+"""
+# @code
+
+import os
+
+from cgroupio import CGROUP_IO
+from logger import LOGGER
+
+LOW_VMS_CPU_CGRP_PATH = "/sys/fs/cgroup/cpu/low_prio_machine.slice"
+USEC_TO_NSEC = 1000
+
+
+class CpuStatData:
+    def __init__(self):
+        self.nr_periods = 0
+        self.nr_throttled = 0
+        self.throttled_time = 0
+        self.delta_periods = 0
+        self.delta_throttled = 0
+        self.delta_throttled_time = 0
+
+    @property
+    def throttled_ratio(self):
+        """Ratio of the CFS periods in the last tick in which the VM was throttled."""
+        return self.delta_throttled / self.delta_periods if self.delta_periods else 0
+
+    def update(self, nr_periods, nr_throttled, throttled_time):
+        self.delta_periods = nr_periods - self.nr_periods
+        self.delta_throttled = nr_throttled - self.nr_throttled
+        self.delta_throttled_time = throttled_time - self.throttled_time
+        self.nr_periods = nr_periods
+        self.nr_throttled = nr_throttled
+        self.throttled_time = throttled_time
+
+
+class CpuStatCollector:
+    """
+    Reads cpu.stat of every low priority VM scope each tick, the deltas tell
+    whether the quota written by CpuController throttled the VM at all.
+    """
+    @staticmethod
+    def __read_cpu_stat(domain):
+        stat_dict = {}
+        cpu_stat = CGROUP_IO.read(os.path.join(LOW_VMS_CPU_CGRP_PATH, domain.cgroup_name, "cpu.stat"))
+        for line in cpu_stat.splitlines():
+            key, _, value = line.partition(" ")
+            stat_dict[key] = int(value)
+        throttled_time = stat_dict.get("throttled_time")
+        if throttled_time is None:
+            # cgroup v2 accounts the throttled time in microseconds.
+            throttled_time = stat_dict.get("throttled_usec", 0) * USEC_TO_NSEC
+        return stat_dict.get("nr_periods", 0), stat_dict.get("nr_throttled", 0), throttled_time
+
+    def update_cpu_stat(self, guest_info):
+        for domain in guest_info.low_prio_vm_dict.values():
+            if domain.cgroup_name is None:
+                continue
+            try:
+                nr_periods, nr_throttled, throttled_time = self.__read_cpu_stat(domain)
+            except OSError as error:
+                # The domain may be stopping, the next tick removes it.
+                LOGGER.debug("Failed to read cpu.stat of domain %s(%d): %s"
+                             % (domain.domain_name, domain.domain_id, str(error)))
+                continue
+            if domain.cpu_stat is None:
+                domain.cpu_stat = CpuStatData()
+                # The first sample is the baseline, its deltas are 0.
+                domain.cpu_stat.update(nr_periods, nr_throttled, throttled_time)
+            domain.cpu_stat.update(nr_periods, nr_throttled, throttled_time)
@@ -16,23 +16,74 @@ Description: This file is used for providing a data collector.
 """
 # @code
 
+import atexit
+
+import data_collector.cpustat as cpustat
 import data_collector.hostinfo as hostinfo
 import data_collector.guestinfo as guestinfo
+import data_collector.poweraccount as poweraccount
+import data_collector.psicollector as psicollector
+import data_collector.resctrlmonitor as resctrlmonitor
+import data_collector.rundelay as rundelay
+import data_collector.vmmongroup as vmmongroup
+import data_collector.vmperfcollector as vmperfcollector
 
 
 class DataCollector:
     def __init__(self):
         self.host_info = hostinfo.HostInfo()
         self.guest_info = guestinfo.GuestInfo()
+        self.power_account = poweraccount.PowerAccount()
+        self.resctrl_monitor = resctrlmonitor.ResctrlMonitor()
+        self.vm_mon_groups = vmmongroup.VmMonGroups()
+        self.cpu_stat_collector = cpustat.CpuStatCollector()
+        self.psi_collector = psicollector.PsiCollector()
+        self.run_delay_collector = rundelay.RunDelayCollector()
+        self.vm_perf_collector = vmperfcollector.VmPerfCollector()
 
     def set_static_base_info(self):
         self.host_info.set_host_base_attribute()
+        self.guest_info.set_stats_collector(self.host_info.host_topo)
+        self.guest_info.set_usage_history(self.host_info.host_topo)
+        atexit.register(self.resctrl_monitor.close_resctrl_monitor)
+        self.resctrl_monitor.init_resctrl_monitor()
+        self.vm_mon_groups.init_vm_mon_groups(self.resctrl_monitor)
+        atexit.register(self.psi_collector.close_psi_triggers)
+        atexit.register(self.run_delay_collector.close_run_delay_collector)
+        atexit.register(self.vm_perf_collector.close_vm_perf_collector)
+        self.vm_perf_collector.init_vm_perf_collector(self.host_info.host_topo)
+        self.psi_collector.init_psi_collector()
 
     def set_static_power_info(self):
         self.host_info.set_host_power_attribute()
+        atexit.register(self.power_account.close_energy_counters)
+        self.power_account.set_energy_counters(self.host_info)
+
+    def register_domain_events(self, vir_conn):
+        self.guest_info.inventory.register_domain_events(vir_conn)
+
+    def deregister_domain_events(self, vir_conn):
+        self.guest_info.inventory.deregister_domain_events(vir_conn)
 
     def update_base_info(self, vir_conn):
         self.guest_info.update_guest_info(vir_conn, self.host_info.host_topo)
 
     def update_power_info(self):
         self.host_info.update_host_power_info()
+        self.cpu_stat_collector.update_cpu_stat(self.guest_info)
+
+    def sample_power_info(self):
+        self.power_account.sample_power()
+
+    def update_run_delay_info(self):
+        self.run_delay_collector.update_run_delay(self.guest_info)
+
+    def update_vm_perf_info(self):
+        self.vm_perf_collector.update_vm_perf(self.guest_info)
+
+    def update_psi_info(self):
+        self.psi_collector.update_psi(self.guest_info)
+
+    def update_resctrl_monitor_info(self):
+        self.resctrl_monitor.update_mon_data()
+        self.vm_mon_groups.sync_vm_mon_groups(self.guest_info, self.resctrl_monitor)
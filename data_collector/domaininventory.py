@@ -0,0 +1,110 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for tracking active VMs by libvirt lifecycle events
+"""
+# @code
+
+import collections
+import threading
+import time
+
+import libvirt
+
+from logger import LOGGER
+
+DOMAIN_RECONCILE_INTERVAL_S = 60
+# Events pile up when no job consumes them, e.g. with only resctrl management
+# enabled. Older events are dropped beyond this, and the next consumer reconciles.
+DOMAIN_EVENT_QUEUE_LEN = 1024
+DOMAIN_EVENT_START = "start"
+DOMAIN_EVENT_DEFINE = "define"
+DOMAIN_EVENT_STOP = "stop"
+
+
+def start_event_loop():
+    """Must be called before the libvirt connection is opened."""
+    def run_event_loop():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    libvirt.virEventRegisterDefaultImpl()
+    event_thread = threading.Thread(target=run_event_loop, name="libvirtEventLoop", daemon=True)
+    event_thread.start()
+    LOGGER.info("Libvirt event loop started.")
+
+
+class DomainInventory:
+    def __init__(self):
+        self.event_queue = collections.deque(maxlen=DOMAIN_EVENT_QUEUE_LEN)
+        self.event_dropped = False
+        self.callback_id = None
+        # The first update always lists all domains, however soon after boot it runs.
+        self.last_reconcile_time = None
+        self.reconcile_interval = 0
+        self.start_listener_list = []
+
+    def register_domain_events(self, conn):
+        try:
+            self.callback_id = conn.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                                           self.__lifecycle_callback, None)
+        except libvirt.libvirtError as error:
+            LOGGER.warning("Failed to register domain lifecycle events, fall back to full listing: %s"
+                           % str(error))
+            return
+        self.reconcile_interval = DOMAIN_RECONCILE_INTERVAL_S
+        LOGGER.info("Domain lifecycle events registered, reconcile interval is %ds" % self.reconcile_interval)
+
+    def deregister_domain_events(self, conn):
+        if self.callback_id is None:
+            return
+        try:
+            conn.domainEventDeregisterAny(self.callback_id)
+        except libvirt.libvirtError as error:
+            LOGGER.warning("Failed to deregister domain lifecycle events: %s" % str(error))
+        self.callback_id = None
+
+    def add_start_listener(self, listener):
+        """The listener is called with the domain in the libvirt event loop thread and must not block."""
+        self.start_listener_list.append(listener)
+
+    def __queue_event(self, event, domain):
+        if len(self.event_queue) == self.event_queue.maxlen:
+            self.event_dropped = True
+        self.event_queue.append((event, domain.UUIDString(), domain))
+
+    def __lifecycle_callback(self, conn, domain, event, detail, opaque):
+        # Runs in the libvirt event loop thread, only queue the event here.
+        if event == libvirt.VIR_DOMAIN_EVENT_STARTED:
+            self.__queue_event(DOMAIN_EVENT_START, domain)
+            for listener in self.start_listener_list:
+                listener(domain)
+        elif event == libvirt.VIR_DOMAIN_EVENT_DEFINED:
+            self.__queue_event(DOMAIN_EVENT_DEFINE, domain)
+        elif event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+            self.__queue_event(DOMAIN_EVENT_STOP, domain)
+
+    def need_reconcile(self):
+        if not self.event_dropped and self.last_reconcile_time is not None and \
+                time.monotonic() - self.last_reconcile_time < self.reconcile_interval:
+            return False
+        if self.event_dropped:
+            LOGGER.warning("Domain events were dropped, reconcile with the full listing.")
+        self.event_dropped = False
+        self.last_reconcile_time = time.monotonic()
+        return True
+
+    def pop_events(self):
+        while self.event_queue:
+            yield self.event_queue.popleft()
@@ -15,6 +15,9 @@
 
 #ifdef __x86_64__
 
+#define _GNU_SOURCE
+#include <pthread.h>
+#include <sched.h>
 #include <unistd.h>
 #include <stdio.h>
 #include <stdlib.h>
@@ -23,6 +26,7 @@
 
 #define MSR_IA32_MPERF      0x000000e7
 #define MSR_IA32_APERF      0x000000e8
+#define MSR_PKG_ENERGY_STATUS   0x00000611
 #define Genu                0x756e6547
 #define inel                0x6c65746e
 #define inte                0x49656e69
@@ -34,6 +38,11 @@ typedef struct StructPerf {
     unsigned long long mperf;
 } StructPerf, *StructPerfPointer;
 
+typedef struct StructCpuSample {
+    unsigned long long aperf;
+    unsigned long long mperf;
+} StructCpuSample, *StructCpuSamplePointer;
+
 static inline void cpuid(unsigned int *eax, unsigned int *ebx,
                          unsigned int *ecx, unsigned int *edx)
 {
@@ -149,7 +158,7 @@ int get_msr(int cpu, long offset, unsigned long long *msr)
     return 0;
 }
 
-int get_cpu_status_data(int cpu, StructPerfPointer p)
+static int read_aperf_mperf(int cpu, unsigned long long *aperf, unsigned long long *mperf)
 {
     unsigned long long tsc_before, tsc_between, tsc_after, aperf_time, mperf_time;
     int aperf_mperf_retry_count = 0;
@@ -157,15 +166,15 @@ int get_cpu_status_data(int cpu, StructPerfPointer p)
     int timeout_times = 2;
 
     while (aperf_mperf_retry_count < retry_max_count) {
-        if (get_msr(cpu, MSR_IA32_APERF, &p->aperf)) {
+        if (get_msr(cpu, MSR_IA32_APERF, aperf)) {
             return -1;
         }
         tsc_before = rdtsc();
-        if (get_msr(cpu, MSR_IA32_APERF, &p->aperf)) {
+        if (get_msr(cpu, MSR_IA32_APERF, aperf)) {
             return -1;
         }
         tsc_between = rdtsc();
-        if (get_msr(cpu, MSR_IA32_MPERF, &p->mperf)) {
+        if (get_msr(cpu, MSR_IA32_MPERF, mperf)) {
             return -1;
         }
         tsc_after = rdtsc();
@@ -181,4 +190,209 @@ int get_cpu_status_data(int cpu, StructPerfPointer p)
     return -2; /* -2 denotes timeout error. */
 }
 
+int get_cpu_status_data(int cpu, StructPerfPointer p)
+{
+    return read_aperf_mperf(cpu, &p->aperf, &p->mperf);
+}
+
+static int sample_cpu_range(int first_cpu, int last_cpu, StructCpuSamplePointer samples, int *err_cpu)
+{
+    int cpu, ret;
+
+    for (cpu = first_cpu; cpu < last_cpu; cpu++) {
+        ret = read_aperf_mperf(cpu, &samples[cpu].aperf, &samples[cpu].mperf);
+        if (!ret && (samples[cpu].aperf == 0 || samples[cpu].mperf == 0)) {
+            ret = -1;
+        }
+        if (ret) {
+            *err_cpu = cpu;
+            return ret;
+        }
+    }
+    return 0;
+}
+
+static int read_package_energy(int package_num, const int *package_cpus, unsigned long long *energy,
+                               int *err_cpu)
+{
+    int i;
+
+    for (i = 0; i < package_num; i++) {
+        if (get_msr(package_cpus[i], MSR_PKG_ENERGY_STATUS, &energy[i])) {
+            *err_cpu = package_cpus[i];
+            return -1;
+        }
+    }
+    return 0;
+}
+
+/*
+ * Sample aperf/mperf of cpus [0, cpu_num) into samples and the package
+ * energy status read on package_cpus[i] into energy[i] in one call. On
+ * failure the failed cpu is stored in err_cpu.
+ */
+int get_all_status_data(int cpu_num, StructCpuSamplePointer samples, int package_num,
+                        const int *package_cpus, unsigned long long *energy, int *err_cpu)
+{
+    int ret;
+
+    ret = sample_cpu_range(0, cpu_num, samples, err_cpu);
+    if (ret) {
+        return ret;
+    }
+    return read_package_energy(package_num, package_cpus, energy, err_cpu);
+}
+
+/*
+ * A small pool of sampling workers, each one covers a contiguous range of
+ * cpus and is pinned to that range, so all cpus are sampled at nearly the
+ * same time and the IPIs of remote msr reads stay close to the worker.
+ */
+typedef struct SamplingWorker {
+    pthread_t thread;
+    int first_cpu;
+    int last_cpu;
+    int ret;
+    int err_cpu;
+} SamplingWorker;
+
+static SamplingWorker *sampling_workers;
+static int sampling_worker_num;
+static pthread_mutex_t sampling_lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t sampling_start_cond = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t sampling_done_cond = PTHREAD_COND_INITIALIZER;
+static unsigned long sampling_generation;
+static int sampling_pending;
+static int sampling_stop;
+static StructCpuSamplePointer sampling_samples;
+
+static void *sampling_worker_main(void *arg)
+{
+    SamplingWorker *worker = arg;
+    StructCpuSamplePointer samples;
+    unsigned long generation = 0;
+    cpu_set_t mask;
+    int cpu;
+
+    CPU_ZERO(&mask);
+    for (cpu = worker->first_cpu; cpu < worker->last_cpu; cpu++) {
+        CPU_SET(cpu, &mask);
+    }
+    pthread_setaffinity_np(pthread_self(), sizeof(mask), &mask);
+
+    pthread_mutex_lock(&sampling_lock);
+    while (1) {
+        while (generation == sampling_generation && !sampling_stop) {
+            pthread_cond_wait(&sampling_start_cond, &sampling_lock);
+        }
+        if (sampling_stop) {
+            break;
+        }
+        generation = sampling_generation;
+        samples = sampling_samples;
+        pthread_mutex_unlock(&sampling_lock);
+
+        worker->ret = sample_cpu_range(worker->first_cpu, worker->last_cpu, samples, &worker->err_cpu);
+
+        pthread_mutex_lock(&sampling_lock);
+        if (--sampling_pending == 0) {
+            pthread_cond_signal(&sampling_done_cond);
+        }
+    }
+    pthread_mutex_unlock(&sampling_lock);
+    return NULL;
+}
+
+void stop_sampling_workers(void)
+{
+    int i;
+
+    if (sampling_workers == NULL) {
+        return;
+    }
+
+    pthread_mutex_lock(&sampling_lock);
+    sampling_stop = 1;
+    pthread_cond_broadcast(&sampling_start_cond);
+    pthread_mutex_unlock(&sampling_lock);
+    for (i = 0; i < sampling_worker_num; i++) {
+        pthread_join(sampling_workers[i].thread, NULL);
+    }
+
+    free(sampling_workers);
+    sampling_workers = NULL;
+    sampling_worker_num = 0;
+    sampling_stop = 0;
+}
+
+int start_sampling_workers(int cpu_num, int worker_num)
+{
+    int i, cpus_per_worker;
+
+    if (cpu_num <= 0 || worker_num <= 0 || sampling_workers != NULL) {
+        return -1;
+    }
+    if (worker_num > cpu_num) {
+        worker_num = cpu_num;
+    }
+
+    sampling_workers = calloc(worker_num, sizeof(SamplingWorker));
+    if (sampling_workers == NULL) {
+        return -1;
+    }
+
+    cpus_per_worker = (cpu_num + worker_num - 1) / worker_num;
+    for (i = 0; i < worker_num; i++) {
+        sampling_workers[i].first_cpu = i * cpus_per_worker;
+        sampling_workers[i].last_cpu = (i + 1) * cpus_per_worker < cpu_num ? (i + 1) * cpus_per_worker : cpu_num;
+        if (sampling_workers[i].first_cpu >= cpu_num) {
+            break;
+        }
+        if (pthread_create(&sampling_workers[i].thread, NULL, sampling_worker_main, &sampling_workers[i])) {
+            break;
+        }
+        sampling_worker_num++;
+    }
+
+    if (sampling_worker_num == 0) {
+        free(sampling_workers);
+        sampling_workers = NULL;
+        return -1;
+    }
+    if (sampling_workers[sampling_worker_num - 1].last_cpu != cpu_num) {
+        stop_sampling_workers();
+        return -1;
+    }
+    return 0;
+}
+
+/* Same as get_all_status_data, but the cpus are sampled by the worker pool. */
+int get_all_status_data_parallel(int cpu_num, StructCpuSamplePointer samples, int package_num,
+                                 const int *package_cpus, unsigned long long *energy, int *err_cpu)
+{
+    int i;
+
+    if (sampling_workers == NULL || sampling_workers[sampling_worker_num - 1].last_cpu != cpu_num) {
+        return get_all_status_data(cpu_num, samples, package_num, package_cpus, energy, err_cpu);
+    }
+
+    pthread_mutex_lock(&sampling_lock);
+    sampling_samples = samples;
+    sampling_pending = sampling_worker_num;
+    sampling_generation++;
+    pthread_cond_broadcast(&sampling_start_cond);
+    while (sampling_pending) {
+        pthread_cond_wait(&sampling_done_cond, &sampling_lock);
+    }
+    pthread_mutex_unlock(&sampling_lock);
+
+    for (i = 0; i < sampling_worker_num; i++) {
+        if (sampling_workers[i].ret) {
+            *err_cpu = sampling_workers[i].err_cpu;
+            return sampling_workers[i].ret;
+        }
+    }
+    return read_package_energy(package_num, package_cpus, energy, err_cpu);
+}
+
 #endif /* __x86_64__ */
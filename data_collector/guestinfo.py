@@ -16,12 +16,21 @@ Description: This file is used for setting and updating of VMs info
 """
 # @code
 
+from array import array
+import errno
+import operator
 import re
 import time
 import os
 
 import libvirt
 
+from cgroupio import CGROUP_IO
+from data_collector.cgroupusage import CgroupUsageReader, CGRP_ROOT_PATH, CGRP_V2_CONTROLLERS_PATH
+from data_collector.domaininventory import DomainInventory, DOMAIN_EVENT_DEFINE, \
+    DOMAIN_EVENT_START, DOMAIN_EVENT_STOP
+from data_collector.usagehistory import UsageHistory
+from data_collector.usagematrix import UsageMatrix
 from logger import LOGGER
 
 DEFAULT_PRIORITY = "machine"
@@ -29,26 +38,72 @@ HIGH_PRIORITY = "high_prio_machine"
 LOW_PRIORITY = "low_prio_machine"
 PIDS_CGRP_PATH = "/sys/fs/cgroup/pids"
 DOMAIN_STOP_MSG = "domain is not running"
+STATS_COLLECTOR_LIBVIRT = "libvirt"
+STATS_COLLECTOR_BULK = "bulk"
+STATS_COLLECTOR_CGROUPFS = "cgroupfs"
+# In bulk mode the per-CPU usage split is refreshed per domain every N ticks
+BULK_PERCPU_REFRESH_TICKS = 10
+USAGE_STATISTIC_INSTANT = "instant"
+USAGE_STATISTIC_EWMA = "ewma"
+USAGE_STATISTIC_P95 = "p95"
 
 
 class DomainInfo:
-    def __init__(self):
+    def __init__(self, usage_matrix):
         self.domain_id = 0
         self.domain_name = 0
+        self.domain_uuid = None
         self.domain_usage = 0
         self.running_time = []
         self.priority = 0
-        self.cpu_usage = []
+        self.usage_matrix = usage_matrix
+        self.matrix_row = None
         self.package_usage_dict = {}
         self.last_update_time = 0
+        self.last_percpu_update_time = 0
+        self.total_running_time = 0
+        self.cpu_share = None
         self.global_quota_config = 0
+        self.cgroup_slice = None
         self.cgroup_name = None
+        self.mbm_bandwidth = 0
+        self.cpu_stat = None
+        self.run_delay = 0
+        self.cpi = 0
+        self.llc_miss_rate = 0
+
+    @property
+    def cpu_usage(self):
+        return self.usage_matrix.get_row(self.matrix_row)
 
-    def set_domain_attribute(self, domain, host_topo):
+    def __fit_cpu_nums(self, running_time_list):
+        cpu_nums = self.usage_matrix.cpu_nums
+        return (list(running_time_list) + [0] * cpu_nums)[:cpu_nums]
+
+    def set_domain_attribute(self, domain, host_topo, cgroup_usage_reader=None):
         self.domain_name = domain.name()
         self.domain_id = int(domain.ID())
+        self.domain_uuid = domain.UUIDString()
+        for package in host_topo.package_set:
+            self.package_usage_dict[package] = 0
+
+        ret = self.parse_domain_xml(domain)
+        if ret < 0:
+            return ret
 
-        quota_parameter = re.search("<global_quota>(.*)</global_quota>", domain.XMLDesc())
+        self.last_update_time = time.time_ns()
+        if cgroup_usage_reader is not None:
+            self.running_time = cgroup_usage_reader.get_percpu_time(self)
+        else:
+            self.running_time = [cpu.get('cpu_time') for cpu in domain.getCPUStats(total=False)]
+        self.running_time = self.__fit_cpu_nums(self.running_time)
+        self.total_running_time = sum(self.running_time)
+        self.last_percpu_update_time = self.last_update_time
+        return 0
+
+    def parse_domain_xml(self, domain):
+        domain_xml = domain.XMLDesc()
+        quota_parameter = re.search("<global_quota>(.*)</global_quota>", domain_xml)
         if quota_parameter:
             self.global_quota_config = int(quota_parameter.groups()[0])
         else:
@@ -56,17 +111,8 @@ class DomainInfo:
         LOGGER.debug("Domain %s(%d) global quota setting is %d"
                      % (self.domain_name, self.domain_id, self.global_quota_config))
 
-        self.last_update_time = time.time_ns()
-        domain_running_time_list = domain.getCPUStats(total=False)
-
-        for cpu in domain_running_time_list:
-            self.running_time.append(cpu.get('cpu_time'))
-            self.cpu_usage.append(0)
-        for package in host_topo.package_set:
-            self.package_usage_dict[package] = 0
-
-        priority_info = re.search("<partition>/(.*)</partition>", domain.XMLDesc())
-        if not priority_info.groups() or len(priority_info.groups()) != 1:
+        priority_info = re.search("<partition>/(.*)</partition>", domain_xml)
+        if not priority_info or len(priority_info.groups()) != 1:
             LOGGER.error("Cgroup setting (%s) in XML is wrong!" % priority_info)
             return -1
         if priority_info.groups()[0] == HIGH_PRIORITY or \
@@ -78,7 +124,11 @@ class DomainInfo:
             LOGGER.error("Domain %s(%d) priority setting (%s) is wrong!"
                          % (self.domain_name, self.domain_id, priority_info.groups()[0]))
             return -1
-        vms_cgrp_path = os.path.join(PIDS_CGRP_PATH, priority_info.groups()[0] + ".slice")
+        self.cgroup_slice = priority_info.groups()[0] + ".slice"
+        if os.access(CGRP_V2_CONTROLLERS_PATH, os.R_OK):
+            vms_cgrp_path = os.path.join(CGRP_ROOT_PATH, self.cgroup_slice)
+        else:
+            vms_cgrp_path = os.path.join(PIDS_CGRP_PATH, self.cgroup_slice)
         for subpath in os.listdir(vms_cgrp_path):
             if "machine-qemu\\x2d%d\\x2d" % self.domain_id in subpath:
                 self.cgroup_name = subpath
@@ -94,23 +144,53 @@ class DomainInfo:
     def update_domain_info(self, domain, host_topo):
         current_time = time.time_ns()
         domain_running_time_list = domain.getCPUStats(total=False)
+        return self.update_percpu_time([cpu.get("cpu_time") for cpu in domain_running_time_list],
+                                       current_time, host_topo)
 
-        domain_usage = 0
-        for package in self.package_usage_dict:
-            self.package_usage_dict[package] = 0
+    def update_percpu_time(self, running_time_list, current_time, host_topo, spread=False):
+        """spread means running_time_list is the total time spread evenly, e.g. by cgroup v2."""
+        update_interval = current_time - self.last_percpu_update_time
+        running_time_list = self.__fit_cpu_nums(running_time_list)
+        if update_interval != 0:
+            self.usage_matrix.write_row(self.matrix_row,
+                                        map((1 / update_interval).__mul__,
+                                            map(operator.sub, running_time_list, self.running_time)))
+        else:
+            self.usage_matrix.scale_row(self.matrix_row, 0.0)
+        self.usage_matrix.set_spread(self.matrix_row, spread)
+        self.package_usage_dict = self.usage_matrix.get_package_usage(self.matrix_row)
+
+        self.domain_usage = sum(self.package_usage_dict.values())
+        # An idle sample says nothing about where the domain runs, keep the last split
+        if self.domain_usage > 0:
+            self.cpu_share = array('d', map((1 / self.domain_usage).__mul__, self.cpu_usage))
+        self.running_time = running_time_list
+        self.total_running_time = sum(running_time_list)
+        self.last_update_time = current_time
+        self.last_percpu_update_time = current_time
+        LOGGER.debug("Domain %s(%d) usage is %.2f, update time is %d"
+                     % (self.domain_name, self.domain_id, self.domain_usage, current_time))
+        return 0
+
+    def update_total_time(self, total_running_time, current_time):
+        """
+        Only the total cpu time is known, so spread the usage over CPUs by the
+        split of the latest busy per-CPU sample, or evenly before there is one.
+        """
+        update_interval = current_time - self.last_update_time
+        if update_interval != 0:
+            domain_usage = (total_running_time - self.total_running_time) / update_interval
+        else:
+            domain_usage = 0
+        if self.cpu_share is None:
+            self.cpu_share = array('d', [1 / self.usage_matrix.cpu_nums]) * self.usage_matrix.cpu_nums
+            self.usage_matrix.set_spread(self.matrix_row, True)
 
-        for cpu in range(len(domain_running_time_list)):
-            if (current_time - self.last_update_time) != 0:
-                self.cpu_usage[cpu] = (domain_running_time_list[cpu].get("cpu_time") -
-                                       self.running_time[cpu]) / (current_time - self.last_update_time)
-            else:
-                self.cpu_usage[cpu] = 0
-            domain_usage += self.cpu_usage[cpu]
-            self.running_time[cpu] = domain_running_time_list[cpu].get("cpu_time")
-            package = host_topo.cpu_topo_list[cpu]
-            self.package_usage_dict[package] += self.cpu_usage[cpu]
+        self.usage_matrix.write_row(self.matrix_row, map(float(domain_usage).__mul__, self.cpu_share))
+        self.package_usage_dict = self.usage_matrix.get_package_usage(self.matrix_row)
 
         self.domain_usage = domain_usage
+        self.total_running_time = total_running_time
         self.last_update_time = current_time
         LOGGER.debug("Domain %s(%d) usage is %.2f, update time is %d"
                      % (self.domain_name, self.domain_id, self.domain_usage, current_time))
@@ -122,56 +202,219 @@ class GuestInfo:
         self.vm_dict = {}
         self.low_prio_vm_dict = {}
         self.vm_online_dict = {}
-        self.domain_online = []
-        self.running_domain_in_cpus = []
+        self.vm_uuid_dict = {}
+        self.new_vm_set = set()
+        self.usage_matrix = UsageMatrix()
+        self.usage_history = UsageHistory()
+        self.usage_statistic = USAGE_STATISTIC_INSTANT
+        self.inventory = DomainInventory()
+        self.stats_collector = STATS_COLLECTOR_LIBVIRT
+        self.stats_tick = 0
+        self.cgroup_usage_reader = None
+
+    def set_stats_collector(self, host_topo):
+        self.stats_collector = os.getenv("GUEST_STATS_COLLECTOR", STATS_COLLECTOR_LIBVIRT).lower()
+        if self.stats_collector not in (STATS_COLLECTOR_LIBVIRT, STATS_COLLECTOR_BULK, STATS_COLLECTOR_CGROUPFS):
+            LOGGER.error("Configuration for GUEST_STATS_COLLECTOR is unknown.")
+            raise ValueError
+        if self.stats_collector == STATS_COLLECTOR_CGROUPFS:
+            self.cgroup_usage_reader = CgroupUsageReader(host_topo.max_cpu_nums)
+        self.usage_matrix.set_cpu_topo(host_topo)
+        LOGGER.info("Guest stats collector is %s" % self.stats_collector)
+
+    def set_usage_history(self, host_topo):
+        self.usage_statistic = os.getenv("USAGE_STATISTIC", USAGE_STATISTIC_INSTANT).lower()
+        if self.usage_statistic not in (USAGE_STATISTIC_INSTANT, USAGE_STATISTIC_EWMA, USAGE_STATISTIC_P95):
+            LOGGER.error("Configuration for USAGE_STATISTIC is unknown.")
+            raise ValueError
+        try:
+            history_window = int(os.getenv("USAGE_HISTORY_WINDOW", "30"))
+            ewma_alpha = float(os.getenv("USAGE_EWMA_ALPHA", "0.3"))
+        except ValueError:
+            LOGGER.error("USAGE_HISTORY_WINDOW or USAGE_EWMA_ALPHA parameter type is invalid.")
+            raise
+        if not 10 <= history_window <= 300 or not 0 < ewma_alpha <= 1:
+            LOGGER.error("USAGE_HISTORY_WINDOW or USAGE_EWMA_ALPHA parameter is invalid.")
+            raise ValueError
+        self.usage_history.set_history_attribute(host_topo.package_set, history_window, ewma_alpha)
+        LOGGER.info("Usage statistic is %s, history window is %d, ewma alpha is %.2f"
+                    % (self.usage_statistic, history_window, ewma_alpha))
+
+    def get_domain_usage(self, domain_id, package=None):
+        """Return the usage of a domain, or of a domain on a package, by the configured statistic."""
+        domain = self.vm_dict.get(domain_id)
+        if package is None:
+            domain_usage = domain.domain_usage
+        else:
+            domain_usage = domain.package_usage_dict.get(package, 0)
+        if self.usage_statistic == USAGE_STATISTIC_EWMA:
+            history_usage = self.usage_history.get_ewma(domain_id, package)
+        elif self.usage_statistic == USAGE_STATISTIC_P95:
+            history_usage = self.usage_history.get_percentile(domain_id, package)
+        else:
+            history_usage = None
+        return domain_usage if history_usage is None else history_usage
 
     def update_guest_info(self, conn, host_topo):
-        self.running_domain_in_cpus.clear()
-        self.vm_online_dict.clear()
-        self.domain_online.clear()
-        self.low_prio_vm_dict.clear()
+        self.new_vm_set.clear()
+        self.__handle_domain_events(host_topo)
+        if self.inventory.need_reconcile():
+            self.__reconcile_domains(conn, host_topo)
 
-        for cpu in range(host_topo.max_cpu_nums):
-            self.running_domain_in_cpus.append([])
+        bulk_time_dict = None
+        if self.stats_collector == STATS_COLLECTOR_BULK and self.stats_tick % BULK_PERCPU_REFRESH_TICKS:
+            bulk_time_dict = self.__get_bulk_cpu_time(conn)
+        self.stats_tick += 1
 
-        self.get_all_active_domain(conn)
-        for dom in self.domain_online:
-            self.vm_online_dict[dom.ID()] = dom
-        # Remove ever see but now stopped domains
         for vm_id in list(self.vm_dict):
-            if vm_id not in self.vm_online_dict:
-                del self.vm_dict[vm_id]
+            # The first sample of new domains is taken by set_domain_attribute
+            if vm_id not in self.new_vm_set:
+                try:
+                    ret = self.__update_domain(vm_id, bulk_time_dict, host_topo)
+                except libvirt.libvirtError as e:
+                    ret = -1
+                    # If domain doesn't stop, raise exception
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN and \
+                       DOMAIN_STOP_MSG not in e.get_error_message():
+                        raise
+                if ret < 0:
+                    self.__remove_domain(vm_id)
+                    continue
+                self.usage_history.record(vm_id, self.vm_dict.get(vm_id).domain_usage,
+                                          self.vm_dict.get(vm_id).package_usage_dict)
 
-        for vm_id in self.vm_online_dict:
+    def __update_domain(self, vm_id, bulk_time_dict, host_topo):
+        domain_info = self.vm_dict.get(vm_id)
+        if self.cgroup_usage_reader is not None:
             try:
-                if vm_id in self.vm_dict:
-                    ret = self.vm_dict.get(vm_id).update_domain_info(self.vm_online_dict.get(vm_id), host_topo)
-                else:
-                    self.vm_dict[vm_id] = DomainInfo()
-                    ret = self.vm_dict.get(vm_id).set_domain_attribute(self.vm_online_dict.get(vm_id), host_topo)
-            except libvirt.libvirtError as e:
-                ret = -1
-                # If domain doesn't stop, raise exception
-                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN and \
-                   DOMAIN_STOP_MSG not in e.get_error_message():
+                running_time_list = self.cgroup_usage_reader.get_percpu_time(domain_info)
+            except OSError as error:
+                # The scope is removed when the domain stops
+                if error.errno not in (errno.ENOENT, errno.ENODEV):
                     raise
-            if ret < 0:
-                del self.vm_dict[vm_id]
-                continue
-
-            if self.vm_dict.get(vm_id).priority == 1:
-                self.low_prio_vm_dict[vm_id] = self.vm_dict.get(vm_id)
-            for cpu in range(host_topo.max_cpu_nums):
-                self.running_domain_in_cpus[cpu].append((self.vm_dict.get(vm_id).cpu_usage[cpu],
-                                                         self.vm_dict.get(vm_id).domain_id,
-                                                         self.vm_dict.get(vm_id).domain_name,
-                                                         self.vm_dict.get(vm_id).priority))
-
-    def get_all_active_domain(self, conn):
+                return -1
+            return domain_info.update_percpu_time(running_time_list, time.time_ns(), host_topo,
+                                                  self.cgroup_usage_reader.cgroup_v2)
+        if bulk_time_dict is None:
+            return domain_info.update_domain_info(self.vm_online_dict.get(vm_id), host_topo)
+        # Active domains absent from the bulk result have stopped
+        if domain_info.domain_uuid not in bulk_time_dict:
+            return -1
+        total_running_time, current_time = bulk_time_dict.get(domain_info.domain_uuid)
+        return domain_info.update_total_time(total_running_time, current_time)
+
+    def __get_bulk_cpu_time(self, conn):
+        try:
+            domain_stats_list = conn.getAllDomainStats(stats=libvirt.VIR_DOMAIN_STATS_CPU_TOTAL,
+                                                       flags=libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+        except AttributeError:
+            domain_stats_list = None
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                raise
+            domain_stats_list = None
+        if domain_stats_list is None:
+            LOGGER.warning("Bulk domain stats is unavailable, fall back to per domain stats.")
+            self.stats_collector = STATS_COLLECTOR_LIBVIRT
+            return None
+
+        current_time = time.time_ns()
+        bulk_time_dict = {}
+        for domain, stats in domain_stats_list:
+            if "cpu.time" in stats:
+                bulk_time_dict[domain.UUIDString()] = (stats.get("cpu.time"), current_time)
+        return bulk_time_dict
+
+    def __handle_domain_events(self, host_topo):
+        for event, uuid, domain in self.inventory.pop_events():
+            vm_id = self.vm_uuid_dict.get(uuid)
+            if event == DOMAIN_EVENT_STOP:
+                if vm_id is not None:
+                    self.__remove_domain(vm_id)
+            elif event == DOMAIN_EVENT_START:
+                if vm_id is None:
+                    self.__add_domain(domain, host_topo)
+            elif event == DOMAIN_EVENT_DEFINE and vm_id is not None:
+                self.__refresh_domain(vm_id)
+
+    def __reconcile_domains(self, conn, host_topo):
+        domain_online = self.get_all_active_domain(conn)
+        online_uuid_set = set()
+        for dom in domain_online:
+            online_uuid_set.add(dom.UUIDString())
+            if dom.UUIDString() not in self.vm_uuid_dict:
+                self.__add_domain(dom, host_topo)
+        # Remove ever see but now stopped domains
+        for uuid in list(self.vm_uuid_dict):
+            if uuid not in online_uuid_set:
+                self.__remove_domain(self.vm_uuid_dict.get(uuid))
+
+    def __add_domain(self, domain, host_topo):
+        domain_info = DomainInfo(self.usage_matrix)
+        try:
+            ret = domain_info.set_domain_attribute(domain, host_topo, self.cgroup_usage_reader)
+        except libvirt.libvirtError as e:
+            ret = -1
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN and \
+               DOMAIN_STOP_MSG not in e.get_error_message():
+                raise
+        except FileNotFoundError:
+            ret = -1
+        if ret < 0:
+            return
+
+        vm_id = domain_info.domain_id
+        domain_info.matrix_row = self.usage_matrix.acquire_row(vm_id, domain_info.priority)
+        if self.cgroup_usage_reader is not None:
+            self.usage_matrix.set_spread(domain_info.matrix_row, self.cgroup_usage_reader.cgroup_v2)
+        self.vm_dict[vm_id] = domain_info
+        self.vm_online_dict[vm_id] = domain
+        self.vm_uuid_dict[domain_info.domain_uuid] = vm_id
+        self.new_vm_set.add(vm_id)
+        if domain_info.priority == 1:
+            self.low_prio_vm_dict[vm_id] = domain_info
+        LOGGER.debug("Domain %s(%d) is added" % (domain_info.domain_name, vm_id))
+
+    def __refresh_domain(self, vm_id):
+        domain_info = self.vm_dict.get(vm_id)
+        try:
+            ret = domain_info.parse_domain_xml(self.vm_online_dict.get(vm_id))
+        except libvirt.libvirtError as e:
+            ret = -1
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN and \
+               DOMAIN_STOP_MSG not in e.get_error_message():
+                raise
+        if ret < 0:
+            self.__remove_domain(vm_id)
+            return
+
+        self.usage_matrix.set_priority(domain_info.matrix_row, domain_info.priority)
+        if domain_info.priority == 1:
+            self.low_prio_vm_dict[vm_id] = domain_info
+        else:
+            self.low_prio_vm_dict.pop(vm_id, None)
+
+    def __remove_domain(self, vm_id):
+        domain_info = self.vm_dict.pop(vm_id, None)
+        self.low_prio_vm_dict.pop(vm_id, None)
+        self.vm_online_dict.pop(vm_id, None)
+        if domain_info is not None:
+            self.usage_matrix.release_row(vm_id)
+            self.usage_history.evict(vm_id)
+            self.vm_uuid_dict.pop(domain_info.domain_uuid, None)
+            if self.cgroup_usage_reader is not None:
+                self.cgroup_usage_reader.release(domain_info)
+            if domain_info.cgroup_name is not None:
+                CGROUP_IO.evict_scope(domain_info.cgroup_name)
+            LOGGER.debug("Domain %s(%d) is removed" % (domain_info.domain_name, vm_id))
+
+    @staticmethod
+    def get_all_active_domain(conn):
         try:
-            self.domain_online = conn.listAllDomains(flags=libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE)
+            domain_online = conn.listAllDomains(flags=libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE)
         except libvirt.libvirtError:
             LOGGER.error("Failed to get all active domain info")
             raise
         else:
-            LOGGER.info("Active domain number is %d" % len(self.domain_online))
+            LOGGER.info("Active domain number is %d" % len(domain_online))
+        return domain_online
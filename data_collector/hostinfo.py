@@ -16,9 +16,9 @@ Description: This file is used for setting and updating of host info
 """
 # @code
 
+from array import array
 import atexit
 import ctypes
-import copy
 import os
 import subprocess
 import re
@@ -27,6 +27,9 @@ import time
 from data_collector import intelfamily as intel
 from data_collector import msrlibrary
 from data_collector import msrindex as msr
+from data_collector import poweraccount
+from data_collector.powercapcollector import PowercapCollector
+from cgroupio import CGROUP_IO
 from logger import LOGGER
 import util
 
@@ -34,9 +37,19 @@ SECOND_TO_NANOSECOND = 1000000000
 WATT_TO_UWATT = 1000000
 INTEL_FAM6_ATOM_SILVERMONT = 0x37
 RESCTRLPATH = "/sys/fs/resctrl"
+NODE_PATH = "/sys/devices/system/node"
+POWER_COLLECTORS = ("msr", "powercap")
 
 
-class StructPointer(ctypes.Structure):
+def get_power_collector():
+    power_collector = os.getenv("POWER_COLLECTOR", "msr").lower()
+    if power_collector not in POWER_COLLECTORS:
+        LOGGER.error("POWER_COLLECTOR parameter is invalid.")
+        raise ValueError
+    return power_collector
+
+
+class StructCpuSample(ctypes.Structure):
     _fields_ = [("aperf", ctypes.c_ulonglong), ("mperf", ctypes.c_ulonglong)]
 
 
@@ -46,6 +59,14 @@ class HostTopology:
         self.max_cpu_nums = 0
         self.cpu_topo_list = []
         self.package_set = set()
+        self.first_core_in_package_list = []
+        self.package_first_cpu_dict = {}
+        self.package_cpus_dict = {}
+        self.cpu_siblings_list = []
+        self.smt_pair_cpus = array('i')
+        self.smt_pair_siblings = array('i')
+        self.numa_node_list = []
+        self.node_cpus_dict = {}
 
     @staticmethod
     def get_first_core_in_package(cpu):
@@ -56,6 +77,11 @@ class HostTopology:
     def __get_physical_package_id(cpu):
         return int(util.file_read("/sys/devices/system/cpu/cpu%d/topology/physical_package_id" % cpu))
 
+    @staticmethod
+    def __get_thread_siblings(cpu):
+        return tuple(util.parse_cpu_list(util.file_read("/sys/devices/system/cpu/cpu%d/topology/"
+                                                        "thread_siblings_list" % cpu)))
+
     def get_total_cpu(self):
         cpu_present = util.file_read("/sys/devices/system/cpu/present")
         self.max_cpu_nums = int(cpu_present.strip('\n').split('-')[1]) + 1
@@ -70,34 +96,45 @@ class HostTopology:
 
         self.max_package_nums = len(self.package_set)
 
-        LOGGER.info("Max package nums is %d" % self.max_package_nums)
+        self.first_core_in_package_list = [False] * self.max_cpu_nums
+        for cpu in range(self.max_cpu_nums):
+            if cpu == self.get_first_core_in_package(cpu):
+                self.first_core_in_package_list[cpu] = True
+                self.package_first_cpu_dict.setdefault(self.cpu_topo_list[cpu], cpu)
 
+        for cpu in range(self.max_cpu_nums):
+            self.package_cpus_dict.setdefault(self.cpu_topo_list[cpu], array('i')).append(cpu)
+        self.cpu_siblings_list = [self.__get_thread_siblings(cpu) for cpu in range(self.max_cpu_nums)]
+        # Every ordered (cpu, sibling) pair of SMT threads, as two parallel arrays.
+        for cpu, siblings in enumerate(self.cpu_siblings_list):
+            for sibling in siblings:
+                if sibling != cpu and sibling < self.max_cpu_nums:
+                    self.smt_pair_cpus.append(cpu)
+                    self.smt_pair_siblings.append(sibling)
+        self.__get_numa_topo()
 
-class CpuData:
-    def __init__(self, cpu_id, package_id):
-        self.cpu_id = cpu_id
-        self.package_id = package_id
-        self.aperf = 0
-        self.mperf = 0
-        self.curr_freq = 0
-        self.cpu_is_first_core_in_package = \
-            self.cpu_id == HostTopology.get_first_core_in_package(self.cpu_id)
-
-    def get_cpu_status_data(self, extern_lib, aperf_mperf_multiplier):
-        perf_data = StructPointer()
-        perf_data.aperf = 0
-        perf_data.mperf = 0
-
-        ret = extern_lib.get_cpu_status_data(self.cpu_id, ctypes.byref(perf_data))
-        if ret == -1 or perf_data.aperf == 0 or perf_data.mperf == 0:
-            LOGGER.error("CPU %d: msr aperf or mperf read failed!", self.cpu_id)
-            raise OSError
-        elif ret == -2:
-            LOGGER.error("CPU %d has jitter", self.cpu_id)
-            raise TimeoutError
-        else:
-            self.aperf = perf_data.aperf * aperf_mperf_multiplier
-            self.mperf = perf_data.mperf * aperf_mperf_multiplier
+        LOGGER.info("Max package nums is %d" % self.max_package_nums)
+        LOGGER.info("NUMA node cpus are %s" % {node: util.format_cpu_list(cpus)
+                                                for node, cpus in self.node_cpus_dict.items()})
+
+    def __get_numa_topo(self):
+        self.numa_node_list = [0] * self.max_cpu_nums
+        node_list = []
+        if os.path.isdir(NODE_PATH):
+            node_list = [int(entry[len("node"):]) for entry in os.listdir(NODE_PATH)
+                         if entry.startswith("node") and entry[len("node"):].isdigit()]
+        if not node_list:
+            self.node_cpus_dict[0] = array('i', range(self.max_cpu_nums))
+            return
+
+        for node in sorted(node_list):
+            cpus = array('i', [cpu for cpu in util.parse_cpu_list(
+                util.file_read(os.path.join(NODE_PATH, "node%d" % node, "cpulist"))) if cpu < self.max_cpu_nums])
+            if not cpus:
+                continue
+            self.node_cpus_dict[node] = cpus
+            for cpu in cpus:
+                self.numa_node_list[cpu] = node
 
 
 class PackageData:
@@ -108,50 +145,64 @@ class PackageData:
         self.energy_watt = 0
         self.update_time = 0
 
-    def get_energy_data(self, extern_lib):
-        self.update_time = time.time_ns()
-        self.energy_pkg = extern_lib.get_msr(self.cpu_id, msr.MSR_PKG_ENERGY_STATUS)
-
 
 class HostStatusData:
+    """Allocated once per buffer from the host topology and refilled every tick."""
     def __init__(self, host_topo):
-        self.cpu_data_list = []
+        self.cpu_nums = host_topo.max_cpu_nums
+        self.curr_freq = array('d', [0.0]) * self.cpu_nums
         self.package_data_dict = {}
+        for package, cpu in sorted(host_topo.package_first_cpu_dict.items()):
+            self.package_data_dict[package] = PackageData(cpu, package)
+
+        # Filled by libskylarkmsr in one call, read through the views without copying.
+        self.cpu_samples = (StructCpuSample * self.cpu_nums)()
+        self.package_cpus = (ctypes.c_int * len(self.package_data_dict))(
+            *[package_data.cpu_id for package_data in self.package_data_dict.values()])
+        self.package_energy = (ctypes.c_ulonglong * len(self.package_data_dict))()
+        self.sample_view = memoryview(self.cpu_samples).cast('B').cast('Q')
+        self.energy_view = memoryview(self.package_energy).cast('B').cast('Q')
+
+    def get_status_data(self, extern_lib):
+        ret, err_cpu = extern_lib.get_all_status_data(self.cpu_nums, self.cpu_samples,
+                                                      len(self.package_data_dict), self.package_cpus,
+                                                      self.package_energy)
+        update_time = time.time_ns()
+        if ret == -1:
+            LOGGER.error("CPU %d: msr aperf, mperf or energy read failed!", err_cpu)
+            raise OSError
+        elif ret == -2:
+            LOGGER.error("CPU %d has jitter", err_cpu)
+            raise TimeoutError
 
-        for cpu in range(host_topo.max_cpu_nums):
-            self.cpu_data_list.append(CpuData(cpu, host_topo.cpu_topo_list[cpu]))
-            if self.cpu_data_list[cpu].cpu_is_first_core_in_package:
-                if self.cpu_data_list[cpu].package_id not in self.package_data_dict:
-                    self.package_data_dict[self.cpu_data_list[cpu].package_id] = \
-                        PackageData(cpu, host_topo.cpu_topo_list[cpu])
-
-    def get_status_data(self, extern_lib, aperf_mperf_multiplier):
-        for cpu in range(len(self.cpu_data_list)):
-            self.cpu_data_list[cpu].get_cpu_status_data(extern_lib, aperf_mperf_multiplier)
-        for package in self.package_data_dict:
-            self.package_data_dict.get(package).get_energy_data(extern_lib)
+        for index, package_data in enumerate(self.package_data_dict.values()):
+            package_data.energy_pkg = self.energy_view[index]
+            package_data.update_time = update_time
 
     def format_status_data(self, old_status_data, base_freq, rapl_energy_unit):
-        for cpu in range(len(self.cpu_data_list)):
+        curr_aperf, curr_mperf = self.sample_view[0::2], self.sample_view[1::2]
+        old_aperf, old_mperf = old_status_data.sample_view[0::2], old_status_data.sample_view[1::2]
+        for cpu in range(self.cpu_nums):
             LOGGER.debug("CPU %d: Last time aperf was %d, mperf was %d; curr aperf is %d, mperf is %d"
-                         % (cpu, old_status_data.cpu_data_list[cpu].aperf,
-                            old_status_data.cpu_data_list[cpu].mperf,
-                            self.cpu_data_list[cpu].aperf, self.cpu_data_list[cpu].mperf))
+                         % (cpu, old_aperf[cpu], old_mperf[cpu], curr_aperf[cpu], curr_mperf[cpu]))
 
-            aperf_delta = (self.cpu_data_list[cpu].aperf - old_status_data.cpu_data_list[cpu].aperf)
-            mperf_delta = (self.cpu_data_list[cpu].mperf - old_status_data.cpu_data_list[cpu].mperf)
+            # aperf and mperf tick at the same scale, KNL included, so their ratio is exact.
+            aperf_delta = curr_aperf[cpu] - old_aperf[cpu]
+            mperf_delta = curr_mperf[cpu] - old_mperf[cpu]
             if mperf_delta != 0:
-                self.cpu_data_list[cpu].curr_freq = base_freq * aperf_delta / mperf_delta
+                self.curr_freq[cpu] = base_freq * aperf_delta / mperf_delta
             else:
                 raise OSError
 
-            LOGGER.debug("The curr_freq of cpu %d is %.2f" % (cpu, self.cpu_data_list[cpu].curr_freq))
+            LOGGER.debug("The curr_freq of cpu %d is %.2f" % (cpu, self.curr_freq[cpu]))
 
         for package in self.package_data_dict:
             update_interval = (self.package_data_dict.get(package).update_time -
                                old_status_data.package_data_dict.get(package).update_time)
+            # MSR_PKG_ENERGY_STATUS is a 32-bit counter which wraps within minutes on a busy package.
             energy_delta = (self.package_data_dict.get(package).energy_pkg -
-                            old_status_data.package_data_dict.get(package).energy_pkg)
+                            old_status_data.package_data_dict.get(package).energy_pkg) % \
+                poweraccount.MSR_ENERGY_RANGE
             if update_interval != 0:
                 self.package_data_dict.get(package).energy_watt = energy_delta * rapl_energy_unit / \
                                                               update_interval * SECOND_TO_NANOSECOND
@@ -174,12 +225,11 @@ class ResctrlInfo:
         self.min_cache_ways = None
         self.mbw_gran = None
         self.mbw_min = None
-        self.id_num = None
+        self.l3_domain_list = []
+        self.mb_domain_list = []
+        self.l3_size_dict = {}
 
     def get_resctrl_infos(self):
-        def value_of_subpath(subpath):
-            return util.file_read(os.path.join(RESCTRLPATH, subpath))
-
         cache_allocation_enabled = os.access(
             os.path.join(RESCTRLPATH, "info/L3"), os.R_OK)
         mbw_allocation_enabled = os.access(
@@ -188,12 +238,40 @@ class ResctrlInfo:
             LOGGER.error("Resctrl's cache/mbw allocation disabled, skylark exit")
             raise OSError
 
-        self.max_cache_ways = bin(int(
-            value_of_subpath("info/L3/cbm_mask"), 16)).count("1")
-        self.min_cache_ways = int(value_of_subpath("info/L3/min_cbm_bits"))
-        self.mbw_min = int(value_of_subpath("info/MB/min_bandwidth"))
-        self.mbw_gran = int(value_of_subpath("info/MB/bandwidth_gran"))
-        self.id_num = len(value_of_subpath("schemata").split(";"))
+        cbm_mask, min_cbm_bits, min_bandwidth, bandwidth_gran, schemata = CGROUP_IO.read_batch(
+            [os.path.join(RESCTRLPATH, subpath) for subpath in
+             ("info/L3/cbm_mask", "info/L3/min_cbm_bits", "info/MB/min_bandwidth",
+              "info/MB/bandwidth_gran", "schemata")])
+        self.max_cache_ways = bin(int(cbm_mask, 16)).count("1")
+        self.min_cache_ways = int(min_cbm_bits)
+        self.mbw_min = int(min_bandwidth)
+        self.mbw_gran = int(bandwidth_gran)
+        self.__get_schemata_domains(schemata)
+        self.__get_l3_size()
+
+    def __get_schemata_domains(self, schemata):
+        for line in schemata.splitlines():
+            resource, _, domain_allocs = line.strip().partition(":")
+            domain_list = [int(domain_alloc.split("=")[0]) for domain_alloc in domain_allocs.split(";")]
+            if resource.strip() == "L3":
+                self.l3_domain_list = domain_list
+            elif resource.strip() == "MB":
+                self.mb_domain_list = domain_list
+        LOGGER.info("L3 domains are %s, MB domains are %s" % (self.l3_domain_list, self.mb_domain_list))
+
+    def __get_l3_size(self):
+        size_path = os.path.join(RESCTRLPATH, "size")
+        if not os.access(size_path, os.R_OK):
+            LOGGER.warning("No resctrl size file, LLC size is unknown.")
+            return
+        for line in CGROUP_IO.read(size_path).splitlines():
+            resource, _, domain_sizes = line.strip().partition(":")
+            if resource.strip() != "L3":
+                continue
+            for domain_size in domain_sizes.split(";"):
+                domain_id, size = domain_size.split("=")
+                self.l3_size_dict[int(domain_id)] = int(size)
+        LOGGER.info("LLC size of L3 domains is %s" % self.l3_size_dict)
 
     @staticmethod
     def mount_resctrl():
@@ -217,12 +295,14 @@ class HostInfo:
         self.host_topo = HostTopology()
         self.rapl_energy_units = 0
         self.has_aperf = False
-        self.aperf_mperf_multiplier = 0
         self.family = 0
         self.model = 0
-        self.old_host_status_data = None
+        self.host_status_data = None
+        self.spare_host_status_data = None
         self.turbo_is_enable = False
         self.extern_lib = None
+        self.power_collector = None
+        self.powercap_collector = None
         self.resctrl_info = ResctrlInfo()
 
     def set_host_base_attribute(self):
@@ -233,6 +313,12 @@ class HostInfo:
         self.resctrl_info.get_resctrl_infos()
 
     def set_host_power_attribute(self):
+        self.power_collector = get_power_collector()
+        LOGGER.info("Power collector is %s" % self.power_collector)
+        if self.power_collector == "powercap":
+            self.__set_powercap_attribute()
+            return
+
         self.extern_lib = msrlibrary.MsrLibrary()
         atexit.register(self.__clear_fd_percpu)
         self.extern_lib.allocate_fd_percpu(self.host_topo.max_cpu_nums)
@@ -244,19 +330,58 @@ class HostInfo:
         self.__get_cpu_tdp()
         self.__get_rapl_energy_unit()
         self.__check_has_aperf()
+        self.__start_sampling_workers()
 
-        self.old_host_status_data = HostStatusData(self.host_topo)
-        self.old_host_status_data.get_status_data(self.extern_lib, self.aperf_mperf_multiplier)
+        self.host_status_data = HostStatusData(self.host_topo)
+        self.spare_host_status_data = HostStatusData(self.host_topo)
+        self.host_status_data.get_status_data(self.extern_lib)
+
+    def __set_powercap_attribute(self):
+        self.powercap_collector = PowercapCollector()
+        atexit.register(self.powercap_collector.close_collector)
+
+        self.cpu_basefreq_mhz = self.powercap_collector.get_cpu_base_freq_mhz()
+        LOGGER.info("Base frequency is %.2f MHz" % self.cpu_basefreq_mhz)
+        self.__is_turbo_enable()
+        if self.turbo_is_enable:
+            self.cpu_turbofreq_mhz = self.powercap_collector.get_cpu_max_freq_mhz()
+            LOGGER.info("Turbo frequency is %.2f MHz" % self.cpu_turbofreq_mhz)
+        else:
+            self.cpu_turbofreq_mhz = self.cpu_basefreq_mhz
+
+        self.__get_cpu_tdp()
+
+        self.host_status_data = HostStatusData(self.host_topo)
+        self.powercap_collector.open_collector(self.host_topo)
 
     def update_host_power_info(self):
-        curr_host_status_data = HostStatusData(self.host_topo)
+        if self.power_collector == "powercap":
+            self.powercap_collector.get_status_data(self.host_status_data, self.cpu_basefreq_mhz)
+            return
+
+        curr_host_status_data = self.spare_host_status_data
 
-        curr_host_status_data.get_status_data(self.extern_lib, self.aperf_mperf_multiplier)
+        curr_host_status_data.get_status_data(self.extern_lib)
 
-        curr_host_status_data.format_status_data(self.old_host_status_data, self.cpu_basefreq_mhz,
+        curr_host_status_data.format_status_data(self.host_status_data, self.cpu_basefreq_mhz,
                                                  self.rapl_energy_units)
 
-        self.old_host_status_data = copy.deepcopy(curr_host_status_data)
+        # Swap the double buffers, the latest data is always host_status_data.
+        self.spare_host_status_data = self.host_status_data
+        self.host_status_data = curr_host_status_data
+
+    def __start_sampling_workers(self):
+        try:
+            worker_nums = int(os.getenv("MSR_SAMPLING_WORKERS", "4"))
+        except ValueError:
+            LOGGER.error("MSR_SAMPLING_WORKERS parameter type is invalid.")
+            raise
+        if not 0 <= worker_nums <= 64:
+            LOGGER.error("MSR_SAMPLING_WORKERS parameter is invalid.")
+            raise ValueError
+        if worker_nums > 1:
+            self.extern_lib.start_sampling_workers(worker_nums)
+        LOGGER.info("MSR sampling workers number is %d" % worker_nums)
 
     def __clear_fd_percpu(self):
         self.extern_lib.clear_memory()
@@ -315,19 +440,10 @@ class HostInfo:
         LOGGER.info("RAPL energy units is %.6f Joules" % self.rapl_energy_units)
 
     def __check_has_aperf(self):
-        if self.extern_lib.check_has_aperf():
-            self.__get_aperf_mperf_multiplier()
-            LOGGER.info("The aperf_mperf_multiplier is %d" % self.aperf_mperf_multiplier)
-        else:
+        if not self.extern_lib.check_has_aperf():
             LOGGER.error("The host doesn't have aperf register so that can't get CPU frequency.")
             raise OSError
 
-    def __get_aperf_mperf_multiplier(self):
-        if self.__is_knl():
-            self.aperf_mperf_multiplier = 1024
-        else:
-            self.aperf_mperf_multiplier = 1
-
     def __discover_bclk(self):
         if self.__has_snb_msrs() or self.__is_knl():
             return 100.00
@@ -21,3 +21,5 @@ MSR_PLATFORM_INFO = 0x000000ce
 MSR_TURBO_RATIO_LIMIT = 0x000001ad
 MSR_RAPL_POWER_UNIT = 0x00000606
 MSR_PKG_ENERGY_STATUS = 0x00000611
+MSR_DRAM_ENERGY_STATUS = 0x00000619
+MSR_PP0_ENERGY_STATUS = 0x00000639
@@ -17,24 +17,41 @@ Description: This file is used for providing MSR Library class
 # @code
 
 import ctypes
+import threading
 
 from logger import LOGGER
 
 
 class MsrLibrary:
+    """
+    libskylarkmsr keeps its per-CPU fds and sampling workers in global state,
+    so the power sample and power manage jobs, which run in different
+    scheduler threads, take turns through self.lock.
+    """
     def __init__(self):
         self.c_lib = ctypes.cdll.LoadLibrary("/usr/lib/libskylarkmsr.so")
         self.max_cpu_nums = 0
+        self.lock = threading.Lock()
 
     def allocate_fd_percpu(self, max_cpu_nums):
         self.max_cpu_nums = max_cpu_nums
-        ret = self.c_lib.allocate_fd_percpu(max_cpu_nums)
+        with self.lock:
+            ret = self.c_lib.allocate_fd_percpu(max_cpu_nums)
         if ret:
             LOGGER.error("Failed to calloc fd_percpu!")
             raise OSError
 
     def clear_memory(self):
-        self.c_lib.free_fd_percpu(self.max_cpu_nums)
+        with self.lock:
+            self.c_lib.stop_sampling_workers()
+            self.c_lib.free_fd_percpu(self.max_cpu_nums)
+
+    def start_sampling_workers(self, worker_nums):
+        with self.lock:
+            ret = self.c_lib.start_sampling_workers(self.max_cpu_nums, worker_nums)
+        if ret:
+            LOGGER.error("Failed to start %d msr sampling workers!" % worker_nums)
+            raise OSError
 
     def get_cpu_microarch(self):
         return self.c_lib.get_cpu_microarch()
@@ -47,11 +64,22 @@ class MsrLibrary:
 
     def get_msr(self, cpu, offset):
         msr = ctypes.c_ulonglong(0)
-        if self.c_lib.get_msr(cpu, offset, ctypes.byref(msr)):
+        with self.lock:
+            ret = self.c_lib.get_msr(cpu, offset, ctypes.byref(msr))
+        if ret:
             LOGGER.error("CPU %d: msr offset %d read failed" % (cpu, offset))
             raise OSError
         else:
             return msr.value
 
     def get_cpu_status_data(self, cpuid, perf_data_pointer):
-        return self.c_lib.get_cpu_status_data(cpuid, perf_data_pointer)
+        with self.lock:
+            return self.c_lib.get_cpu_status_data(cpuid, perf_data_pointer)
+
+    def get_all_status_data(self, cpu_nums, cpu_samples, package_nums, package_cpus, package_energy):
+        err_cpu = ctypes.c_int(-1)
+        # Falls back to sampling in the calling thread if no workers are started
+        with self.lock:
+            ret = self.c_lib.get_all_status_data_parallel(cpu_nums, cpu_samples, package_nums, package_cpus,
+                                                          package_energy, ctypes.byref(err_cpu))
+        return ret, err_cpu.value
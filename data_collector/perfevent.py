@@ -0,0 +1,115 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for providing perf_event counter groups
+"""
+# @code
+
+import ctypes
+import fcntl
+import os
+import struct
+
+from logger import LOGGER
+
+SYS_PERF_EVENT_OPEN = 298
+PERF_TYPE_HARDWARE = 0
+PERF_COUNT_HW_CPU_CYCLES = 0
+PERF_COUNT_HW_INSTRUCTIONS = 1
+PERF_COUNT_HW_CACHE_MISSES = 3
+PERF_COUNT_HW_REF_CPU_CYCLES = 9
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_GROUP = 1 << 3
+PERF_ATTR_FLAG_DISABLED = 1 << 0
+PERF_FLAG_PID_CGROUP = 1 << 2
+PERF_FLAG_FD_CLOEXEC = 1 << 3
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+PERF_IOC_FLAG_GROUP = 1
+
+
+class PerfEventAttr(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_uint32),
+                ("size", ctypes.c_uint32),
+                ("config", ctypes.c_uint64),
+                ("sample_period", ctypes.c_uint64),
+                ("sample_type", ctypes.c_uint64),
+                ("read_format", ctypes.c_uint64),
+                ("flags", ctypes.c_uint64),
+                ("wakeup_events", ctypes.c_uint32),
+                ("bp_type", ctypes.c_uint32),
+                ("config1", ctypes.c_uint64),
+                ("config2", ctypes.c_uint64),
+                ("branch_sample_type", ctypes.c_uint64),
+                ("sample_regs_user", ctypes.c_uint64),
+                ("sample_stack_user", ctypes.c_uint32),
+                ("clockid", ctypes.c_int32),
+                ("sample_regs_intr", ctypes.c_uint64),
+                ("aux_watermark", ctypes.c_uint32),
+                ("sample_max_stack", ctypes.c_uint16),
+                ("reserved_2", ctypes.c_uint16)]
+
+
+LIBC = ctypes.CDLL(None, use_errno=True)
+
+
+def perf_event_open(config, pid, cpu, group_fd, flags):
+    attr = PerfEventAttr()
+    attr.type = PERF_TYPE_HARDWARE
+    attr.size = ctypes.sizeof(PerfEventAttr)
+    attr.config = config
+    attr.read_format = PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING
+    if group_fd == -1:
+        attr.flags = PERF_ATTR_FLAG_DISABLED
+    fd = LIBC.syscall(ctypes.c_long(SYS_PERF_EVENT_OPEN), ctypes.byref(attr), ctypes.c_long(pid),
+                      ctypes.c_long(cpu), ctypes.c_long(group_fd), ctypes.c_ulong(flags | PERF_FLAG_FD_CLOEXEC))
+    if fd < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, "perf_event_open: %s" % os.strerror(error))
+    return fd
+
+
+class PerfEventGroup:
+    """
+    A group of hardware counters read together with one read() on the leader.
+    With pid == -1 it counts everything on cpu, with a cgroup fd as pid and
+    PERF_FLAG_PID_CGROUP it counts the tasks of that cgroup on cpu.
+    """
+    def __init__(self, configs, pid=-1, cpu=-1, flags=0):
+        self.fds = []
+        self.read_size = 8 * (3 + len(configs))
+        try:
+            for config in configs:
+                self.fds.append(perf_event_open(config, pid, cpu, self.fds[0] if self.fds else -1, flags))
+        except OSError:
+            self.close()
+            raise
+        fcntl.ioctl(self.fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP)
+
+    def read(self):
+        """Return the counter values, scaled up if the group was multiplexed."""
+        data = struct.unpack("%dQ" % (self.read_size // 8), os.read(self.fds[0], self.read_size))
+        time_enabled, time_running = data[1], data[2]
+        if time_running == 0:
+            return [0] * data[0]
+        return [value * time_enabled // time_running for value in data[3:]]
+
+    def close(self):
+        for fd in self.fds:
+            try:
+                os.close(fd)
+            except OSError as error:
+                LOGGER.warning("Failed to close perf event fd: %s" % str(error))
+        self.fds = []
@@ -0,0 +1,162 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for accounting the energy and power of RAPL domains
+"""
+# @code
+
+import functools
+import math
+import os
+import time
+
+from data_collector import intelfamily as intel
+from data_collector import msrindex as msr
+from logger import LOGGER
+import util
+
+POWERCAP_PATH = "/sys/class/powercap/intel-rapl"
+MSR_ENERGY_RANGE = 1 << 32
+POWERCAP_ENERGY_UNIT = 0.000001
+DRAM_ENERGY_UNIT_SERVER = 0.0000153
+NANOSECOND_TO_SECOND = 0.000000001
+# Smoothed power follows the raw samples with the time constant of the power control tick.
+POWER_TIME_CONSTANT = 1.0
+ENERGY_DOMAIN_PACKAGE = "package"
+ENERGY_DOMAIN_DRAM = "dram"
+ENERGY_DOMAIN_CORE = "core"
+ENERGY_STATUS_MSR_DICT = {
+    ENERGY_DOMAIN_PACKAGE: msr.MSR_PKG_ENERGY_STATUS,
+    ENERGY_DOMAIN_DRAM: msr.MSR_DRAM_ENERGY_STATUS,
+    ENERGY_DOMAIN_CORE: msr.MSR_PP0_ENERGY_STATUS,
+}
+DRAM_FIXED_UNIT_MODELS = ('INTEL_FAM6_HASWELL_X', 'INTEL_FAM6_BROADWELL_X', 'INTEL_FAM6_SKYLAKE_X',
+                          'INTEL_FAM6_ICELAKE_X', 'INTEL_FAM6_SAPPHIRERAPIDS_X', 'INTEL_FAM6_XEON_PHI_KNL')
+
+
+def get_power_sample_interval():
+    """Return the power sample interval in seconds."""
+    try:
+        sample_interval = int(os.getenv("POWER_SAMPLE_INTERVAL", "100"))
+    except ValueError:
+        LOGGER.error("POWER_SAMPLE_INTERVAL parameter type is invalid.")
+        raise
+    if not 10 <= sample_interval <= 1000:
+        LOGGER.error("POWER_SAMPLE_INTERVAL parameter is invalid.")
+        raise ValueError
+    return sample_interval / 1000
+
+
+class EnergyCounter:
+    """
+    A free running energy counter accumulated into a total which never wraps.
+    The modulo recovers the wrap between two samples, which is exact as long
+    as the counter wraps at most once per sample interval.
+    """
+    def __init__(self, read_energy, energy_range, energy_unit):
+        self.read_energy = read_energy
+        self.energy_range = energy_range
+        self.energy_unit = energy_unit
+        self.last_energy = read_energy()
+        self.last_time = time.time_ns()
+        self.total_energy = 0
+        self.power = 0.0
+        self.smoothed_power = None
+
+    def sample(self):
+        energy = self.read_energy()
+        sample_time = time.time_ns()
+        interval = (sample_time - self.last_time) * NANOSECOND_TO_SECOND
+        if interval <= 0:
+            return
+
+        energy_delta = (energy - self.last_energy) % self.energy_range
+        self.total_energy += energy_delta
+        self.power = energy_delta * self.energy_unit / interval
+        if self.smoothed_power is None:
+            self.smoothed_power = self.power
+        else:
+            self.smoothed_power += (1 - math.exp(-interval / POWER_TIME_CONSTANT)) * \
+                                   (self.power - self.smoothed_power)
+        self.last_energy = energy
+        self.last_time = sample_time
+
+    def get_total_joules(self):
+        return self.total_energy * self.energy_unit
+
+
+class PowerAccount:
+    """
+    Energy counters of the package and its DRAM/core (PP0) subdomains, sampled
+    faster than the power control tick. The domains are discovered from the
+    powercap zones and read through the configured power collector.
+    """
+    def __init__(self):
+        self.energy_counter_dict = {}
+        self.energy_fd_list = []
+
+    @staticmethod
+    def __read_powercap_energy(energy_fd):
+        return int(os.pread(energy_fd, 32, 0))
+
+    @staticmethod
+    def __read_msr_energy(extern_lib, cpu, offset):
+        return extern_lib.get_msr(cpu, offset) & (MSR_ENERGY_RANGE - 1)
+
+    def set_energy_counters(self, host_info):
+        for package in sorted(host_info.host_topo.package_set):
+            zone_path = os.path.join(POWERCAP_PATH, "intel-rapl:%d" % package)
+            self.__add_energy_counter(host_info, package, ENERGY_DOMAIN_PACKAGE, zone_path)
+            for entry in sorted(os.listdir(zone_path)):
+                if not entry.startswith("intel-rapl:%d:" % package):
+                    continue
+                subzone_path = os.path.join(zone_path, entry)
+                domain = util.file_read(os.path.join(subzone_path, "name"))
+                if domain in (ENERGY_DOMAIN_DRAM, ENERGY_DOMAIN_CORE):
+                    self.__add_energy_counter(host_info, package, domain, subzone_path)
+        LOGGER.info("Energy counters are %s" % sorted(self.energy_counter_dict))
+
+    def __add_energy_counter(self, host_info, package, domain, zone_path):
+        if host_info.power_collector == "powercap":
+            energy_fd = os.open(os.path.join(zone_path, "energy_uj"), os.O_RDONLY | os.O_CLOEXEC)
+            self.energy_fd_list.append(energy_fd)
+            read_energy = functools.partial(self.__read_powercap_energy, energy_fd)
+            energy_range = int(util.file_read(os.path.join(zone_path, "max_energy_range_uj")))
+            energy_unit = POWERCAP_ENERGY_UNIT
+        else:
+            read_energy = functools.partial(self.__read_msr_energy, host_info.extern_lib,
+                                            host_info.host_topo.package_first_cpu_dict.get(package),
+                                            ENERGY_STATUS_MSR_DICT.get(domain))
+            energy_range = MSR_ENERGY_RANGE
+            energy_unit = host_info.rapl_energy_units
+            if domain == ENERGY_DOMAIN_DRAM and \
+                    intel.INTEL_NUMTOMODEL_DICT.get(host_info.model) in DRAM_FIXED_UNIT_MODELS:
+                energy_unit = DRAM_ENERGY_UNIT_SERVER
+        self.energy_counter_dict[(package, domain)] = EnergyCounter(read_energy, energy_range, energy_unit)
+
+    def close_energy_counters(self):
+        for energy_fd in self.energy_fd_list:
+            os.close(energy_fd)
+        self.energy_fd_list.clear()
+
+    def sample_power(self):
+        for energy_counter in self.energy_counter_dict.values():
+            energy_counter.sample()
+
+    def get_power(self, package, domain=ENERGY_DOMAIN_PACKAGE):
+        """Return the smoothed power in watts, None if the domain isn't sampled yet."""
+        energy_counter = self.energy_counter_dict.get((package, domain))
+        if energy_counter is None:
+            return None
+        return energy_counter.smoothed_power
@@ -0,0 +1,124 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for collecting power and frequency without MSR access
+"""
+# @code
+
+import os
+import time
+
+from data_collector import perfevent
+from logger import LOGGER
+import util
+
+POWERCAP_ZONE_PATH = "/sys/class/powercap/intel-rapl/intel-rapl:%d"
+CPUFREQ_PATH = "/sys/devices/system/cpu/cpu%d/cpufreq"
+KHZ_TO_MHZ = 1000
+UJ_NS_TO_WATT = 1000
+
+
+class PowercapCollector:
+    """
+    Package energy comes from powercap energy_uj, and per-CPU frequency from
+    perf_event cycles/ref-cycles groups. All fds are opened once.
+    """
+    def __init__(self):
+        self.energy_fd_dict = {}
+        self.max_energy_range_dict = {}
+        self.last_energy_dict = {}
+        self.last_update_time = 0
+        self.freq_group_list = []
+        self.last_cycles_list = []
+
+    @staticmethod
+    def get_cpu_base_freq_mhz():
+        try:
+            return int(util.file_read(os.path.join(CPUFREQ_PATH % 0, "base_frequency"))) / KHZ_TO_MHZ
+        except FileNotFoundError:
+            LOGGER.warning("No cpufreq base_frequency, use cpuinfo_max_freq as base frequency.")
+            return int(util.file_read(os.path.join(CPUFREQ_PATH % 0, "cpuinfo_max_freq"))) / KHZ_TO_MHZ
+
+    @staticmethod
+    def get_cpu_max_freq_mhz():
+        return int(util.file_read(os.path.join(CPUFREQ_PATH % 0, "cpuinfo_max_freq"))) / KHZ_TO_MHZ
+
+    def open_collector(self, host_topo):
+        for package in host_topo.package_set:
+            zone_path = POWERCAP_ZONE_PATH % package
+            self.max_energy_range_dict[package] = int(util.file_read(os.path.join(zone_path,
+                                                                                  "max_energy_range_uj")))
+            self.energy_fd_dict[package] = os.open(os.path.join(zone_path, "energy_uj"),
+                                                   os.O_RDONLY | os.O_CLOEXEC)
+
+        try:
+            for cpu in range(host_topo.max_cpu_nums):
+                self.freq_group_list.append(perfevent.PerfEventGroup(
+                    [perfevent.PERF_COUNT_HW_CPU_CYCLES, perfevent.PERF_COUNT_HW_REF_CPU_CYCLES], cpu=cpu))
+        except OSError as error:
+            LOGGER.error("Failed to open cycles/ref-cycles perf events: %s" % str(error))
+            self.close_collector()
+            raise
+
+        self.last_energy_dict = self.__read_energy()
+        self.last_update_time = time.time_ns()
+        self.last_cycles_list = [group.read() for group in self.freq_group_list]
+        LOGGER.info("Powercap collector opened for %d packages and %d CPUs"
+                    % (len(self.energy_fd_dict), len(self.freq_group_list)))
+
+    def close_collector(self):
+        for energy_fd in self.energy_fd_dict.values():
+            os.close(energy_fd)
+        self.energy_fd_dict.clear()
+        for group in self.freq_group_list:
+            group.close()
+        self.freq_group_list.clear()
+
+    def __read_energy(self):
+        energy_dict = {}
+        for package, energy_fd in self.energy_fd_dict.items():
+            energy_dict[package] = int(os.pread(energy_fd, 32, 0))
+        return energy_dict
+
+    def get_status_data(self, host_status_data, base_freq):
+        energy_dict = self.__read_energy()
+        update_time = time.time_ns()
+        cycles_list = [group.read() for group in self.freq_group_list]
+
+        update_interval = update_time - self.last_update_time
+        if update_interval == 0:
+            LOGGER.error("The update interval is zero!")
+            raise OSError
+        for package, energy in energy_dict.items():
+            energy_delta = energy - self.last_energy_dict.get(package, energy)
+            if energy_delta < 0:
+                energy_delta += self.max_energy_range_dict.get(package)
+            package_data = host_status_data.package_data_dict.get(package)
+            package_data.energy_pkg = energy
+            package_data.update_time = update_time
+            package_data.energy_watt = energy_delta * UJ_NS_TO_WATT / update_interval
+            LOGGER.debug("The power of package %d is %.2f, interval is %dns."
+                         % (package, package_data.energy_watt, update_interval))
+
+        for cpu, (cycles, ref_cycles) in enumerate(cycles_list):
+            cycles_delta = cycles - self.last_cycles_list[cpu][0]
+            ref_cycles_delta = ref_cycles - self.last_cycles_list[cpu][1]
+            # ref-cycles stop in idle, an idle CPU keeps its last frequency
+            if ref_cycles_delta > 0:
+                host_status_data.curr_freq[cpu] = base_freq * cycles_delta / ref_cycles_delta
+            LOGGER.debug("The curr_freq of cpu %d is %.2f" % (cpu, host_status_data.curr_freq[cpu]))
+
+        self.last_energy_dict = energy_dict
+        self.last_update_time = update_time
+        self.last_cycles_list = cycles_list
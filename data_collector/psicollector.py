@@ -0,0 +1,197 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for collecting the pressure stall information of the host and high priority VMs
+"""
+# @code
+
+import os
+import select
+import threading
+import time
+
+from cgroupio import CGROUP_IO
+from data_collector.cgroupusage import CGRP_ROOT_PATH, CPUACCT_CGRP_PATH, CGRP_V2_CONTROLLERS_PATH
+from logger import LOGGER
+
+PROC_PRESSURE_PATH = "/proc/pressure"
+PSI_RESOURCES = ("cpu", "memory", "io")
+HIGH_VMS_SLICE = "high_prio_machine.slice"
+MS_TO_US = 1000
+SEC_TO_US = 1000000
+
+
+def get_psi_trigger_threshold():
+    """Return (stall_us, window_us) of the PSI triggers."""
+    try:
+        stall_ms = int(os.getenv("PSI_TRIGGER_STALL_MS", "100"))
+        window_ms = int(os.getenv("PSI_TRIGGER_WINDOW_MS", "1000"))
+    except ValueError:
+        LOGGER.error("PSI trigger parameter type is incorrect, please check.")
+        raise
+    # The kernel accepts windows from 500ms to 10s.
+    if window_ms < 500 or window_ms > 10000 or stall_ms < 1 or stall_ms > window_ms:
+        LOGGER.error("PSI trigger parameter is invalid.")
+        raise ValueError
+    return stall_ms * MS_TO_US, window_ms * MS_TO_US
+
+
+class PressureData:
+    def __init__(self):
+        self.some_avg10 = 0.0
+        self.full_avg10 = 0.0
+        self.some_total = None
+        self.full_total = None
+        self.some_stall_ratio = 0.0
+        self.full_stall_ratio = 0.0
+        self.update_time = 0
+
+    def update(self, pressure, now):
+        """pressure is the content of a *.pressure file, now is in microseconds."""
+        for line in pressure.splitlines():
+            kind, *fields = line.split()
+            field_dict = dict(field.split("=") for field in fields)
+            avg10 = float(field_dict.get("avg10"))
+            total = int(field_dict.get("total"))
+            last_total = getattr(self, kind + "_total")
+            stall_ratio = 0.0
+            if last_total is not None and now > self.update_time:
+                stall_ratio = (total - last_total) / (now - self.update_time)
+            setattr(self, kind + "_avg10", avg10)
+            setattr(self, kind + "_total", total)
+            setattr(self, kind + "_stall_ratio", stall_ratio)
+        self.update_time = now
+
+
+class PsiCollector:
+    """
+    Reads the pressure of the host, the high priority slice and its scopes every
+    tick, where the stall ratio is the share of the last tick in which some (or
+    all) tasks stalled. PSI triggers on the slice call back from a poll thread as
+    soon as the stall within a window exceeds the threshold, without waiting for
+    the next tick.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.slice_path = None
+        self.host_pressure_dict = {}
+        self.slice_pressure_dict = {}
+        self.scope_pressure_dict = {}
+        self.trigger_dict = {}
+
+    def init_psi_collector(self):
+        if os.getenv("PSI_MONITOR", "false").lower() != "true":
+            return
+        if not os.access(os.path.join(PROC_PRESSURE_PATH, "cpu"), os.R_OK):
+            LOGGER.warning("PSI is disabled in the kernel, PSI monitor is not able to start.")
+            return
+        if os.access(CGRP_V2_CONTROLLERS_PATH, os.R_OK):
+            self.slice_path = os.path.join(CGRP_ROOT_PATH, HIGH_VMS_SLICE)
+        else:
+            # cgroup v1 exposes pressure in the cpuacct hierarchy if enabled with psi=1.
+            self.slice_path = os.path.join(CPUACCT_CGRP_PATH, HIGH_VMS_SLICE)
+        if not os.access(os.path.join(self.slice_path, "cpu.pressure"), os.R_OK):
+            LOGGER.warning("No pressure files in %s, only the host pressure is collected." % self.slice_path)
+            self.slice_path = None
+        self.enabled = True
+        LOGGER.info("PSI monitor started, cgroup pressure is read from %s" % self.slice_path)
+
+    @staticmethod
+    def __update_pressure(pressure_dict, pressure_path_format, now):
+        for resource in PSI_RESOURCES:
+            pressure_data = pressure_dict.get(resource)
+            if pressure_data is None:
+                pressure_data = PressureData()
+                pressure_dict[resource] = pressure_data
+            pressure_data.update(CGROUP_IO.read(pressure_path_format % resource), now)
+
+    def update_psi(self, guest_info):
+        if not self.enabled:
+            return
+        now = time.monotonic_ns() // 1000
+        self.__update_pressure(self.host_pressure_dict, os.path.join(PROC_PRESSURE_PATH, "%s"), now)
+        if self.slice_path is None:
+            return
+        self.__update_pressure(self.slice_pressure_dict, os.path.join(self.slice_path, "%s.pressure"), now)
+
+        scope_set = set()
+        # Runs in its own job while the guest info job may add or remove domains.
+        for domain in list(guest_info.vm_dict.values()):
+            if domain.cgroup_slice != HIGH_VMS_SLICE or domain.cgroup_name is None:
+                continue
+            scope_set.add(domain.cgroup_name)
+            pressure_dict = self.scope_pressure_dict.setdefault(domain.cgroup_name, {})
+            try:
+                self.__update_pressure(pressure_dict, os.path.join(self.slice_path, domain.cgroup_name,
+                                                                   "%s.pressure"), now)
+            except OSError as error:
+                # The domain may be stopping, the next tick removes it.
+                LOGGER.debug("Failed to read pressure of %s: %s" % (domain.cgroup_name, str(error)))
+        for scope_name in [scope for scope in self.scope_pressure_dict if scope not in scope_set]:
+            del self.scope_pressure_dict[scope_name]
+
+    def get_stall_ratio(self, resource, scope_name=None, full=False):
+        """Return the stall ratio of the slice, or of scope_name, in the last tick."""
+        if scope_name is None:
+            pressure_dict = self.slice_pressure_dict
+        else:
+            pressure_dict = self.scope_pressure_dict.get(scope_name)
+        pressure_data = pressure_dict.get(resource) if pressure_dict else None
+        if pressure_data is None:
+            return 0.0
+        return pressure_data.full_stall_ratio if full else pressure_data.some_stall_ratio
+
+    def start_psi_triggers(self, callback):
+        """callback(resource) runs in the trigger thread and must not block."""
+        if not self.enabled or self.slice_path is None:
+            return
+        stall_us, window_us = get_psi_trigger_threshold()
+        poller = select.poll()
+        for resource in PSI_RESOURCES:
+            pressure_path = os.path.join(self.slice_path, "%s.pressure" % resource)
+            trigger_fd = os.open(pressure_path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+            try:
+                os.write(trigger_fd, ("some %d %d\0" % (stall_us, window_us)).encode())
+            except OSError as error:
+                os.close(trigger_fd)
+                LOGGER.warning("Failed to set PSI trigger on %s: %s" % (pressure_path, str(error)))
+                continue
+            poller.register(trigger_fd, select.POLLPRI)
+            self.trigger_dict[trigger_fd] = resource
+        if not self.trigger_dict:
+            return
+
+        trigger_thread = threading.Thread(target=self.__run_triggers, args=(poller, callback),
+                                          name="psiTrigger", daemon=True)
+        trigger_thread.start()
+        LOGGER.info("PSI triggers of %s started, %dus stall in %dus window"
+                    % (list(self.trigger_dict.values()), stall_us, window_us))
+
+    def __run_triggers(self, poller, callback):
+        while self.trigger_dict:
+            for trigger_fd, event in poller.poll():
+                resource = self.trigger_dict.get(trigger_fd)
+                if event & select.POLLERR:
+                    # The cgroup has gone, the trigger never fires again.
+                    poller.unregister(trigger_fd)
+                    del self.trigger_dict[trigger_fd]
+                    os.close(trigger_fd)
+                    LOGGER.warning("PSI trigger of %s is closed" % resource)
+                elif event & select.POLLPRI:
+                    callback(resource)
+
+    def close_psi_triggers(self):
+        for trigger_fd in list(self.trigger_dict):
+            del self.trigger_dict[trigger_fd]
+            os.close(trigger_fd)
@@ -0,0 +1,159 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for collecting memory bandwidth and LLC occupancy from resctrl
+"""
+# @code
+
+import os
+import time
+
+from logger import LOGGER
+
+RESCTRL_PATH = "/sys/fs/resctrl"
+L3_MON_FEATURES_PATH = "/sys/fs/resctrl/info/L3_MON/mon_features"
+DEFAULT_GROUP = ""
+LOW_PRIO_GROUP = "low_prio_machine"
+MON_L3_PREFIX = "mon_L3_"
+MBM_TOTAL_EVENT = "mbm_total_bytes"
+MBM_LOCAL_EVENT = "mbm_local_bytes"
+LLC_OCCUPANCY_EVENT = "llc_occupancy"
+MON_EVENTS = (MBM_TOTAL_EVENT, MBM_LOCAL_EVENT, LLC_OCCUPANCY_EVENT)
+MBM_COUNTER_RANGE = 1 << 64
+NANOSECOND_TO_SECOND = 0.000000001
+
+
+class MonGroupData:
+    """Monitoring data of one resctrl group on one L3 domain, bandwidth in bytes/s."""
+    def __init__(self):
+        self.counter_dict = {}
+        self.mbm_total_rate = 0.0
+        self.mbm_local_rate = 0.0
+        self.llc_occupancy = 0
+        self.update_time = 0
+
+
+class ResctrlMonitor:
+    """
+    Reads the mon_data of resctrl groups through fds kept open between reads.
+    Groups may be created after the monitor, their fds are opened on first use.
+    """
+    def __init__(self):
+        self.mon_enabled = False
+        self.mon_events = ()
+        self.domain_id_list = []
+        self.mon_group_dict = {}
+        self.event_fd_dict = {}
+        self.group_data_dict = {}
+
+    def init_resctrl_monitor(self):
+        if not os.access(L3_MON_FEATURES_PATH, os.R_OK):
+            LOGGER.warning("Resctrl monitoring is not supported, skip MBM and LLC occupancy collection.")
+            return
+        with open(L3_MON_FEATURES_PATH) as features_file:
+            mon_features = features_file.read().split()
+        self.mon_events = tuple(event for event in MON_EVENTS if event in mon_features)
+        self.domain_id_list = sorted(int(entry[len(MON_L3_PREFIX):])
+                                     for entry in os.listdir(os.path.join(RESCTRL_PATH, "mon_data"))
+                                     if entry.startswith(MON_L3_PREFIX))
+        self.mon_enabled = bool(self.mon_events) and bool(self.domain_id_list)
+        self.add_mon_group(DEFAULT_GROUP, RESCTRL_PATH)
+        self.add_mon_group(LOW_PRIO_GROUP, os.path.join(RESCTRL_PATH, LOW_PRIO_GROUP))
+        LOGGER.info("Resctrl monitor events are %s on L3 domains %s" % (self.mon_events, self.domain_id_list))
+
+    def add_mon_group(self, group, group_path):
+        self.mon_group_dict[group] = group_path
+        self.group_data_dict[group] = {domain_id: MonGroupData() for domain_id in self.domain_id_list}
+
+    def remove_mon_group(self, group):
+        self.mon_group_dict.pop(group, None)
+        self.group_data_dict.pop(group, None)
+        for key in [key for key in self.event_fd_dict if key[0] == group]:
+            os.close(self.event_fd_dict.pop(key))
+
+    def close_resctrl_monitor(self):
+        for event_fd in self.event_fd_dict.values():
+            os.close(event_fd)
+        self.event_fd_dict.clear()
+
+    def __read_event(self, group, domain_id, event):
+        """Return None if the group doesn't exist yet or the counter is unavailable."""
+        key = (group, domain_id, event)
+        event_fd = self.event_fd_dict.get(key)
+        try:
+            if event_fd is None:
+                event_fd = os.open(os.path.join(self.mon_group_dict.get(group), "mon_data",
+                                                "%s%02d" % (MON_L3_PREFIX, domain_id), event),
+                                   os.O_RDONLY | os.O_CLOEXEC)
+                self.event_fd_dict[key] = event_fd
+            value = os.pread(event_fd, 32, 0)
+        except FileNotFoundError:
+            return None
+        except OSError as error:
+            LOGGER.debug("Read %s of group %s on L3 domain %d failed: %s"
+                         % (event, group, domain_id, str(error)))
+            self.event_fd_dict.pop(key, None)
+            if event_fd is not None:
+                os.close(event_fd)
+            return None
+        # The counter reads "Unavailable" while its RMID is not being counted.
+        return int(value) if value.strip().isdigit() else None
+
+    def update_mon_data(self):
+        if not self.mon_enabled:
+            return
+        for group, domain_data_dict in self.group_data_dict.items():
+            for domain_id, mon_data in domain_data_dict.items():
+                self.__update_group_data(group, domain_id, mon_data)
+
+    def __update_group_data(self, group, domain_id, mon_data):
+        for event in self.mon_events:
+            value = self.__read_event(group, domain_id, event)
+            update_time = time.monotonic_ns()
+            if value is None:
+                continue
+            if event == LLC_OCCUPANCY_EVENT:
+                mon_data.llc_occupancy = value
+                continue
+            last_counter = mon_data.counter_dict.get(event)
+            mon_data.counter_dict[event] = (value, update_time)
+            if last_counter is None or update_time == last_counter[1]:
+                continue
+            # The kernel extends the hardware counters to 64 bits, which still wrap eventually.
+            rate = (value - last_counter[0]) % MBM_COUNTER_RANGE / \
+                ((update_time - last_counter[1]) * NANOSECOND_TO_SECOND)
+            if event == MBM_TOTAL_EVENT:
+                mon_data.mbm_total_rate = rate
+            else:
+                mon_data.mbm_local_rate = rate
+            mon_data.update_time = update_time
+        LOGGER.debug("Group %s on L3 domain %d: total bandwidth %.0f B/s, local bandwidth %.0f B/s, "
+                     "llc occupancy %d B" % (group or "default", domain_id, mon_data.mbm_total_rate,
+                                             mon_data.mbm_local_rate, mon_data.llc_occupancy))
+
+    def has_bandwidth(self, group):
+        return any(mon_data.update_time for mon_data in self.group_data_dict.get(group, {}).values())
+
+    def get_bandwidth(self, group, domain_id=None, local=False):
+        """Return the bandwidth in bytes/s on domain_id, or on all domains if domain_id is None."""
+        domain_data_dict = self.group_data_dict.get(group, {})
+        mon_data_list = domain_data_dict.values() if domain_id is None else [domain_data_dict.get(domain_id)]
+        return sum(mon_data.mbm_local_rate if local else mon_data.mbm_total_rate
+                   for mon_data in mon_data_list if mon_data is not None)
+
+    def get_llc_occupancy(self, group, domain_id=None):
+        """Return the LLC occupancy in bytes on domain_id, or on all domains if domain_id is None."""
+        domain_data_dict = self.group_data_dict.get(group, {})
+        mon_data_list = domain_data_dict.values() if domain_id is None else [domain_data_dict.get(domain_id)]
+        return sum(mon_data.llc_occupancy for mon_data in mon_data_list if mon_data is not None)
@@ -0,0 +1,125 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for collecting the run queue delay of the vCPUs of high priority VMs
+"""
+# @code
+
+import os
+import time
+
+from cgroupio import CGROUP_IO
+from logger import LOGGER
+
+PIDS_CGRP_PATH = "/sys/fs/cgroup/pids"
+# QEMU names its vCPU threads "CPU <n>/KVM".
+VCPU_COMM_SUFFIX = "/KVM"
+READ_BUFFER_SIZE = 256
+MSEC_PER_SEC = 1000
+
+
+class RunDelayCollector:
+    """
+    Reads the run queue wait time of every vCPU thread of the high priority VMs
+    from schedstat. The schedstat fds stay open and the threads are resolved
+    again only when the tasks of the scope change. The run delay of a VM is
+    the time its vCPUs waited in milliseconds per second, averaged over them.
+    """
+    def __init__(self):
+        self.tasks_dict = {}
+        self.vcpu_fd_dict = {}
+        self.wait_time_dict = {}
+        self.update_time_dict = {}
+
+    @staticmethod
+    def __open_vcpu_schedstat(tid):
+        """Return the schedstat fd of tid, or None if it isn't a vCPU thread."""
+        task_path = "/proc/%s/task/%s" % (tid, tid)
+        with open(os.path.join(task_path, "comm")) as comm_file:
+            if not comm_file.read().strip().endswith(VCPU_COMM_SUFFIX):
+                return None
+        return os.open(os.path.join(task_path, "schedstat"), os.O_RDONLY | os.O_CLOEXEC)
+
+    def __resolve_vcpu_threads(self, scope_name, tids):
+        fd_dict = self.vcpu_fd_dict.setdefault(scope_name, {})
+        wait_time_dict = self.wait_time_dict.setdefault(scope_name, {})
+        for tid in [tid for tid in fd_dict if tid not in tids]:
+            schedstat_fd = fd_dict.pop(tid)
+            wait_time_dict.pop(tid, None)
+            if schedstat_fd is not None:
+                os.close(schedstat_fd)
+        for tid in tids.difference(fd_dict):
+            try:
+                fd_dict[tid] = self.__open_vcpu_schedstat(tid)
+            except OSError:
+                # The thread has exited since the scan.
+                continue
+
+    def __release_scope(self, scope_name):
+        for schedstat_fd in self.vcpu_fd_dict.pop(scope_name, {}).values():
+            if schedstat_fd is not None:
+                os.close(schedstat_fd)
+        self.tasks_dict.pop(scope_name, None)
+        self.wait_time_dict.pop(scope_name, None)
+        self.update_time_dict.pop(scope_name, None)
+
+    def __get_run_delay(self, scope_name, now):
+        wait_time_dict = self.wait_time_dict.get(scope_name)
+        delay_time = 0
+        vcpu_nums = 0
+        for tid, schedstat_fd in self.vcpu_fd_dict.get(scope_name).items():
+            if schedstat_fd is None:
+                continue
+            try:
+                # run_time wait_time timeslices, in nanoseconds.
+                wait_time = int(os.pread(schedstat_fd, READ_BUFFER_SIZE, 0).split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            last_wait_time = wait_time_dict.get(tid)
+            wait_time_dict[tid] = wait_time
+            if last_wait_time is not None:
+                delay_time += wait_time - last_wait_time
+                vcpu_nums += 1
+
+        last_update_time = self.update_time_dict.get(scope_name)
+        self.update_time_dict[scope_name] = now
+        if not vcpu_nums or last_update_time is None:
+            return 0
+        return delay_time * MSEC_PER_SEC / vcpu_nums / (now - last_update_time)
+
+    def update_run_delay(self, guest_info):
+        now = time.monotonic_ns()
+        scope_set = set()
+        for domain in guest_info.vm_dict.values():
+            if domain.priority != 0 or domain.cgroup_name is None:
+                continue
+            scope_set.add(domain.cgroup_name)
+            tasks_path = os.path.join(PIDS_CGRP_PATH, domain.cgroup_slice, domain.cgroup_name, "tasks")
+            try:
+                tids = frozenset(CGROUP_IO.read(tasks_path).split())
+            except OSError as error:
+                # The domain may be stopping, the next tick removes it.
+                LOGGER.debug("Failed to read tasks of %s: %s" % (domain.cgroup_name, str(error)))
+                continue
+            if tids != self.tasks_dict.get(domain.cgroup_name):
+                self.__resolve_vcpu_threads(domain.cgroup_name, tids)
+                self.tasks_dict[domain.cgroup_name] = tids
+            domain.run_delay = self.__get_run_delay(domain.cgroup_name, now)
+
+        for scope_name in [scope for scope in self.vcpu_fd_dict if scope not in scope_set]:
+            self.__release_scope(scope_name)
+
+    def close_run_delay_collector(self):
+        for scope_name in list(self.vcpu_fd_dict):
+            self.__release_scope(scope_name)
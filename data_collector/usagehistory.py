@@ -0,0 +1,122 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for keeping bounded CPU usage history of VMs
+"""
+# @code
+
+from array import array
+import bisect
+import math
+
+USAGE_PERCENTILE = 0.95
+INIT_SLOT_NUMS = 64
+
+
+class UsageHistory:
+    """
+    Fixed size ring buffers of usage samples, one slot per domain. Every slot
+    holds a series for the domain total and one series per package. Besides
+    the ring, each series keeps a sorted copy of its window and an EWMA, so
+    both the EWMA and the percentile are O(1) to query.
+    """
+    def __init__(self):
+        self.window = 0
+        self.alpha = 0
+        self.package_index = {}
+        self.series_per_slot = 0
+        self.slot_nums = 0
+        self.samples = array('d')
+        self.heads = array('l')
+        self.counts = array('l')
+        self.ewma = array('d')
+        self.sorted_samples = []
+        self.slot_of_domain = {}
+        self.free_slots = []
+
+    def set_history_attribute(self, package_set, window, alpha):
+        self.window = window
+        self.alpha = alpha
+        self.package_index = {package: index + 1 for index, package in enumerate(sorted(package_set))}
+        self.series_per_slot = len(self.package_index) + 1
+        self.__grow(INIT_SLOT_NUMS)
+
+    def __grow(self, slot_nums):
+        series_nums = (slot_nums - self.slot_nums) * self.series_per_slot
+        self.samples.extend(array('d', [0.0]) * (series_nums * self.window))
+        self.heads.extend(array('l', [0]) * series_nums)
+        self.counts.extend(array('l', [0]) * series_nums)
+        self.ewma.extend(array('d', [0.0]) * series_nums)
+        self.sorted_samples.extend(array('d') for _ in range(series_nums))
+        self.free_slots.extend(range(slot_nums - 1, self.slot_nums - 1, -1))
+        self.slot_nums = slot_nums
+
+    def __get_series(self, domain_id, package):
+        slot = self.slot_of_domain.get(domain_id)
+        if slot is None:
+            return None
+        return slot * self.series_per_slot + (self.package_index.get(package) if package is not None else 0)
+
+    def __push(self, series, value):
+        sorted_window = self.sorted_samples[series]
+        offset = series * self.window + self.heads[series]
+        if self.counts[series] == self.window:
+            del sorted_window[bisect.bisect_left(sorted_window, self.samples[offset])]
+            self.ewma[series] += self.alpha * (value - self.ewma[series])
+        else:
+            if self.counts[series] == 0:
+                self.ewma[series] = value
+            else:
+                self.ewma[series] += self.alpha * (value - self.ewma[series])
+            self.counts[series] += 1
+        self.samples[offset] = value
+        bisect.insort(sorted_window, value)
+        self.heads[series] = (self.heads[series] + 1) % self.window
+
+    def record(self, domain_id, domain_usage, package_usage_dict):
+        slot = self.slot_of_domain.get(domain_id)
+        if slot is None:
+            if not self.free_slots:
+                self.__grow(self.slot_nums * 2)
+            slot = self.free_slots.pop()
+            self.slot_of_domain[domain_id] = slot
+
+        base = slot * self.series_per_slot
+        self.__push(base, domain_usage)
+        for package, index in self.package_index.items():
+            self.__push(base + index, package_usage_dict.get(package, 0))
+
+    def evict(self, domain_id):
+        slot = self.slot_of_domain.pop(domain_id, None)
+        if slot is None:
+            return
+        for series in range(slot * self.series_per_slot, (slot + 1) * self.series_per_slot):
+            self.heads[series] = 0
+            self.counts[series] = 0
+            self.ewma[series] = 0
+            del self.sorted_samples[series][:]
+        self.free_slots.append(slot)
+
+    def get_ewma(self, domain_id, package=None):
+        series = self.__get_series(domain_id, package)
+        if series is None or not self.counts[series]:
+            return None
+        return self.ewma[series]
+
+    def get_percentile(self, domain_id, package=None, percentile=USAGE_PERCENTILE):
+        series = self.__get_series(domain_id, package)
+        if series is None or not self.counts[series]:
+            return None
+        rank = math.ceil(percentile * self.counts[series]) - 1
+        return self.sorted_samples[series][max(rank, 0)]
@@ -0,0 +1,141 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for storing the CPU usage of VMs as a domain x CPU matrix
+"""
+# @code
+
+from array import array
+import heapq
+import operator
+
+INIT_ROW_NUMS = 64
+FREE_ROW = -1
+
+
+def top_k(usage_dict, k):
+    """Return the k (domain_id, usage) pairs with the highest usage."""
+    return heapq.nlargest(k, usage_dict.items(), key=lambda item: item[1])
+
+
+class UsageMatrix:
+    """
+    Row-major matrix of per-CPU usage, one row per domain. Rows are reused
+    across ticks and only change when domains start or stop. Spread rows
+    only know the total usage of their domain, spread evenly over the CPUs
+    it may run on, so the per-CPU queries skip them.
+    """
+    def __init__(self):
+        self.cpu_nums = 0
+        self.row_nums = 0
+        self.usage = array('d')
+        self.priority_mask = array('b')
+        self.spread_mask = array('b')
+        self.domain_of_row = []
+        self.free_rows = []
+        self.row_of_domain = {}
+        self.package_cpus = {}
+
+    def set_cpu_topo(self, host_topo):
+        self.cpu_nums = host_topo.max_cpu_nums
+        self.package_cpus = host_topo.package_cpus_dict
+        self.__grow(INIT_ROW_NUMS)
+
+    def __grow(self, row_nums):
+        self.usage.extend(array('d', [0.0]) * ((row_nums - self.row_nums) * self.cpu_nums))
+        self.priority_mask.extend(array('b', [FREE_ROW]) * (row_nums - self.row_nums))
+        self.spread_mask.extend(array('b', [0]) * (row_nums - self.row_nums))
+        self.domain_of_row.extend([None] * (row_nums - self.row_nums))
+        self.free_rows.extend(range(row_nums - 1, self.row_nums - 1, -1))
+        self.row_nums = row_nums
+
+    def acquire_row(self, domain_id, priority):
+        if not self.free_rows:
+            self.__grow(self.row_nums * 2)
+        row = self.free_rows.pop()
+        self.priority_mask[row] = priority
+        self.domain_of_row[row] = domain_id
+        self.row_of_domain[domain_id] = row
+        return row
+
+    def release_row(self, domain_id):
+        row = self.row_of_domain.pop(domain_id, None)
+        if row is None:
+            return
+        self.write_row(row, array('d', [0.0]) * self.cpu_nums)
+        self.priority_mask[row] = FREE_ROW
+        self.spread_mask[row] = 0
+        self.domain_of_row[row] = None
+        self.free_rows.append(row)
+
+    def set_priority(self, row, priority):
+        self.priority_mask[row] = priority
+
+    def set_spread(self, row, spread):
+        self.spread_mask[row] = spread
+
+    def write_row(self, row, values):
+        base = row * self.cpu_nums
+        self.usage[base:base + self.cpu_nums] = array('d', values)
+
+    def scale_row(self, row, scale):
+        base = row * self.cpu_nums
+        self.write_row(row, map(float(scale).__mul__, self.usage[base:base + self.cpu_nums]))
+
+    def get_row(self, row):
+        base = row * self.cpu_nums
+        return self.usage[base:base + self.cpu_nums]
+
+    def get_column(self, cpu):
+        return self.usage[cpu::self.cpu_nums]
+
+    def get_package_usage(self, row):
+        row_usage = self.get_row(row)
+        return {package: sum(map(row_usage.__getitem__, cpus)) for package, cpus in self.package_cpus.items()}
+
+    def get_priority_rows(self, priority):
+        return [row for row in self.row_of_domain.values() if self.priority_mask[row] == priority]
+
+    def __get_percpu_rows(self, priority):
+        return [row for row in self.get_priority_rows(priority) if not self.spread_mask[row]]
+
+    def get_priority_usage(self, priority):
+        """Return the per-CPU usage summed over the domains with priority, except spread rows."""
+        priority_usage = array('d', [0.0]) * self.cpu_nums
+        for row in self.__get_percpu_rows(priority):
+            priority_usage = array('d', map(operator.add, priority_usage, self.get_row(row)))
+        return priority_usage
+
+    def top_domain_in_cpus(self, cpus, priority, excluded_ids=()):
+        """Return (cpu, usage, domain_id) of the busiest domain with priority on each non-idle cpu."""
+        rows = [row for row in self.__get_percpu_rows(priority) if self.domain_of_row[row] not in excluded_ids]
+        if not rows:
+            return []
+        top_domain_list = []
+        for cpu in cpus:
+            column = self.get_column(cpu)
+            row = max(rows, key=column.__getitem__)
+            if column[row] > 0:
+                top_domain_list.append((cpu, column[row], self.domain_of_row[row]))
+        return top_domain_list
+
+    def running_domain_in_cpus(self, cpus, priority):
+        """Return {domain_id: usage} of the domains with priority running on any of cpus."""
+        running_domain_dict = {}
+        for row in self.__get_percpu_rows(priority):
+            row_usage = self.get_row(row)
+            usage = sum(map(row_usage.__getitem__, cpus))
+            if usage > 0:
+                running_domain_dict[self.domain_of_row[row]] = usage
+        return running_domain_dict
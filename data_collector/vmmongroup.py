@@ -0,0 +1,168 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for monitoring low priority VMs with per-VM resctrl mon_groups
+"""
+# @code
+
+import errno
+import os
+import re
+import threading
+import time
+
+from cgroupio import CGROUP_IO
+from data_collector.resctrlmonitor import RESCTRL_PATH, LOW_PRIO_GROUP
+from logger import LOGGER
+import util
+
+LOW_VMS_PID_CGRP_PATH = "/sys/fs/cgroup/pids/low_prio_machine.slice"
+LOW_VMS_MON_GROUPS_PATH = os.path.join(RESCTRL_PATH, LOW_PRIO_GROUP, "mon_groups")
+NUM_RMIDS_PATH = os.path.join(RESCTRL_PATH, "info/L3_MON/num_rmids")
+RESCTRL_INFO_DIRS = ("info", "mon_groups", "mon_data")
+# When RMIDs run short, the groups are rebalanced every ROTATION_CYCLES monitor cycles
+# and ROTATION_RATIO of the budget is rotated among the VMs which aren't monitored.
+ROTATION_CYCLES = 10
+ROTATION_RATIO = 0.25
+
+
+class VmMonGroups:
+    """
+    Per-VM mon_groups under low_prio_machine, one RMID each. If there are more
+    low priority VMs than free RMIDs, the top consumers by bandwidth keep their
+    groups and the rest of the budget rotates over the other VMs, which keep
+    the bandwidth measured last time they were monitored.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.rmid_budget = 0
+        self.cycles = 0
+        self.mon_group_dict = {}
+        self.bandwidth_dict = {}
+        self.monitored_time_dict = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def __get_group_key(scope_name):
+        return "%s/mon_groups/%s" % (LOW_PRIO_GROUP, re.sub(r"[^\w.-]", "_", scope_name))
+
+    @staticmethod
+    def __count_used_rmids():
+        used_rmids = 1 + len(os.listdir(os.path.join(RESCTRL_PATH, "mon_groups")))
+        for entry in os.listdir(RESCTRL_PATH):
+            group_path = os.path.join(RESCTRL_PATH, entry)
+            if entry in RESCTRL_INFO_DIRS or not os.path.isdir(group_path):
+                continue
+            used_rmids += 1 + len(os.listdir(os.path.join(group_path, "mon_groups")))
+        return used_rmids
+
+    def init_vm_mon_groups(self, resctrl_monitor):
+        if os.getenv("RESCTRL_VM_MON_GROUPS", "false").lower() != "true":
+            return
+        if not resctrl_monitor.mon_enabled:
+            LOGGER.warning("Resctrl monitoring is disabled, per-VM mon_groups are not able to start.")
+            return
+
+        # The groups of the last run can't be matched with VMs any more, give their RMIDs back.
+        if os.path.isdir(LOW_VMS_MON_GROUPS_PATH):
+            for entry in os.listdir(LOW_VMS_MON_GROUPS_PATH):
+                os.rmdir(os.path.join(LOW_VMS_MON_GROUPS_PATH, entry))
+        used_rmids = self.__count_used_rmids()
+        if not os.path.isdir(os.path.join(RESCTRL_PATH, LOW_PRIO_GROUP)):
+            # low_prio_machine is created by CacheMBWController later.
+            used_rmids += 1
+        self.rmid_budget = int(util.file_read(NUM_RMIDS_PATH)) - used_rmids
+        self.enabled = self.rmid_budget > 0
+        LOGGER.info("Per-VM mon_groups %s, RMID budget is %d"
+                    % ("enabled" if self.enabled else "disabled", self.rmid_budget))
+
+    def get_tasks_path(self, scope_name):
+        """Return the resctrl tasks file which the tasks of the VM scope belong to."""
+        group_key = self.mon_group_dict.get(scope_name)
+        return os.path.join(RESCTRL_PATH, group_key if group_key else LOW_PRIO_GROUP, "tasks")
+
+    def __add_mon_group(self, scope_name, resctrl_monitor):
+        group_key = self.__get_group_key(scope_name)
+        group_path = os.path.join(RESCTRL_PATH, group_key)
+        try:
+            os.mkdir(group_path)
+        except OSError as error:
+            if error.errno != errno.ENOSPC:
+                raise
+            # Freed RMIDs may stay in limbo for a while, shrink the budget to what is in use.
+            self.rmid_budget = len(self.mon_group_dict)
+            LOGGER.warning("Out of RMIDs, per-VM mon_groups budget shrinks to %d" % self.rmid_budget)
+            return False
+        resctrl_monitor.add_mon_group(group_key, group_path)
+        self.mon_group_dict[scope_name] = group_key
+        self.monitored_time_dict[scope_name] = time.monotonic()
+        return True
+
+    def __remove_mon_group(self, scope_name, resctrl_monitor):
+        group_key = self.mon_group_dict.pop(scope_name)
+        resctrl_monitor.remove_mon_group(group_key)
+        CGROUP_IO.evict(os.path.join(RESCTRL_PATH, group_key))
+        try:
+            # The tasks of the group move back to low_prio_machine.
+            os.rmdir(os.path.join(RESCTRL_PATH, group_key))
+        except FileNotFoundError:
+            pass
+
+    def __select_scopes(self, scope_list):
+        if len(scope_list) <= self.rmid_budget:
+            return set(scope_list)
+        if self.cycles % ROTATION_CYCLES:
+            selected_set = set(scope for scope in scope_list if scope in self.mon_group_dict)
+            for scope in scope_list:
+                if len(selected_set) >= self.rmid_budget:
+                    break
+                selected_set.add(scope)
+            return selected_set
+
+        rotate_nums = max(1, int(self.rmid_budget * ROTATION_RATIO))
+        ranked_list = sorted(scope_list, key=lambda scope: self.bandwidth_dict.get(scope, 0), reverse=True)
+        selected_set = set(ranked_list[:self.rmid_budget - rotate_nums])
+        rotation_list = sorted((scope for scope in scope_list if scope not in selected_set),
+                               key=lambda scope: self.monitored_time_dict.get(scope, 0))
+        selected_set.update(rotation_list[:rotate_nums])
+        return selected_set
+
+    def sync_vm_mon_groups(self, guest_info, resctrl_monitor):
+        """Called right after resctrl_monitor is updated."""
+        if not self.enabled:
+            return
+        self.cycles += 1
+
+        for scope_name, group_key in self.mon_group_dict.items():
+            if resctrl_monitor.has_bandwidth(group_key):
+                self.bandwidth_dict[scope_name] = resctrl_monitor.get_bandwidth(group_key)
+                self.monitored_time_dict[scope_name] = time.monotonic()
+
+        with os.scandir(LOW_VMS_PID_CGRP_PATH) as it:
+            scope_list = [entry.name for entry in it if entry.is_dir()]
+        selected_set = self.__select_scopes(scope_list)
+        with self.lock:
+            for scope_name in [scope for scope in self.mon_group_dict if scope not in selected_set]:
+                self.__remove_mon_group(scope_name, resctrl_monitor)
+            for scope_name in selected_set.difference(self.mon_group_dict):
+                if not self.__add_mon_group(scope_name, resctrl_monitor):
+                    break
+
+        scope_set = set(scope_list)
+        for scope_name in [scope for scope in self.bandwidth_dict if scope not in scope_set]:
+            del self.bandwidth_dict[scope_name]
+            self.monitored_time_dict.pop(scope_name, None)
+        # Runs in the resctrl monitor job while the guest info job may add or remove domains.
+        for domain in list(guest_info.low_prio_vm_dict.values()):
+            domain.mbm_bandwidth = self.bandwidth_dict.get(domain.cgroup_name, 0)
@@ -0,0 +1,183 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for collecting the CPI and LLC misses of VMs with cgroup perf events
+"""
+# @code
+
+import errno
+import os
+import time
+
+from cgroupio import CGROUP_IO
+from data_collector import perfevent
+from data_collector.cgroupusage import CGRP_ROOT_PATH, CGRP_V2_CONTROLLERS_PATH
+from logger import LOGGER
+import util
+
+PERF_EVENT_CGRP_PATH = "/sys/fs/cgroup/perf_event"
+CPUSET_CGRP_PATH = "/sys/fs/cgroup/cpuset"
+CPUS_FILE_V1 = "cpuset.effective_cpus"
+CPUS_FILE_V2 = "cpuset.cpus.effective"
+VM_PERF_CONFIGS = (perfevent.PERF_COUNT_HW_CPU_CYCLES, perfevent.PERF_COUNT_HW_INSTRUCTIONS,
+                   perfevent.PERF_COUNT_HW_CACHE_MISSES)
+# Running out of fds is not the fault of the domain, its events are opened again later.
+RETRY_ERRNOS = (errno.EMFILE, errno.ENFILE)
+# CPI of VMs which hardly ran in the last tick is noise.
+MIN_INSTRUCTIONS = 1000000
+NSEC_PER_SEC = 1000000000
+
+
+class VmPerfScope:
+    def __init__(self, cpus, group_list):
+        self.cpus = cpus
+        self.group_list = group_list
+        self.values_list = [[0] * len(VM_PERF_CONFIGS) for _ in group_list]
+        self.counters = None
+        self.update_time = 0
+
+
+class VmPerfCollector:
+    """
+    Counts cycles, instructions and LLC misses of the high priority VMs and of
+    the low priority VMs sharing packages with them, with one perf event group
+    per CPU of the effective cpuset of the VM scope. Only the groups on CPUs
+    the VM ran on in the last tick are read. The CPI and the LLC misses per
+    second of the last tick are set on DomainInfo.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.cgroup_v2 = False
+        self.perf_cgrp_path = None
+        self.cpus = []
+        self.cpu_package_list = []
+        self.scope_dict = {}
+        self.failed_scope_set = set()
+
+    def init_vm_perf_collector(self, host_topo):
+        if os.getenv("INTERFERENCE_QOS_MANAGEMENT", "false").lower() != "true":
+            return
+        self.cgroup_v2 = os.access(CGRP_V2_CONTROLLERS_PATH, os.R_OK)
+        self.perf_cgrp_path = CGRP_ROOT_PATH if self.cgroup_v2 else PERF_EVENT_CGRP_PATH
+        self.cpus = sorted(cpu for cpus in host_topo.package_cpus_dict.values() for cpu in cpus)
+        self.cpu_package_list = list(host_topo.cpu_topo_list)
+        self.enabled = True
+        LOGGER.info("VM perf collector started on %d cpus, cgroups from %s"
+                    % (len(self.cpus), self.perf_cgrp_path))
+
+    def __read_scope_cpus(self, domain):
+        if self.cgroup_v2:
+            cpus_path = os.path.join(CGRP_ROOT_PATH, domain.cgroup_slice, domain.cgroup_name, CPUS_FILE_V2)
+        else:
+            cpus_path = os.path.join(CPUSET_CGRP_PATH, domain.cgroup_slice, domain.cgroup_name, CPUS_FILE_V1)
+        try:
+            cpus = util.parse_cpu_list(CGROUP_IO.read(cpus_path))
+        except OSError:
+            return tuple(self.cpus)
+        cpu_set = set(self.cpus)
+        return tuple(cpu for cpu in cpus if cpu in cpu_set) or tuple(self.cpus)
+
+    def __get_candidate_dict(self, guest_info):
+        """Return the cpus of the high priority VMs and of the low priority VMs sharing packages with them."""
+        domain_list = [domain for domain in guest_info.vm_dict.values()
+                       if domain.cgroup_name is not None and domain.cgroup_name not in self.failed_scope_set]
+        cpus_dict = {domain.cgroup_name: self.__read_scope_cpus(domain) for domain in domain_list}
+        high_packages = set(self.cpu_package_list[cpu] for domain in domain_list if domain.priority == 0
+                            for cpu in cpus_dict.get(domain.cgroup_name))
+        return {domain.cgroup_name: cpus_dict.get(domain.cgroup_name) for domain in domain_list
+                if domain.priority == 0 or
+                any(self.cpu_package_list[cpu] in high_packages for cpu in cpus_dict.get(domain.cgroup_name))}
+
+    def __open_scope(self, domain, cpus):
+        cgroup_fd = os.open(os.path.join(self.perf_cgrp_path, domain.cgroup_slice, domain.cgroup_name),
+                            os.O_RDONLY | os.O_CLOEXEC)
+        group_list = []
+        try:
+            for cpu in cpus:
+                group_list.append(perfevent.PerfEventGroup(VM_PERF_CONFIGS, pid=cgroup_fd, cpu=cpu,
+                                                           flags=perfevent.PERF_FLAG_PID_CGROUP))
+        except OSError:
+            for group in group_list:
+                group.close()
+            raise
+        finally:
+            # The events hold their own reference to the cgroup.
+            os.close(cgroup_fd)
+        return VmPerfScope(cpus, group_list)
+
+    def __close_scope(self, scope_name):
+        perf_scope = self.scope_dict.pop(scope_name, None)
+        if perf_scope is None:
+            return
+        for group in perf_scope.group_list:
+            group.close()
+
+    def __read_scope(self, domain, perf_scope):
+        usage_row = domain.usage_matrix.get_row(domain.matrix_row) if domain.matrix_row is not None else None
+        for index, cpu in enumerate(perf_scope.cpus):
+            # The counters of a CPU the VM did not run on have not moved.
+            if usage_row is None or usage_row[cpu] > 0 or perf_scope.counters is None:
+                perf_scope.values_list[index] = perf_scope.group_list[index].read()
+        return [sum(values) for values in zip(*perf_scope.values_list)]
+
+    def update_vm_perf(self, guest_info):
+        if not self.enabled:
+            return
+        candidate_dict = self.__get_candidate_dict(guest_info)
+        for scope_name in [scope for scope in self.scope_dict if candidate_dict.get(scope) !=
+                           self.scope_dict.get(scope).cpus]:
+            self.__close_scope(scope_name)
+
+        out_of_fds = False
+        for domain in guest_info.vm_dict.values():
+            domain.cpi = 0
+            domain.llc_miss_rate = 0
+            cpus = candidate_dict.get(domain.cgroup_name)
+            if cpus is None:
+                continue
+            perf_scope = self.scope_dict.get(domain.cgroup_name)
+            if perf_scope is None:
+                if out_of_fds:
+                    continue
+                try:
+                    perf_scope = self.__open_scope(domain, cpus)
+                except OSError as error:
+                    LOGGER.warning("Failed to open perf events of domain %s(%d): %s"
+                                   % (domain.domain_name, domain.domain_id, str(error)))
+                    if error.errno in RETRY_ERRNOS:
+                        out_of_fds = True
+                    else:
+                        # Not retried until the domain restarts.
+                        self.failed_scope_set.add(domain.cgroup_name)
+                    continue
+                self.scope_dict[domain.cgroup_name] = perf_scope
+
+            now = time.monotonic_ns()
+            counters = self.__read_scope(domain, perf_scope)
+            last_counters = perf_scope.counters
+            last_update_time = perf_scope.update_time
+            perf_scope.counters = counters
+            perf_scope.update_time = now
+            if last_counters is None:
+                continue
+            cycles, instructions, cache_misses = [value - last_value for value, last_value
+                                                  in zip(counters, last_counters)]
+            domain.cpi = cycles / instructions if instructions >= MIN_INSTRUCTIONS else 0
+            domain.llc_miss_rate = cache_misses * NSEC_PER_SEC / (now - last_update_time)
+
+        self.failed_scope_set.intersection_update(domain.cgroup_name for domain in guest_info.vm_dict.values())
+
+    def close_vm_perf_collector(self):
+        for scope_name in list(self.scope_dict):
+            self.__close_scope(scope_name)
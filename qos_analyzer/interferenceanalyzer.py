@@ -0,0 +1,97 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for providing a CPI interference analyzer
+"""
+# @code
+
+import os
+
+from data_collector import usagematrix
+from logger import LOGGER
+
+# The CPI baseline of a VM follows its CPI slowly, and even more slowly while the VM
+# suffers interference, so that a lasting phase change of its workload is absorbed.
+BASELINE_ALPHA = 0.1
+INTERFERED_BASELINE_ALPHA = 0.01
+
+
+class InterferenceAnalyzer:
+    """
+    Flags the high priority VMs whose CPI rises CPI_RISE_THRESHOLD above their
+    baseline, and selects the low priority VMs with the most LLC misses per
+    second on the same packages as aggressors. Their CPU bandwidth gets limited,
+    and the cache/mbw allocation of low priority VMs shrinks.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.cpi_rise_threshold = 0
+        self.abnormal_threshold = 0
+        self.quota_threshold = 0
+        self.abnormal_vm_counts = 0
+        self.cpi_baseline_dict = {}
+
+    def set_interference_threshold(self):
+        if os.getenv("INTERFERENCE_QOS_MANAGEMENT", "false").lower() != "true":
+            return
+        try:
+            self.cpi_rise_threshold = float(os.getenv("CPI_RISE_THRESHOLD", "0.2"))
+            self.abnormal_threshold = int(os.getenv("ABNORMAL_THRESHOLD", "3"))
+            self.quota_threshold = float(os.getenv("QUOTA_THRESHOLD", "0.9"))
+            self.abnormal_vm_counts = int(os.getenv("ABNORMAL_VM_COUNTS", "3"))
+        except ValueError:
+            LOGGER.error("Interference threshold parameter type is incorrect, please check.")
+            raise
+        if not 0.05 <= self.cpi_rise_threshold <= 1 or not 1 <= self.abnormal_threshold <= 5 or \
+                not 0.8 <= self.quota_threshold <= 1 or not 1 <= self.abnormal_vm_counts <= 16:
+            LOGGER.error("Interference threshold parameter is invalid.")
+            raise ValueError
+        self.enabled = True
+        LOGGER.info("CPI rise threshold of high priority VMs is %.2f" % self.cpi_rise_threshold)
+
+    def __is_interfered(self, domain):
+        baseline = self.cpi_baseline_dict.get(domain.domain_id)
+        if baseline is None:
+            self.cpi_baseline_dict[domain.domain_id] = domain.cpi
+            return False
+        interfered = domain.cpi > baseline * (1 + self.cpi_rise_threshold)
+        alpha = INTERFERED_BASELINE_ALPHA if interfered else BASELINE_ALPHA
+        self.cpi_baseline_dict[domain.domain_id] = alpha * domain.cpi + (1 - alpha) * baseline
+        return interfered
+
+    def interference_analysis(self, guest_info, cpu_controller, cachembw_controller):
+        """Only select the aggressors, cpu_controller limits them."""
+        for domain_id in [domain_id for domain_id in self.cpi_baseline_dict
+                          if domain_id not in guest_info.vm_dict]:
+            del self.cpi_baseline_dict[domain_id]
+
+        for domain in guest_info.vm_dict.values():
+            # A CPI of 0 means the VM hardly ran in the last tick.
+            if domain.priority != 0 or domain.cpi == 0 or not self.__is_interfered(domain):
+                continue
+            packages = [package for package, usage in domain.package_usage_dict.items() if usage > 0]
+            aggressor_dict = {domain_id: low_domain.llc_miss_rate
+                              for domain_id, low_domain in guest_info.low_prio_vm_dict.items()
+                              if low_domain.llc_miss_rate > 0 and
+                              any(low_domain.package_usage_dict.get(package, 0) > 0 for package in packages)}
+            aggressor_list = usagematrix.top_k(aggressor_dict, self.abnormal_vm_counts)
+            if not aggressor_list:
+                continue
+            for domain_id, _ in aggressor_list:
+                cpu_controller.domain_adjust_dict[domain_id] = self.abnormal_threshold
+            cachembw_controller.request_shrink()
+            LOGGER.info("Domain %s(%d) CPI rises to %.2f over baseline %.2f, limit low priority domains %s"
+                        % (domain.domain_name, domain.domain_id, domain.cpi,
+                           self.cpi_baseline_dict.get(domain.domain_id),
+                           [domain_id for domain_id, _ in aggressor_list]))
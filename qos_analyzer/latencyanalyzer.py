@@ -0,0 +1,84 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for providing a run queue latency analyzer
+"""
+# @code
+
+import os
+
+from data_collector import usagematrix
+from logger import LOGGER
+
+
+class LatencyAnalyzer:
+    """
+    Limits the low priority VMs running on the CPUs of a high priority VM whose
+    vCPUs wait longer than RUN_DELAY_SLO_MS per second on the run queues, or
+    whose scope stalls on cpu for more than PSI_STALL_THRESHOLD of the last tick
+    when PSI_MONITOR is enabled. Memory stall of the high priority slice shrinks
+    the cache/mbw allocation of low priority VMs.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.run_delay_slo_ms = 0
+        self.psi_stall_threshold = 0
+        self.abnormal_threshold = 0
+        self.quota_threshold = 0
+        self.abnormal_vm_counts = 0
+
+    def set_latency_slo(self):
+        if os.getenv("LATENCY_QOS_MANAGEMENT", "false").lower() != "true":
+            return
+        try:
+            self.run_delay_slo_ms = float(os.getenv("RUN_DELAY_SLO_MS", "50"))
+            self.psi_stall_threshold = float(os.getenv("PSI_STALL_THRESHOLD", "0.1"))
+            self.abnormal_threshold = int(os.getenv("ABNORMAL_THRESHOLD", "3"))
+            self.quota_threshold = float(os.getenv("QUOTA_THRESHOLD", "0.9"))
+            self.abnormal_vm_counts = int(os.getenv("ABNORMAL_VM_COUNTS", "3"))
+        except ValueError:
+            LOGGER.error("Latency SLO parameter type is incorrect, please check.")
+            raise
+        if not 1 <= self.run_delay_slo_ms <= 1000 or not 0.01 <= self.psi_stall_threshold <= 1 or \
+                not 1 <= self.abnormal_threshold <= 5 or \
+                not 0.8 <= self.quota_threshold <= 1 or not 1 <= self.abnormal_vm_counts <= 16:
+            LOGGER.error("Latency SLO parameter is invalid.")
+            raise ValueError
+        self.enabled = True
+        LOGGER.info("Run delay SLO of high priority VMs is %.2fms per second" % self.run_delay_slo_ms)
+
+    def latency_analysis(self, guest_info, psi_collector, qos_controller, cachembw_controller):
+        """Only select the low priority VMs to be limited, qos_controller limits them."""
+        for domain in guest_info.vm_dict.values():
+            if domain.priority != 0:
+                continue
+            cpu_stall_ratio = 0
+            if psi_collector.enabled and domain.cgroup_name is not None:
+                cpu_stall_ratio = psi_collector.get_stall_ratio("cpu", domain.cgroup_name)
+            if domain.run_delay <= self.run_delay_slo_ms and cpu_stall_ratio <= self.psi_stall_threshold:
+                continue
+            cpus = [cpu for cpu, usage in enumerate(domain.cpu_usage) if usage > 0]
+            running_domain_dict = guest_info.usage_matrix.running_domain_in_cpus(cpus, 1)
+            victim_list = usagematrix.top_k(running_domain_dict, self.abnormal_vm_counts)
+            for domain_id, _ in victim_list:
+                qos_controller.domain_adjust_dict[domain_id] = self.abnormal_threshold
+            LOGGER.info("Domain %s(%d) run delay is %.2fms per second, cpu stall is %.2f, "
+                        "limit low priority domains %s"
+                        % (domain.domain_name, domain.domain_id, domain.run_delay, cpu_stall_ratio,
+                           [domain_id for domain_id, _ in victim_list]))
+
+        if psi_collector.enabled and psi_collector.get_stall_ratio("memory") > self.psi_stall_threshold:
+            cachembw_controller.request_shrink()
+            LOGGER.info("High priority VMs stall on memory for %.2f of the last tick, shrink low priority "
+                        "cache/mbw allocation" % psi_collector.get_stall_ratio("memory"))
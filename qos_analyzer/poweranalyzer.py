@@ -19,9 +19,17 @@ Description: This file is used for providing a power analyzer
 import os
 import sys
 
+from data_collector import poweraccount
+from data_collector import usagematrix
 from logger import LOGGER
 from qos_controller import cpucontroller
 
+EFFICACY_EWMA_ALPHA = 0.5
+# A victim which is throttled for EARLY_RELEASE_CYCLES while the power of its package
+# doesn't drop is released, and not selected again for RELEASE_COOLDOWN_CYCLES.
+EARLY_RELEASE_CYCLES = 2
+RELEASE_COOLDOWN_CYCLES = 10
+
 
 class PowerAnalyzer:
     def __init__(self):
@@ -31,7 +39,15 @@ class PowerAnalyzer:
         self.tdp_threshold = 0
         self.package_tdp_threshold = {}
         self.abnormal_threshold = 0
+        self.abnormal_vm_counts = 0
+        self.victim_metric = None
         self.quota_threshold = 0
+        self.package_error_dict = {}
+        self.package_power_dict = {}
+        self.last_package_power_dict = {}
+        self.efficacy_dict = {}
+        self.ineffective_cycles_dict = {}
+        self.released_dict = {}
         self.qos_controller = cpucontroller.CpuController()
 
     def set_hotspot_threshold(self, data_collector):
@@ -40,87 +56,165 @@ class PowerAnalyzer:
             self.freq_threshold = float(os.getenv("FREQ_THRESHOLD", "0.98"))
             self.abnormal_threshold = int(os.getenv("ABNORMAL_THRESHOLD", "3"))
             self.quota_threshold = float(os.getenv("QUOTA_THRESHOLD", "0.9"))
+            self.abnormal_vm_counts = int(os.getenv("ABNORMAL_VM_COUNTS", "3"))
+            self.victim_metric = os.getenv("VICTIM_METRIC", "cpu").lower()
         except ValueError:
             LOGGER.error("Threshold parameter type is incorrect, please check.")
             sys.exit(1)
         self.__check_threshold_validity()
+        if self.victim_metric == "mbm" and not data_collector.vm_mon_groups.enabled:
+            # Every low priority VM would rank with a bandwidth of 0.
+            LOGGER.warning("Per-VM mon_groups are not available, low priority VMs are ranked by cpu usage.")
+            self.victim_metric = "cpu"
         self.freq_threshold = self.freq_threshold * data_collector.host_info.cpu_turbofreq_mhz
-        LOGGER.info("Frequency threshold is %.2f, abnormal times threshold is %d, bandwidth threshold is %.2f"
-                    % (self.freq_threshold, self.abnormal_threshold, self.quota_threshold))
+        LOGGER.info("Frequency threshold is %.2f, abnormal times threshold is %d, bandwidth threshold is %.2f, "
+                    "abnormal VM counts is %d" % (self.freq_threshold, self.abnormal_threshold,
+                                                  self.quota_threshold, self.abnormal_vm_counts))
 
         for package in data_collector.host_info.host_topo.package_set:
             self.package_tdp_threshold[package] = self.tdp_threshold * \
                                           data_collector.host_info.cpu_tdp_watt[package]
             LOGGER.info("Package %d tdp threshold is %.2fW" % (package, self.package_tdp_threshold.get(package)))
 
-    def power_manage(self, data_collector, qos_controller):
-        self.__power_analysis(data_collector.host_info)
+    def power_manage(self, data_collector, qos_controller, cpuset_controller=None):
+        self.__power_analysis(data_collector.host_info, data_collector.power_account)
+        self.__throttle_feedback(data_collector.guest_info, qos_controller)
 
         for package in self.power_hotspot_dict:
             if self.power_hotspot_dict.get(package):
                 self.__usage_analysis(data_collector.host_info.host_topo,
                                       data_collector.guest_info, package, qos_controller)
 
-        qos_controller.check_adjust_recover_list(data_collector.guest_info)
-        qos_controller.limit_domain_bandwidth(data_collector.guest_info,
-                                              self.quota_threshold, self.abnormal_threshold)
-        qos_controller.recovery_domain_bandwidth(data_collector.guest_info)
-        qos_controller.refresh_adjust_recover_list()
+        if cpuset_controller is not None:
+            host_topo = data_collector.host_info.host_topo
+            for underclocking_cpus in self.underclocking_dict.values():
+                cpuset_controller.report_hot_cpus(underclocking_cpus)
+            for package in [package for package, hotspot in self.power_hotspot_dict.items() if hotspot]:
+                cpuset_controller.report_hot_cpus(host_topo.package_cpus_dict.get(package))
+            cpuset_controller.place_low_domains(data_collector.guest_info, host_topo, qos_controller)
+
+        if qos_controller.control_mode == cpucontroller.CPU_CONTROL_MODE_PID:
+            qos_controller.check_adjust_recover_list(data_collector.guest_info)
+            qos_controller.control_domain_bandwidth(data_collector.guest_info, self.package_error_dict)
+            qos_controller.refresh_adjust_recover_list()
+            return
+        qos_controller.control_step(data_collector.guest_info, self.quota_threshold, self.abnormal_threshold)
 
-    def __power_analysis(self, host_info):
+    def __power_analysis(self, host_info, power_account):
         self.power_hotspot_dict.clear()
         self.underclocking_dict.clear()
+        self.package_error_dict.clear()
+        self.last_package_power_dict = self.package_power_dict
+        self.package_power_dict = {}
 
-        package_energy_dict = host_info.old_host_status_data.package_data_dict
+        package_energy_dict = host_info.host_status_data.package_data_dict
+        curr_freq = host_info.host_status_data.curr_freq
         for package in package_energy_dict:
             package_id = package_energy_dict.get(package).package_id
-            if package_energy_dict.get(package).energy_watt > self.package_tdp_threshold.get(package):
-                self.underclocking_dict[package_id] = []
+            package_power = power_account.get_power(package_id)
+            if package_power is None:
+                package_power = package_energy_dict.get(package).energy_watt
+            LOGGER.debug("Package %d smoothed power is %.2fW, dram %s, core %s"
+                         % (package_id, package_power,
+                            power_account.get_power(package_id, poweraccount.ENERGY_DOMAIN_DRAM),
+                            power_account.get_power(package_id, poweraccount.ENERGY_DOMAIN_CORE)))
+            self.package_power_dict[package_id] = package_power
+            tdp_threshold = self.package_tdp_threshold.get(package)
+            self.package_error_dict[package_id] = (package_power - tdp_threshold) / tdp_threshold
+            if package_power > tdp_threshold:
                 self.power_hotspot_dict[package_id] = True
-                for cpu in host_info.old_host_status_data.cpu_data_list:
-                    if cpu.package_id == package_energy_dict.get(package).package_id and \
-                            cpu.curr_freq < self.freq_threshold:
-                        self.underclocking_dict.get(package_id).append(cpu.cpu_id)
-                LOGGER.info("Package %d underclocking cpu list is %s"
-                            % (package, self.underclocking_dict.get(package_id)))
+                underclocking_cpus = [cpu for cpu in host_info.host_topo.package_cpus_dict.get(
+                    package_id) if curr_freq[cpu] < self.freq_threshold]
+                self.underclocking_dict[package_id] = underclocking_cpus
+                LOGGER.info("Package %d underclocking cpu list is %s" % (package, underclocking_cpus))
+                if underclocking_cpus:
+                    freq_error = (self.freq_threshold - sum(curr_freq[cpu] for cpu in underclocking_cpus)
+                                  / len(underclocking_cpus)) / self.freq_threshold
+                    self.package_error_dict[package_id] = \
+                        max(self.package_error_dict.get(package_id), freq_error)
             else:
                 self.power_hotspot_dict[package_id] = False
         LOGGER.info("Package power hotspot list is %s" % self.power_hotspot_dict)
 
+    def __throttle_feedback(self, guest_info, qos_controller):
+        """
+        Credit the power drop of every package since the last cycle to the victims
+        throttled on it by their share of the throttled time, and release the victims
+        which keep being throttled without any power drop.
+        """
+        for domain_id in list(self.released_dict):
+            self.released_dict[domain_id] -= 1
+            if self.released_dict.get(domain_id) <= 0 or domain_id not in guest_info.low_prio_vm_dict:
+                del self.released_dict[domain_id]
+        for domain_id in [domain_id for domain_id in self.efficacy_dict
+                          if domain_id not in guest_info.low_prio_vm_dict]:
+            del self.efficacy_dict[domain_id]
+            self.ineffective_cycles_dict.pop(domain_id, None)
+
+        for package_id, package_power in self.package_power_dict.items():
+            last_package_power = self.last_package_power_dict.get(package_id)
+            if last_package_power is None:
+                continue
+            throttled_time_dict = {}
+            for domain_id in qos_controller.domain_adjust_dict:
+                domain = guest_info.low_prio_vm_dict.get(domain_id)
+                if domain is not None and domain.cpu_stat is not None and \
+                        domain.package_usage_dict.get(package_id, 0) > 0 and \
+                        domain.cpu_stat.delta_throttled_time > 0:
+                    throttled_time_dict[domain_id] = domain.cpu_stat.delta_throttled_time
+            total_throttled_time = sum(throttled_time_dict.values())
+            for domain_id, throttled_time in throttled_time_dict.items():
+                power_credit = (last_package_power - package_power) * throttled_time / total_throttled_time
+                if domain_id not in self.efficacy_dict:
+                    self.efficacy_dict[domain_id] = power_credit
+                else:
+                    last_efficacy = self.efficacy_dict.get(domain_id)
+                    self.efficacy_dict[domain_id] = \
+                        EFFICACY_EWMA_ALPHA * power_credit + (1 - EFFICACY_EWMA_ALPHA) * last_efficacy
+                if power_credit > 0 or not self.power_hotspot_dict.get(package_id):
+                    self.ineffective_cycles_dict[domain_id] = 0
+                    continue
+                self.ineffective_cycles_dict[domain_id] = self.ineffective_cycles_dict.get(domain_id, 0) + 1
+                if self.ineffective_cycles_dict.get(domain_id) >= EARLY_RELEASE_CYCLES:
+                    # check_adjust_recover_list moves it to recovery in this cycle.
+                    qos_controller.domain_adjust_dict[domain_id] = 0
+                    self.released_dict[domain_id] = RELEASE_COOLDOWN_CYCLES
+                    self.ineffective_cycles_dict[domain_id] = 0
+                    LOGGER.info("Domain %s(%d) was throttled without power drop, released early"
+                                % (guest_info.low_prio_vm_dict.get(domain_id).domain_name, domain_id))
+
     def __usage_analysis(self, host_topo, guest_info, package_id, qos_controller):
-        package_domain_set = set()
-        package_domain_usage_dict = dict()
         if len(self.underclocking_dict.get(package_id)) != 0:
-            for cpu in self.underclocking_dict.get(package_id):
-                guest_info.running_domain_in_cpus[cpu].sort(reverse=True)
-                for domain in guest_info.running_domain_in_cpus[cpu]:
-                    if domain[3] == 1 and domain[0] != 0:
-                        qos_controller.domain_adjust_dict[domain[1]] = self.abnormal_threshold
-                        LOGGER.debug("Domain %s(%d) usage on CPU%d is %f"
-                                     % (domain[2], domain[1], cpu, domain[0]))
-                        break
+            for cpu, domain_usage, domain_id in guest_info.usage_matrix.top_domain_in_cpus(
+                    self.underclocking_dict.get(package_id), 1, self.released_dict):
+                qos_controller.domain_adjust_dict[domain_id] = self.abnormal_threshold
+                LOGGER.debug("Domain %s(%d) usage on CPU%d is %f"
+                             % (guest_info.vm_dict.get(domain_id).domain_name, domain_id, cpu, domain_usage))
         else:
-            for cpu in range(host_topo.max_cpu_nums):
-                if host_topo.cpu_topo_list[cpu] == package_id:
-                    for domain in guest_info.running_domain_in_cpus[cpu]:
-                        if domain[3] == 1 and domain[0] != 0:
-                            package_domain_set.add(domain[1])
-            for domain in package_domain_set:
-                package_domain_usage_dict[domain] = guest_info.vm_dict[domain].package_usage_dict.get(package_id)
-            package_domain_usage_list = sorted(package_domain_usage_dict.items(),
-                                               key=lambda x: x[1], reverse=True)
-            abnormal_vm_counts = 3
-            for domain in package_domain_usage_list:
-                if not abnormal_vm_counts:
-                    break
-                qos_controller.domain_adjust_dict[domain[0]] = self.abnormal_threshold
-                abnormal_vm_counts -= 1
+            package_domain_usage_dict = dict()
+            for domain_id, domain in guest_info.low_prio_vm_dict.items():
+                if domain.package_usage_dict.get(package_id) > 0 and domain_id not in self.released_dict:
+                    if self.victim_metric == "mbm":
+                        package_domain_usage_dict[domain_id] = domain.mbm_bandwidth
+                    else:
+                        package_domain_usage_dict[domain_id] = guest_info.get_domain_usage(domain_id, package_id)
+            # The victims whose throttling dropped the power most are preferred, up to twice their usage.
+            max_efficacy = max([self.efficacy_dict.get(domain_id, 0) for domain_id in package_domain_usage_dict],
+                               default=0)
+            if max_efficacy > 0:
+                for domain_id in package_domain_usage_dict:
+                    package_domain_usage_dict[domain_id] *= \
+                        1 + max(0, self.efficacy_dict.get(domain_id, 0)) / max_efficacy
+            for domain_id, _ in usagematrix.top_k(package_domain_usage_dict, self.abnormal_vm_counts):
+                qos_controller.domain_adjust_dict[domain_id] = self.abnormal_threshold
 
     def __check_threshold_validity(self):
         tdp_threshold_range = (0.8, 1)
         freq_threshold_range = (0.9, 1)
         quota_threshold_range = (0.8, 1)
         abnormal_threshold_range = (1, 5)
+        abnormal_vm_counts_range = (1, 16)
+        victim_metrics = ("cpu", "mbm")
 
         if self.tdp_threshold < tdp_threshold_range[0] or \
                 self.tdp_threshold > tdp_threshold_range[1] or \
@@ -129,6 +223,12 @@ class PowerAnalyzer:
                 self.quota_threshold < quota_threshold_range[0] or \
                 self.quota_threshold > quota_threshold_range[1] or \
                 self.abnormal_threshold < abnormal_threshold_range[0] or \
-                self.abnormal_threshold > abnormal_threshold_range[1]:
+                self.abnormal_threshold > abnormal_threshold_range[1] or \
+                self.abnormal_vm_counts < abnormal_vm_counts_range[0] or \
+                self.abnormal_vm_counts > abnormal_vm_counts_range[1] or \
+                self.victim_metric not in victim_metrics:
             LOGGER.error("Threshold parameter is invalid.")
             raise ValueError
+        if self.victim_metric == "mbm" and os.getenv("RESCTRL_VM_MON_GROUPS", "false").lower() != "true":
+            LOGGER.error("VICTIM_METRIC mbm needs RESCTRL_VM_MON_GROUPS to be enabled.")
+            raise ValueError
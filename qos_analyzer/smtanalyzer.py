@@ -0,0 +1,85 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for providing an SMT sibling analyzer
+"""
+# @code
+
+import itertools
+import operator
+import os
+
+from data_collector import usagematrix
+from logger import LOGGER
+
+
+class SmtAnalyzer:
+    """
+    Finds the SMT siblings where a high priority VM runs on one thread and low
+    priority VMs on the other, and selects the low priority VMs running on the
+    sibling threads to be limited. Each check goes over the sibling pairs
+    with map and compress, with no Python loop per CPU.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.usage_threshold = 0
+        self.abnormal_threshold = 0
+        self.quota_threshold = 0
+        self.abnormal_vm_counts = 0
+        self.pair_cpus = None
+        self.pair_siblings = None
+        self.shared_cpus = set()
+
+    def set_smt_threshold(self, host_topo):
+        if os.getenv("SMT_QOS_MANAGEMENT", "false").lower() != "true":
+            return
+        try:
+            self.usage_threshold = float(os.getenv("SMT_USAGE_THRESHOLD", "0.5"))
+            self.abnormal_threshold = int(os.getenv("ABNORMAL_THRESHOLD", "3"))
+            self.quota_threshold = float(os.getenv("QUOTA_THRESHOLD", "0.9"))
+            self.abnormal_vm_counts = int(os.getenv("ABNORMAL_VM_COUNTS", "3"))
+        except ValueError:
+            LOGGER.error("SMT threshold parameter type is incorrect, please check.")
+            raise
+        if not 0.1 <= self.usage_threshold <= 1 or not 1 <= self.abnormal_threshold <= 5 or \
+                not 0.8 <= self.quota_threshold <= 1 or not 1 <= self.abnormal_vm_counts <= 16:
+            LOGGER.error("SMT threshold parameter is invalid.")
+            raise ValueError
+        if not host_topo.smt_pair_cpus:
+            LOGGER.warning("No SMT siblings on the host, SMT QoS management is not able to start.")
+            return
+        self.pair_cpus = host_topo.smt_pair_cpus
+        self.pair_siblings = host_topo.smt_pair_siblings
+        self.enabled = True
+        LOGGER.info("SMT QoS management started on %d sibling pairs, usage threshold is %.2f"
+                    % (len(self.pair_cpus) // 2, self.usage_threshold))
+
+    def smt_analysis(self, guest_info, qos_controller):
+        """Only select the low priority VMs to be limited, qos_controller limits them."""
+        usage_matrix = guest_info.usage_matrix
+        high_usage = usage_matrix.get_priority_usage(0)
+        low_usage = usage_matrix.get_priority_usage(1)
+        busy_high = map(self.usage_threshold.__lt__, map(high_usage.__getitem__, self.pair_cpus))
+        busy_low = map(self.usage_threshold.__lt__, map(low_usage.__getitem__, self.pair_siblings))
+        shared_cpus = set(itertools.compress(self.pair_siblings, map(operator.and_, busy_high, busy_low)))
+        self.shared_cpus = shared_cpus
+        if not shared_cpus:
+            return
+
+        running_domain_dict = usage_matrix.running_domain_in_cpus(shared_cpus, 1)
+        victim_list = usagematrix.top_k(running_domain_dict, self.abnormal_vm_counts)
+        for domain_id, _ in victim_list:
+            qos_controller.domain_adjust_dict[domain_id] = self.abnormal_threshold
+        LOGGER.info("Low priority VMs share SMT siblings with high priority VMs on cpus %s, limit domains %s"
+                    % (sorted(shared_cpus), [domain_id for domain_id, _ in victim_list]))
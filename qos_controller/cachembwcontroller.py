@@ -20,16 +20,21 @@ import os
 import sys
 import errno
 
-import util
+from cgroupio import CGROUP_IO
 from logger import LOGGER
 from data_collector.guestinfo import GuestInfo
 from data_collector.hostinfo import ResctrlInfo
+from data_collector.resctrlmonitor import DEFAULT_GROUP, ResctrlMonitor
 
 LOW_VMS_RESGROUP_PATH = "/sys/fs/resctrl/low_prio_machine"
 LOW_MBW_INIT_FLOOR = 0.1
 LOW_MBW_INIT_CEIL = 0.2
 LOW_CACHE_INIT_FLOOR = 1
 LOW_CACHE_INIT_CEIL = 3
+BYTES_TO_MB = 1024 * 1024
+# Allocations shrink as soon as high priority VMs cross the high watermark, but only
+# grow after they stay below the low watermark for this many cycles.
+ADJUST_GROW_CYCLES = 3
 
 
 class ResgroupFileOperations:
@@ -48,14 +53,28 @@ class ResgroupFileOperations:
 class CacheMBWController:
     def __init__(self):
         self.dynamic_control = False
-        self.low_vms_alloc = None
-        self.low_vms_init_cache_alloc = None
-        self.low_vms_init_mbw_alloc = None
+        self.low_vms_cache_ways_dict = {}
+        self.low_vms_mbw_dict = {}
+        self.low_vms_min_cache_ways = 0
+        self.low_vms_max_cache_ways = 0
+        self.low_vms_min_mbw = 0
+        self.low_vms_max_mbw = 0
+        self.mbw_watermark = (0, 0)
+        self.llc_watermark = (0, 0)
+        self.grow_cycles_dict = {}
+        self.known_tids_dict = {}
+        self.shrink_requested = False
 
-    def init_cachembw_controller(self, resctrl_info: ResctrlInfo):
+    def init_cachembw_controller(self, resctrl_info: ResctrlInfo, resctrl_monitor: ResctrlMonitor):
         ResgroupFileOperations.create_group_dir(LOW_VMS_RESGROUP_PATH)
         self.__get_low_init_alloc(resctrl_info)
         self.set_low_init_alloc(resctrl_info)
+        self.__get_dynamic_control_config(resctrl_info, resctrl_monitor)
+
+    @staticmethod
+    def __get_cache_alloc(resctrl_info: ResctrlInfo, cache_ways: int):
+        cache_bit_mask = "0" * (resctrl_info.max_cache_ways - cache_ways) + "1" * cache_ways
+        return hex(int(cache_bit_mask, 2))[2:]
 
     def __get_low_init_alloc(self, resctrl_info: ResctrlInfo):
         try:
@@ -77,54 +96,161 @@ class CacheMBWController:
             LOGGER.error("Cache ways: %d, low_vms_cache_init: %d" %
                          (max_cache_ways, low_vms_cache_init))
             raise Exception
-        low_vms_cache_bit_mask = \
-            "0" * (max_cache_ways - low_vms_cache_init) + "1" * low_vms_cache_init
-        self.low_vms_init_cache_alloc = hex(int(low_vms_cache_bit_mask, 2))[2:]
+        self.low_vms_min_cache_ways = low_vms_cache_init
         if mbw_gran == 0:
             LOGGER.error("Found mbw_gran == 0, skylark exit...")
             raise Exception
         low_vms_env_mbw = int((low_vms_mbw_init * 100) // mbw_gran) * mbw_gran
-        self.low_vms_init_mbw_alloc = str(max(low_vms_env_mbw, mbw_min))
-        LOGGER.info("Get low vm init alloc, cache: %s, mbw: %s" %
-                    (self.low_vms_init_cache_alloc, self.low_vms_init_mbw_alloc))
+        self.low_vms_min_mbw = max(low_vms_env_mbw, mbw_min)
+        LOGGER.info("Get low vm init alloc, cache ways: %d, mbw: %d" %
+                    (self.low_vms_min_cache_ways, self.low_vms_min_mbw))
 
     def set_low_init_alloc(self, resctrl_info: ResctrlInfo):
-        self.__set_low_cache_alloc(resctrl_info, self.low_vms_init_cache_alloc)
-        self.__set_low_mbw_alloc(resctrl_info, self.low_vms_init_mbw_alloc)
+        self.low_vms_cache_ways_dict = dict.fromkeys(resctrl_info.l3_domain_list, self.low_vms_min_cache_ways)
+        self.low_vms_mbw_dict = dict.fromkeys(resctrl_info.mb_domain_list, self.low_vms_min_mbw)
+        self.__set_low_alloc(resctrl_info)
 
-    @staticmethod
-    def __set_low_cache_alloc(resctrl_info: ResctrlInfo, cache_alloc: str):
-        schemata_l3_alloc = "L3:"
-        for id in range(resctrl_info.id_num):
-            schemata_l3_alloc += "%d=%s;" % (id, cache_alloc)
-        schemata_l3_alloc += "\n"
-        util.file_write(os.path.join(
-            LOW_VMS_RESGROUP_PATH, "schemata"), schemata_l3_alloc)
+    def __get_dynamic_control_config(self, resctrl_info: ResctrlInfo, resctrl_monitor: ResctrlMonitor):
+        self.dynamic_control = os.getenv("CACHE_MBW_DYNAMIC_CONTROL", "false").lower() == "true"
+        if not self.dynamic_control:
+            return
+        if not resctrl_monitor.mon_enabled:
+            LOGGER.warning("Resctrl monitoring is disabled, cache/mbw dynamic control is not able to start.")
+            self.dynamic_control = False
+            return
 
-    @staticmethod
-    def __set_low_mbw_alloc(resctrl_info: ResctrlInfo, mbw_alloc: str):
-        schemata_mbw_alloc = "MB:"
-        for id in range(resctrl_info.id_num):
-            schemata_mbw_alloc += "%d=%s;" % (id, mbw_alloc)
-        schemata_mbw_alloc += "\n"
-        util.file_write(os.path.join(
-            LOW_VMS_RESGROUP_PATH, "schemata"), schemata_mbw_alloc)
+        try:
+            low_vms_cache_max = int(os.getenv("MAX_LLC_WAYS_LOW_VMS", "4"))
+            low_vms_mbw_max = float(os.getenv("MAX_MBW_LOW_VMS", "0.5"))
+            self.mbw_watermark = (int(os.getenv("HIGH_VMS_MBW_LOW_WATERMARK", "2000")),
+                                  int(os.getenv("HIGH_VMS_MBW_HIGH_WATERMARK", "8000")))
+            self.llc_watermark = (float(os.getenv("HIGH_VMS_LLC_LOW_WATERMARK", "0.5")),
+                                  float(os.getenv("HIGH_VMS_LLC_HIGH_WATERMARK", "0.8")))
+        except ValueError:
+            LOGGER.error("Cache/mbw dynamic control parameter type is invalid.")
+            sys.exit(1)
+        if not self.low_vms_min_cache_ways <= low_vms_cache_max < resctrl_info.max_cache_ways:
+            LOGGER.error("Invalid environment variables: MAX_LLC_WAYS_LOW_VMS")
+            raise Exception
+        low_vms_mbw_max = int((low_vms_mbw_max * 100) // resctrl_info.mbw_gran) * resctrl_info.mbw_gran
+        if not self.low_vms_min_mbw <= low_vms_mbw_max <= 100:
+            LOGGER.error("Invalid environment variables: MAX_MBW_LOW_VMS")
+            raise Exception
+        if not 0 <= self.mbw_watermark[0] < self.mbw_watermark[1]:
+            LOGGER.error("Invalid environment variables: HIGH_VMS_MBW_(LOW|HIGH)_WATERMARK")
+            raise Exception
+        if not 0 <= self.llc_watermark[0] < self.llc_watermark[1] <= 1:
+            LOGGER.error("Invalid environment variables: HIGH_VMS_LLC_(LOW|HIGH)_WATERMARK")
+            raise Exception
+        self.low_vms_max_cache_ways = low_vms_cache_max
+        self.low_vms_max_mbw = low_vms_mbw_max
+        LOGGER.info("Cache/mbw dynamic control enabled, cache ways: %d-%d, mbw: %d-%d, "
+                    "mbw watermark: %s MB/s, llc watermark: %s"
+                    % (self.low_vms_min_cache_ways, self.low_vms_max_cache_ways, self.low_vms_min_mbw,
+                       self.low_vms_max_mbw, self.mbw_watermark, self.llc_watermark))
 
-    @staticmethod
-    def add_vm_pids(tasks_path):
+    def __get_next_alloc(self, resource, alloc, pressure, watermark, alloc_range, step):
+        if pressure > watermark[1]:
+            self.grow_cycles_dict[resource] = 0
+            return max(alloc - step, alloc_range[0])
+        if pressure >= watermark[0]:
+            self.grow_cycles_dict[resource] = 0
+            return alloc
+        self.grow_cycles_dict[resource] = self.grow_cycles_dict.get(resource, 0) + 1
+        if self.grow_cycles_dict.get(resource) < ADJUST_GROW_CYCLES:
+            return alloc
+        self.grow_cycles_dict[resource] = 0
+        return min(alloc + step, alloc_range[1])
+
+    def adjust_low_alloc(self, resctrl_info: ResctrlInfo, resctrl_monitor: ResctrlMonitor):
+        """
+        Move the low priority VMs allocation on every L3 domain by one step
+        against the load of high priority VMs on the same domain.
+        """
+        if not self.dynamic_control:
+            return
+        shrink_requested = self.shrink_requested
+        self.shrink_requested = False
+
+        for domain_id, low_vms_mbw in self.low_vms_mbw_dict.items():
+            high_vms_mbw = resctrl_monitor.get_bandwidth(DEFAULT_GROUP, domain_id) / BYTES_TO_MB
+            if shrink_requested:
+                high_vms_mbw = max(high_vms_mbw, self.mbw_watermark[1] + 1)
+            next_mbw = self.__get_next_alloc(("MB", domain_id), low_vms_mbw, high_vms_mbw, self.mbw_watermark,
+                                             (self.low_vms_min_mbw, self.low_vms_max_mbw), resctrl_info.mbw_gran)
+            if next_mbw != low_vms_mbw:
+                LOGGER.info("High priority VMs mbw on domain %d is %.0f MB/s, "
+                            "set low priority VMs mbw from %d to %d"
+                            % (domain_id, high_vms_mbw, low_vms_mbw, next_mbw))
+                self.low_vms_mbw_dict[domain_id] = next_mbw
+
+        for domain_id, low_vms_cache_ways in self.low_vms_cache_ways_dict.items():
+            l3_size = resctrl_info.l3_size_dict.get(domain_id)
+            if not l3_size:
+                continue
+            high_vms_llc = resctrl_monitor.get_llc_occupancy(DEFAULT_GROUP, domain_id) / l3_size
+            if shrink_requested:
+                high_vms_llc = max(high_vms_llc, self.llc_watermark[1] + 1)
+            next_cache_ways = self.__get_next_alloc(("L3", domain_id), low_vms_cache_ways, high_vms_llc,
+                                                    self.llc_watermark, (self.low_vms_min_cache_ways,
+                                                                         self.low_vms_max_cache_ways), 1)
+            if next_cache_ways != low_vms_cache_ways:
+                LOGGER.info("High priority VMs llc occupancy on domain %d is %.2f, "
+                            "set low priority VMs cache ways from %d to %d"
+                            % (domain_id, high_vms_llc, low_vms_cache_ways, next_cache_ways))
+                self.low_vms_cache_ways_dict[domain_id] = next_cache_ways
+
+        self.__set_low_alloc(resctrl_info)
+
+    def request_shrink(self):
+        """Called by analyzers from other jobs, the next adjustment shrinks the allocation of every domain."""
+        self.shrink_requested = True
+
+    def __set_low_alloc(self, resctrl_info: ResctrlInfo):
+        """Write the L3 and MB allocations of all domains at once, skipped by CGROUP_IO if nothing changed."""
+        schemata_alloc = "L3:%s\nMB:%s\n" % (
+            ";".join("%d=%s" % (domain_id, self.__get_cache_alloc(resctrl_info, cache_ways))
+                     for domain_id, cache_ways in sorted(self.low_vms_cache_ways_dict.items())),
+            ";".join("%d=%d" % (domain_id, mbw) for domain_id, mbw in sorted(self.low_vms_mbw_dict.items())))
+        CGROUP_IO.write(os.path.join(LOW_VMS_RESGROUP_PATH, "schemata"), schemata_alloc)
+
+    def add_vm_pids(self, tasks_path, resctrl_tsk_path=os.path.join(LOW_VMS_RESGROUP_PATH, "tasks")):
+        """Move the tasks of a VM cgroup into a resctrl group, only those not moved by the last scan."""
         if not os.access(tasks_path, os.R_OK):
             LOGGER.warning(
                 "The path %s is not readable, please check." % tasks_path)
             return
 
-        resctrl_tsk_path = os.path.join(LOW_VMS_RESGROUP_PATH, "tasks")
-        LOGGER.debug("Add %s pids to %s" % (tasks_path, resctrl_tsk_path))
+        known_tsk_path, known_tids = self.known_tids_dict.get(tasks_path, (None, set()))
+        if known_tsk_path != resctrl_tsk_path:
+            known_tids = set()
         try:
-            with open(tasks_path) as tasks:
-                for task in tasks:
-                    util.file_write(resctrl_tsk_path, task)
+            tids = set(CGROUP_IO.read(tasks_path).split())
+            new_tids = tids - known_tids
+            if new_tids:
+                LOGGER.debug("Add %d new pids of %s to %s" % (len(new_tids), tasks_path, resctrl_tsk_path))
+            for tid in new_tids:
+                try:
+                    CGROUP_IO.write(resctrl_tsk_path, tid, dedup=False)
+                except ProcessLookupError:
+                    # The thread has exited since the scan.
+                    tids.discard(tid)
         except IOError as e:
             LOGGER.error("Failed to add %s pids to resctrl: %s" % (tasks_path, str(e)))
+            self.known_tids_dict.pop(tasks_path, None)
             # If the VM doesn't stop, raise exception.
             if os.access(tasks_path, os.F_OK):
                 raise
+            return
+        self.known_tids_dict[tasks_path] = (resctrl_tsk_path, tids)
+
+    def prune_vm_pids(self, tasks_path_set):
+        """Forget the VMs which have exited and the resctrl groups nobody is moved into."""
+        released_tsk_path_set = set()
+        for tasks_path in [path for path in self.known_tids_dict if path not in tasks_path_set]:
+            released_tsk_path_set.add(self.known_tids_dict.pop(tasks_path)[0])
+            CGROUP_IO.evict_path(tasks_path)
+        released_tsk_path_set.difference_update(known_tsk_path
+                                                for known_tsk_path, _ in self.known_tids_dict.values())
+        for resctrl_tsk_path in released_tsk_path_set:
+            CGROUP_IO.evict_path(resctrl_tsk_path)
@@ -18,8 +18,8 @@ Description: This file is used for providing a CPU QoS controller
 
 import os
 
+from cgroupio import CGROUP_IO
 from logger import LOGGER
-import util
 
 LOW_PRIORITY_SLICES_PATH = "/sys/fs/cgroup/cpu/low_prio_machine.slice"
 LOW_PRIORITY_QOS_LEVEL = -1
@@ -28,20 +28,70 @@ OVERLOAG_DETECT_PERIOD_MS = 100
 OFFLINE_WAIT_INTERVAL_PATH = "/proc/sys/kernel/qos_offline_wait_interval_ms"
 OFFLINE_WAIT_INTERVAL_MS = 100
 MIN_QUOTA_US = 0
+CPU_CONTROL_MODE_STEP = "step"
+CPU_CONTROL_MODE_PID = "pid"
+# The integral term and the quota change of one cycle are bounded, so a long
+# lasting error neither winds the controller up nor cuts a VM off at once.
+PID_INTEGRAL_LIMIT = 5
+PID_MAX_STEP_RATIO = 0.5
+# PID mode aims slightly below the threshold, otherwise it settles on the threshold
+# and keeps crossing it.
+PID_SETPOINT_MARGIN = 0.02
+
+
+def get_cpu_control_mode():
+    cpu_control_mode = os.getenv("CPU_CONTROL_MODE", CPU_CONTROL_MODE_STEP).lower()
+    if cpu_control_mode not in (CPU_CONTROL_MODE_STEP, CPU_CONTROL_MODE_PID):
+        LOGGER.error("CPU_CONTROL_MODE parameter is invalid.")
+        raise ValueError
+    return cpu_control_mode
+
+
+class PidState:
+    def __init__(self, quota_us):
+        self.start_quota_us = quota_us
+        self.quota_us = quota_us
+        self.integral = 0
+        self.last_error = None
 
 
 class CpuController:
     def __init__(self):
         self.domain_adjust_dict = {}
         self.domain_recovery_list = []
+        self.control_mode = CPU_CONTROL_MODE_STEP
+        self.pid_kp = 0
+        self.pid_ki = 0
+        self.pid_kd = 0
+        self.ramp_ratio = 0
+        self.domain_pid_dict = {}
+
+    def init_cpu_controller(self):
+        self.control_mode = get_cpu_control_mode()
+        if self.control_mode != CPU_CONTROL_MODE_PID:
+            return
+        try:
+            self.pid_kp = float(os.getenv("CPU_PID_KP", "2.0"))
+            self.pid_ki = float(os.getenv("CPU_PID_KI", "0.5"))
+            self.pid_kd = float(os.getenv("CPU_PID_KD", "0"))
+            self.ramp_ratio = float(os.getenv("CPU_RAMP_RATIO", "0.1"))
+        except ValueError:
+            LOGGER.error("CPU PID controller parameter type is incorrect, please check.")
+            raise
+        if not 0 <= self.pid_kp <= 10 or not 0 <= self.pid_ki <= 10 or not 0 <= self.pid_kd <= 10 or \
+                not 0.01 <= self.ramp_ratio <= 1:
+            LOGGER.error("CPU PID controller parameter is invalid.")
+            raise ValueError
+        LOGGER.info("CPU bandwidth is controlled by PID, kp %.2f, ki %.2f, kd %.2f, ramp ratio %.2f"
+                    % (self.pid_kp, self.pid_ki, self.pid_kd, self.ramp_ratio))
 
     @staticmethod
     def set_low_priority_cgroup():
         qos_level_path = os.path.join(LOW_PRIORITY_SLICES_PATH, "cpu.qos_level")
         try:
-            util.file_write(qos_level_path, str(LOW_PRIORITY_QOS_LEVEL))
-            util.file_write(OVERLOAG_DETECT_PERIOD_PATH, str(OVERLOAG_DETECT_PERIOD_MS))
-            util.file_write(OFFLINE_WAIT_INTERVAL_PATH, str(OFFLINE_WAIT_INTERVAL_MS))
+            CGROUP_IO.write(qos_level_path, str(LOW_PRIORITY_QOS_LEVEL))
+            CGROUP_IO.write(OVERLOAG_DETECT_PERIOD_PATH, str(OVERLOAG_DETECT_PERIOD_MS))
+            CGROUP_IO.write(OFFLINE_WAIT_INTERVAL_PATH, str(OFFLINE_WAIT_INTERVAL_MS))
         except IOError as error:
             LOGGER.error("Failed to configure CPU QoS for low priority VMs: %s" % str(error))
             raise
@@ -49,21 +99,21 @@ class CpuController:
     def limit_domain_bandwidth(self, guest_info, quota_threshold, abnormal_threshold):
         global MIN_QUOTA_US
         period_path = os.path.join(LOW_PRIORITY_SLICES_PATH, "cpu.cfs_period_us")
-        cfs_period_us = int(util.file_read(period_path))
+        cfs_period_us = int(CGROUP_IO.read(period_path, cached=True))
         MIN_QUOTA_US = 0.9 * cfs_period_us
         vm_slices_path = LOW_PRIORITY_SLICES_PATH
 
         for domain_id in self.domain_adjust_dict:
             if self.domain_adjust_dict.get(domain_id) == abnormal_threshold:
                 domain = guest_info.low_prio_vm_dict.get(domain_id)
-                domain_quota_us = int(domain.domain_usage * cfs_period_us * quota_threshold)
+                domain_quota_us = int(guest_info.get_domain_usage(domain_id) * cfs_period_us * quota_threshold)
                 if domain_quota_us < MIN_QUOTA_US:
                     continue
 
                 quota_path = os.path.join(vm_slices_path, domain.cgroup_name, "cpu.cfs_quota_us")
 
                 try:
-                    util.file_write(quota_path, str(domain_quota_us), log=False)
+                    CGROUP_IO.write(quota_path, str(domain_quota_us), log=False)
                 except IOError as error:
                     # If VM doesn't stop, raise exception.
                     if os.access(quota_path, os.F_OK):
@@ -74,6 +124,86 @@ class CpuController:
                     LOGGER.info("Domain %s(%d) cpu bandwidth was limitted to %s"
                                 % (domain.domain_name, domain.domain_id, domain_quota_us))
 
+    @staticmethod
+    def __write_domain_quota(domain, quota_us):
+        quota_path = os.path.join(LOW_PRIORITY_SLICES_PATH, domain.cgroup_name, "cpu.cfs_quota_us")
+        try:
+            return CGROUP_IO.write(quota_path, str(quota_us), log=False)
+        except IOError as error:
+            # If VM doesn't stop, raise exception.
+            if os.access(quota_path, os.F_OK):
+                LOGGER.error("Failed to set domain %s(%d) cpu bandwidth to %s: %s"
+                             % (domain.domain_name, domain.domain_id, quota_us, str(error)))
+                raise
+        return False
+
+    def __get_domain_error(self, domain, package_error_dict):
+        package_error_list = [package_error_dict.get(package)
+                              for package, usage in domain.package_usage_dict.items()
+                              if usage > 0 and package in package_error_dict]
+        if not package_error_list:
+            return 0
+        return max(package_error_list) + PID_SETPOINT_MARGIN
+
+    def control_domain_bandwidth(self, guest_info, package_error_dict):
+        """
+        PID mode: the quota of every VM to be limited follows the error of the packages
+        it runs on, a positive error being the relative excess of power or the relative
+        deficit of frequency. VMs no longer to be limited ramp their quota up by
+        ramp_ratio per cycle until it reaches the global quota, or the quota they used
+        when they got limited if they have no global quota.
+        """
+        cfs_period_us = int(CGROUP_IO.read(os.path.join(LOW_PRIORITY_SLICES_PATH, "cpu.cfs_period_us"),
+                                           cached=True))
+        min_quota_us = 0.9 * cfs_period_us
+
+        for domain_id in [domain_id for domain_id in self.domain_pid_dict
+                          if domain_id not in guest_info.low_prio_vm_dict]:
+            del self.domain_pid_dict[domain_id]
+
+        for domain_id in self.domain_adjust_dict:
+            domain = guest_info.low_prio_vm_dict.get(domain_id)
+            if domain is None:
+                continue
+            pid_state = self.domain_pid_dict.get(domain_id)
+            if pid_state is None:
+                domain_quota_us = guest_info.get_domain_usage(domain_id) * cfs_period_us
+                if domain_quota_us < min_quota_us:
+                    continue
+                pid_state = PidState(domain_quota_us)
+                self.domain_pid_dict[domain_id] = pid_state
+
+            error = self.__get_domain_error(domain, package_error_dict)
+            pid_state.integral = max(-PID_INTEGRAL_LIMIT, min(PID_INTEGRAL_LIMIT, pid_state.integral + error))
+            derivative = 0 if pid_state.last_error is None else error - pid_state.last_error
+            pid_state.last_error = error
+            step_ratio = self.pid_kp * error + self.pid_ki * pid_state.integral + self.pid_kd * derivative
+            step_ratio = max(-PID_MAX_STEP_RATIO, min(PID_MAX_STEP_RATIO, step_ratio))
+            max_quota_us = domain.global_quota_config if domain.global_quota_config > 0 \
+                else pid_state.start_quota_us
+            pid_state.quota_us = max(min_quota_us, min(max_quota_us, pid_state.quota_us * (1 - step_ratio)))
+            if self.__write_domain_quota(domain, int(pid_state.quota_us)):
+                LOGGER.info("Domain %s(%d) cpu bandwidth was adjusted to %d, error %.3f"
+                            % (domain.domain_name, domain_id, pid_state.quota_us, error))
+
+        for domain_id in [domain_id for domain_id in self.domain_pid_dict
+                          if domain_id not in self.domain_adjust_dict]:
+            domain = guest_info.low_prio_vm_dict.get(domain_id)
+            pid_state = self.domain_pid_dict.get(domain_id)
+            # The controller starts afresh if the domain gets limited again during the ramp.
+            pid_state.integral = 0
+            pid_state.last_error = None
+            pid_state.quota_us += self.ramp_ratio * pid_state.start_quota_us
+            max_quota_us = domain.global_quota_config if domain.global_quota_config > 0 \
+                else pid_state.start_quota_us
+            if pid_state.quota_us < max_quota_us:
+                self.__write_domain_quota(domain, int(pid_state.quota_us))
+                continue
+            del self.domain_pid_dict[domain_id]
+            self.__write_domain_quota(domain, domain.global_quota_config)
+            LOGGER.info("Domain %s(%d) cpu bandwidth was recoveried to %s"
+                        % (domain.domain_name, domain_id, domain.global_quota_config))
+
     def recovery_domain_bandwidth(self, guest_info):
         vm_slices_path = LOW_PRIORITY_SLICES_PATH
 
@@ -83,7 +213,7 @@ class CpuController:
             quota_path = os.path.join(vm_slices_path, domain.cgroup_name, "cpu.cfs_quota_us")
 
             try:
-                util.file_write(quota_path, str(initial_bandwidth), log=False)
+                CGROUP_IO.write(quota_path, str(initial_bandwidth), log=False)
             except IOError as error:
                 # If VM doesn't stop, raise exception.
                 if os.access(quota_path, os.F_OK):
@@ -102,7 +232,7 @@ class CpuController:
             initial_bandwidth = domain.global_quota_config
             quota_path = os.path.join(vm_slices_path, domain.cgroup_name, "cpu.cfs_quota_us")
             try:
-                util.file_write(quota_path, str(initial_bandwidth), log=False)
+                CGROUP_IO.write(quota_path, str(initial_bandwidth), log=False)
             except IOError:
                 if os.access(quota_path, os.F_OK):
                     LOGGER.error("Failed to reset domain %s(%d) cpu bandwidth to its initial bandwidth %s!"
@@ -121,6 +251,13 @@ class CpuController:
         LOGGER.info("The list of adjustment is %s, the list of recovery is %s"
                     % (self.domain_adjust_dict, self.domain_recovery_list))
 
+    def control_step(self, guest_info, quota_threshold, abnormal_threshold):
+        """Limit and recover the domains selected by the analyzers in step mode."""
+        self.check_adjust_recover_list(guest_info)
+        self.limit_domain_bandwidth(guest_info, quota_threshold, abnormal_threshold)
+        self.recovery_domain_bandwidth(guest_info)
+        self.refresh_adjust_recover_list()
+
     def refresh_adjust_recover_list(self):
         self.domain_recovery_list.clear()
         for domain_id in self.domain_adjust_dict:
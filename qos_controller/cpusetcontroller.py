@@ -0,0 +1,236 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for moving low priority VMs off hot CPUs with cpuset
+"""
+# @code
+
+import os
+
+from cgroupio import CGROUP_IO
+from data_collector.cgroupusage import CGRP_ROOT_PATH, CGRP_V2_CONTROLLERS_PATH
+from logger import LOGGER
+import util
+
+CPUSET_CGRP_PATH = "/sys/fs/cgroup/cpuset"
+LOW_VMS_SLICE = "low_prio_machine.slice"
+CPUS_FILE = "cpuset.cpus"
+EFFECTIVE_CPUS_FILE_V2 = "cpuset.cpus.effective"
+SUBTREE_CONTROL_FILE = "cgroup.subtree_control"
+
+
+class CpusetPlacement:
+    def __init__(self, scope_path, original_cpus, original_value, child_paths):
+        self.scope_path = scope_path
+        self.original_cpus = original_cpus
+        # Empty on cgroup v2 if the scope inherits the cpus of the slice.
+        self.original_value = original_value
+        self.child_paths = child_paths
+        self.cpus = original_cpus
+        self.calm_cycles = 0
+
+
+class CpusetController:
+    """
+    Moves the low priority VMs running on hot CPUs, which the analyzers report
+    every cycle, off them by rewriting the cpuset of their scopes. A VM keeps
+    as many CPUs as it had, taken from its own CPUs which aren't hot first,
+    then from the coolest CPUs of its NUMA nodes, its packages and the other
+    packages in this order. A moved VM stays on its CPUs while none of them is
+    hot. Its original CPUs come back once none of them has been hot for
+    rollback_cycles. The moved VMs no longer need their CPU
+    bandwidth limited, so they are recovered from CpuController.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.cgroup_v2 = False
+        self.slice_path = None
+        self.rollback_cycles = 0
+        self.hot_cpus = set()
+        self.placement_dict = {}
+        self.pinned_scope_set = set()
+
+    def init_cpuset_controller(self):
+        if os.getenv("CPUSET_QOS_MANAGEMENT", "false").lower() != "true":
+            return
+        try:
+            self.rollback_cycles = int(os.getenv("CPUSET_ROLLBACK_CYCLES", "5"))
+        except ValueError:
+            LOGGER.error("CPUSET_ROLLBACK_CYCLES parameter type is incorrect, please check.")
+            raise
+        if self.rollback_cycles < 1 or self.rollback_cycles > 60:
+            LOGGER.error("CPUSET_ROLLBACK_CYCLES parameter is invalid.")
+            raise ValueError
+        self.cgroup_v2 = os.access(CGRP_V2_CONTROLLERS_PATH, os.R_OK)
+        if self.cgroup_v2:
+            self.slice_path = os.path.join(CGRP_ROOT_PATH, LOW_VMS_SLICE)
+            if not self.__has_cpuset_controller(self.slice_path):
+                LOGGER.warning("cpuset is not enabled in %s, cpuset controller is not able to start."
+                               % os.path.join(self.slice_path, SUBTREE_CONTROL_FILE))
+                return
+        else:
+            self.slice_path = os.path.join(CPUSET_CGRP_PATH, LOW_VMS_SLICE)
+        self.enabled = True
+        LOGGER.info("Cpuset controller started on %s, rollback after %d cycles"
+                    % (self.slice_path, self.rollback_cycles))
+
+    def report_hot_cpus(self, cpus):
+        """Called by the analyzers before place_low_domains in the same cycle."""
+        if self.enabled:
+            self.hot_cpus.update(cpus)
+
+    @staticmethod
+    def __has_cpuset_controller(cgroup_path):
+        """On cgroup v2 the children of cgroup_path only have cpuset files if it enables cpuset for them."""
+        return "cpuset" in CGROUP_IO.read(os.path.join(cgroup_path, SUBTREE_CONTROL_FILE)).split()
+
+    @staticmethod
+    def __read_cpus(cgroup_path):
+        return util.parse_cpu_list(CGROUP_IO.read(os.path.join(cgroup_path, CPUS_FILE)))
+
+    @staticmethod
+    def __get_child_paths(scope_path):
+        with os.scandir(scope_path) as it:
+            return [entry.path for entry in it if entry.is_dir()]
+
+    def __get_placement(self, domain):
+        placement = self.placement_dict.get(domain.domain_id)
+        if placement is not None or domain.cgroup_name in self.pinned_scope_set:
+            return placement
+        scope_path = os.path.join(self.slice_path, domain.cgroup_name)
+        original_value = CGROUP_IO.read(os.path.join(scope_path, CPUS_FILE))
+        original_cpus = util.parse_cpu_list(original_value)
+        if not original_cpus:
+            # cgroup v2 leaves cpuset.cpus empty unless set, the scope runs on the cpus of the slice.
+            original_cpus = util.parse_cpu_list(CGROUP_IO.read(os.path.join(scope_path, EFFECTIVE_CPUS_FILE_V2)))
+
+        child_paths = []
+        if not self.cgroup_v2 or self.__has_cpuset_controller(scope_path):
+            for child_path in self.__get_child_paths(scope_path):
+                child_cpus = self.__read_cpus(child_path)
+                if self.cgroup_v2 and not child_cpus:
+                    # Inherits the cpus of the scope, follows it without being written.
+                    continue
+                if child_cpus != original_cpus:
+                    # vCPUs or emulator pinned inside the VM's cpus, leave them to the quota.
+                    LOGGER.debug("Domain %s(%d) has pinned cpus, not moved by cpuset"
+                                 % (domain.domain_name, domain.domain_id))
+                    self.pinned_scope_set.add(domain.cgroup_name)
+                    return None
+                child_paths.append(child_path)
+        placement = CpusetPlacement(scope_path, original_cpus, original_value, child_paths)
+        self.placement_dict[domain.domain_id] = placement
+        return placement
+
+    @staticmethod
+    def __write_cpus(placement, cpus, scope_value=None):
+        """Children must stay within their parent: expand the scope first, shrink its children first."""
+        union_cpus = sorted(set(placement.cpus).union(cpus))
+        if union_cpus != sorted(placement.cpus):
+            for cgroup_path in [placement.scope_path] + placement.child_paths:
+                CGROUP_IO.write(os.path.join(cgroup_path, CPUS_FILE), util.format_cpu_list(union_cpus))
+        if union_cpus != sorted(cpus):
+            for cgroup_path in placement.child_paths + [placement.scope_path]:
+                CGROUP_IO.write(os.path.join(cgroup_path, CPUS_FILE), util.format_cpu_list(cpus))
+        if scope_value is not None:
+            # An empty value makes a cgroup v2 scope inherit the cpus of the slice again.
+            CGROUP_IO.write(os.path.join(placement.scope_path, CPUS_FILE), scope_value or "\n")
+        placement.cpus = sorted(cpus)
+
+    @staticmethod
+    def __get_placement_order(placement, host_topo, cpu_usage):
+        packages = set(host_topo.cpu_topo_list[cpu] for cpu in placement.original_cpus)
+        nodes = set(host_topo.numa_node_list[cpu] for cpu in placement.original_cpus)
+        return sorted(range(host_topo.max_cpu_nums),
+                      key=lambda cpu: (host_topo.numa_node_list[cpu] not in nodes,
+                                       host_topo.cpu_topo_list[cpu] not in packages, cpu_usage[cpu]))
+
+    def __place_domain(self, domain, host_topo, hot_cpus, cpu_usage):
+        placement = self.__get_placement(domain)
+        if placement is None:
+            return False
+        # Start from the current cpus, so that a moved VM doesn't bounce between cool CPUs.
+        cpus = [cpu for cpu in placement.cpus if cpu not in hot_cpus]
+        if len(cpus) < len(placement.original_cpus):
+            for cpu in self.__get_placement_order(placement, host_topo, cpu_usage):
+                if len(cpus) >= len(placement.original_cpus):
+                    break
+                if cpu not in hot_cpus and cpu not in cpus:
+                    cpus.append(cpu)
+        if not cpus or sorted(cpus) == placement.cpus:
+            return False
+        self.__write_cpus(placement, cpus)
+        LOGGER.info("Domain %s(%d) cpus were moved to %s"
+                    % (domain.domain_name, domain.domain_id, util.format_cpu_list(cpus)))
+        return True
+
+    def __rollback_domain(self, domain, placement):
+        self.__write_cpus(placement, placement.original_cpus, placement.original_value)
+        del self.placement_dict[domain.domain_id]
+        LOGGER.info("Domain %s(%d) cpus were rolled back to %s"
+                    % (domain.domain_name, domain.domain_id, util.format_cpu_list(placement.original_cpus)))
+
+    def place_low_domains(self, guest_info, host_topo, cpu_controller):
+        if not self.enabled:
+            return
+        hot_cpus = self.hot_cpus
+        self.hot_cpus = set()
+        for domain_id in [domain_id for domain_id in self.placement_dict
+                          if domain_id not in guest_info.low_prio_vm_dict]:
+            del self.placement_dict[domain_id]
+        scope_set = set(domain.cgroup_name for domain in guest_info.low_prio_vm_dict.values())
+        self.pinned_scope_set.intersection_update(scope_set)
+
+        usage_matrix = guest_info.usage_matrix
+        cpu_usage = [high + low for high, low in zip(usage_matrix.get_priority_usage(0),
+                                                     usage_matrix.get_priority_usage(1))]
+        moved_set = set()
+        for domain_id in usage_matrix.running_domain_in_cpus(hot_cpus, 1):
+            domain = guest_info.low_prio_vm_dict.get(domain_id)
+            if domain is None or domain.cgroup_name is None:
+                continue
+            try:
+                if self.__place_domain(domain, host_topo, hot_cpus, cpu_usage):
+                    moved_set.add(domain_id)
+            except OSError as error:
+                # The domain may be stopping, otherwise it is rolled back once the pressure clears.
+                LOGGER.warning("Failed to move domain %s(%d) cpus: %s"
+                               % (domain.domain_name, domain_id, str(error)))
+
+        for domain_id, placement in list(self.placement_dict.items()):
+            if domain_id in moved_set or hot_cpus.intersection(placement.original_cpus):
+                placement.calm_cycles = 0
+                continue
+            placement.calm_cycles += 1
+            if placement.calm_cycles < self.rollback_cycles:
+                continue
+            domain = guest_info.low_prio_vm_dict.get(domain_id)
+            try:
+                self.__rollback_domain(domain, placement)
+            except OSError as error:
+                LOGGER.warning("Failed to roll back domain %s(%d) cpus: %s"
+                               % (domain.domain_name, domain_id, str(error)))
+
+        for domain_id in moved_set:
+            if domain_id in cpu_controller.domain_adjust_dict:
+                # check_adjust_recover_list moves it to recovery in this cycle.
+                cpu_controller.domain_adjust_dict[domain_id] = 0
+
+    def rollback_all(self):
+        for domain_id, placement in list(self.placement_dict.items()):
+            try:
+                self.__write_cpus(placement, placement.original_cpus, placement.original_value)
+            except OSError as error:
+                LOGGER.warning("Failed to roll back %s cpus: %s" % (placement.scope_path, str(error)))
+            del self.placement_dict[domain_id]
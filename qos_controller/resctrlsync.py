@@ -0,0 +1,129 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for syncing the tasks of low priority vms into resctrl
+"""
+# @code
+
+import os
+import threading
+import time
+
+from data_collector.cgroupusage import CGRP_ROOT_PATH, CGRP_V2_CONTROLLERS_PATH
+from data_collector.cgroupwatcher import CgroupWatcher
+from logger import LOGGER
+
+LOW_VMS_SLICE = "low_prio_machine.slice"
+LOW_VMS_PID_CGRP_PATH = "/sys/fs/cgroup/pids/low_prio_machine.slice"
+RESCTRL_SYNC_MODE_POLL = "poll"
+RESCTRL_SYNC_MODE_EVENT = "event"
+# Neither cgroup v1 nor cgroup.events of v2 notify threads created in an existing
+# scope, e.g. I/O threads or hotplugged vCPUs, so the full scan keeps its pace in
+# event mode too.
+RESCTRL_SYNC_INTERVAL_S = 0.5
+# cgroup v1 doesn't notify new threads, so a scope which has changed is rescanned
+# at a high rate for a while, long enough for QEMU to create its vCPU threads.
+BURST_SYNC_INTERVAL_S = 0.01
+BURST_SYNC_DURATION_S = 2
+ALL_SCOPES = None
+
+
+def get_resctrl_sync_mode():
+    resctrl_sync_mode = os.getenv("RESCTRL_SYNC_MODE", RESCTRL_SYNC_MODE_POLL).lower()
+    if resctrl_sync_mode not in (RESCTRL_SYNC_MODE_POLL, RESCTRL_SYNC_MODE_EVENT):
+        LOGGER.error("RESCTRL_SYNC_MODE parameter is invalid.")
+        raise ValueError
+    return resctrl_sync_mode
+
+
+def get_resctrl_sync_interval():
+    return RESCTRL_SYNC_INTERVAL_S
+
+
+class ResctrlSync:
+    """
+    Moves the tasks of low priority VMs into their resctrl groups. The full
+    scan runs periodically. In event mode, new scopes and domain start events
+    also trigger burst rescans, which move the threads of a starting VM within
+    milliseconds instead of at the next full scan.
+    """
+    def __init__(self, cachembw_controller, vm_mon_groups):
+        self.cachembw_controller = cachembw_controller
+        self.vm_mon_groups = vm_mon_groups
+        self.cgroup_watcher = CgroupWatcher()
+        self.burst_deadline_dict = {}
+        self.burst_condition = threading.Condition()
+
+    def init_resctrl_sync(self, domain_inventory):
+        if get_resctrl_sync_mode() != RESCTRL_SYNC_MODE_EVENT:
+            return
+        burst_thread = threading.Thread(target=self.__run_burst_sync, name="resctrlBurstSync", daemon=True)
+        burst_thread.start()
+        # The scope names are the same in every hierarchy, the watched one is where cgroup.events lives.
+        if os.access(CGRP_V2_CONTROLLERS_PATH, os.R_OK):
+            self.cgroup_watcher.start_watcher(os.path.join(CGRP_ROOT_PATH, LOW_VMS_SLICE),
+                                              self.trigger_burst_sync)
+        else:
+            self.cgroup_watcher.start_watcher(LOW_VMS_PID_CGRP_PATH, self.trigger_burst_sync)
+        domain_inventory.add_start_listener(lambda domain: self.trigger_burst_sync(ALL_SCOPES))
+        LOGGER.info("Resctrl sync is event driven, full scan interval is %.1fs" % RESCTRL_SYNC_INTERVAL_S)
+
+    def trigger_burst_sync(self, scope_name):
+        """Called from the watcher and libvirt event threads, scope_name is ALL_SCOPES for all."""
+        with self.burst_condition:
+            self.burst_deadline_dict[scope_name] = time.monotonic() + BURST_SYNC_DURATION_S
+            self.burst_condition.notify()
+
+    def __run_burst_sync(self):
+        while True:
+            with self.burst_condition:
+                while not self.burst_deadline_dict:
+                    self.burst_condition.wait()
+                now = time.monotonic()
+                for scope_name in [scope for scope, deadline in self.burst_deadline_dict.items()
+                                   if deadline < now]:
+                    del self.burst_deadline_dict[scope_name]
+                scope_list = list(self.burst_deadline_dict)
+
+            try:
+                if ALL_SCOPES in scope_list:
+                    self.sync_all_vm_pids()
+                else:
+                    for scope_name in scope_list:
+                        self.__sync_scope_pids(scope_name)
+            except Exception:
+                # Nothing restarts this thread, the periodic full scan reports it again if the error persists.
+                LOGGER.exception("Burst resctrl sync failed")
+            time.sleep(BURST_SYNC_INTERVAL_S)
+
+    def __sync_scope_pids(self, scope_name):
+        tasks_path = os.path.join(LOW_VMS_PID_CGRP_PATH, scope_name, "tasks")
+        if not os.access(tasks_path, os.F_OK):
+            # The scope has gone, stop the burst.
+            with self.burst_condition:
+                self.burst_deadline_dict.pop(scope_name, None)
+            return
+        with self.vm_mon_groups.lock:
+            self.cachembw_controller.add_vm_pids(tasks_path, self.vm_mon_groups.get_tasks_path(scope_name))
+
+    def sync_all_vm_pids(self):
+        tasks_path_set = set()
+        with self.vm_mon_groups.lock, os.scandir(LOW_VMS_PID_CGRP_PATH) as it:
+            for entry in it:
+                if entry.is_file():
+                    continue
+                tasks_path = os.path.join(LOW_VMS_PID_CGRP_PATH, entry.name, "tasks")
+                tasks_path_set.add(tasks_path)
+                self.cachembw_controller.add_vm_pids(tasks_path, self.vm_mon_groups.get_tasks_path(entry.name))
+            self.cachembw_controller.prune_vm_pids(tasks_path_set)
@@ -19,6 +19,7 @@ Description: This file is used for skylark main framework
 from __future__ import division
 
 import atexit
+from datetime import datetime
 import fcntl
 import os
 import platform
@@ -32,12 +33,20 @@ from apscheduler.events import EVENT_JOB_ERROR
 import libvirt
 
 from data_collector.datacollector import DataCollector
+from data_collector.domaininventory import start_event_loop
+from data_collector.hostinfo import get_power_collector
+from data_collector.poweraccount import get_power_sample_interval
 from data_collector.msrlibrary import MsrLibrary
 from logger import LOGGER
+from qos_analyzer.interferenceanalyzer import InterferenceAnalyzer
+from qos_analyzer.latencyanalyzer import LatencyAnalyzer
 from qos_analyzer.poweranalyzer import PowerAnalyzer
+from qos_analyzer.smtanalyzer import SmtAnalyzer
 from qos_controller.cpucontroller import CpuController
+from qos_controller.cpusetcontroller import CpusetController
 from qos_controller.netcontroller import NetController
 from qos_controller.cachembwcontroller import CacheMBWController
+from qos_controller.resctrlsync import ResctrlSync, get_resctrl_sync_interval
 import util
 
 QOS_MANAGER_ENTRY = None
@@ -47,7 +56,6 @@ LIBVIRT_DRIVE_TYPE = None
 PID_FILE = None
 MSR_PATH = "/dev/cpu/0/msr"
 PID_FILE_NAME = "/var/run/skylarkd.pid"
-LOW_VMS_PID_CGRP_PATH = "/sys/fs/cgroup/pids/low_prio_machine.slice"
 
 
 class QosManager:
@@ -55,9 +63,14 @@ class QosManager:
         self.vir_conn = vir_conn
         self.data_collector = DataCollector()
         self.power_analyzer = PowerAnalyzer()
+        self.latency_analyzer = LatencyAnalyzer()
+        self.interference_analyzer = InterferenceAnalyzer()
+        self.smt_analyzer = SmtAnalyzer()
         self.cpu_controller = CpuController()
+        self.cpuset_controller = CpusetController()
         self.net_controller = NetController()
         self.cachembw_controller = CacheMBWController()
+        self.resctrl_sync = ResctrlSync(self.cachembw_controller, self.data_collector.vm_mon_groups)
 
     def scheduler_listener(self, event):
         if event.exception:
@@ -69,11 +82,24 @@ class QosManager:
         self.scheduler = BlockingScheduler(logger=LOGGER)
         if os.getenv("POWER_QOS_MANAGEMENT", "false").lower() == "true":
             self.scheduler.add_job(self.__do_power_manage, trigger='interval', seconds=1, id='do_power_manage')
-        self.scheduler.add_job(self.__do_resctrl_sync, trigger='interval', seconds=0.5, id='do_resctrl_sync')
+            self.scheduler.add_job(self.__do_power_sample, trigger='interval',
+                                   seconds=get_power_sample_interval(), id='do_power_sample')
+        elif any(os.getenv(switch, "false").lower() == "true" for switch in
+                 ("LATENCY_QOS_MANAGEMENT", "INTERFERENCE_QOS_MANAGEMENT", "SMT_QOS_MANAGEMENT")):
+            self.scheduler.add_job(self.__do_cpu_manage, trigger='interval', seconds=1, id='do_cpu_manage')
+        self.scheduler.add_job(self.__do_resctrl_sync, trigger='interval',
+                               seconds=get_resctrl_sync_interval(), id='do_resctrl_sync')
+        self.scheduler.add_job(self.__do_resctrl_monitor, trigger='interval', seconds=1, id='do_resctrl_monitor')
+        # The latency analyzer reads the pressure itself in its own tick.
+        if os.getenv("PSI_MONITOR", "false").lower() == "true" and \
+                os.getenv("LATENCY_QOS_MANAGEMENT", "false").lower() != "true":
+            self.scheduler.add_job(self.__do_psi_monitor, trigger='interval', seconds=1, id='do_psi_monitor')
         self.scheduler.add_listener(self.scheduler_listener, EVENT_JOB_ERROR)
 
     def init_data_collector(self):
         self.data_collector.set_static_base_info()
+        self.data_collector.register_domain_events(self.vir_conn)
+        atexit.register(self.data_collector.deregister_domain_events, self.vir_conn)
         self.data_collector.update_base_info(self.vir_conn)
         if os.getenv("POWER_QOS_MANAGEMENT", "false").lower() == "true":
             self.data_collector.set_static_power_info()
@@ -81,29 +107,86 @@ class QosManager:
     def init_qos_analyzer(self):
         if os.getenv("POWER_QOS_MANAGEMENT", "false").lower() == "true":
             self.power_analyzer.set_hotspot_threshold(self.data_collector)
+        self.latency_analyzer.set_latency_slo()
+        self.interference_analyzer.set_interference_threshold()
+        self.smt_analyzer.set_smt_threshold(self.data_collector.host_info.host_topo)
 
     def init_qos_controller(self):
         self.cpu_controller.set_low_priority_cgroup()
         if os.getenv("POWER_QOS_MANAGEMENT", "false").lower() == "true":
+            self.cpu_controller.init_cpu_controller()
+        if os.getenv("POWER_QOS_MANAGEMENT", "false").lower() == "true" or \
+                any(analyzer.enabled for analyzer in self.__get_cpu_analyzers()):
             atexit.register(self.cpu_controller.reset_domain_bandwidth, self.data_collector.guest_info)
-        self.cachembw_controller.init_cachembw_controller(self.data_collector.host_info.resctrl_info)
+        self.cpuset_controller.init_cpuset_controller()
+        atexit.register(self.cpuset_controller.rollback_all)
+        self.cachembw_controller.init_cachembw_controller(self.data_collector.host_info.resctrl_info,
+                                                          self.data_collector.resctrl_monitor)
+        self.resctrl_sync.init_resctrl_sync(self.data_collector.guest_info.inventory)
         self.net_controller.init_net_controller()
+        self.data_collector.psi_collector.start_psi_triggers(self.__wake_on_stall)
 
     def start_scheduler(self):
         self.scheduler.start()
 
+    def __get_cpu_analyzers(self):
+        return self.latency_analyzer, self.interference_analyzer, self.smt_analyzer
+
+    def __analyze_interference(self):
+        """Select low priority VMs to limit for run delay, CPI and SMT siblings of high priority VMs."""
+        if self.latency_analyzer.enabled:
+            self.data_collector.update_run_delay_info()
+            self.data_collector.update_psi_info()
+            self.latency_analyzer.latency_analysis(self.data_collector.guest_info,
+                                                   self.data_collector.psi_collector, self.cpu_controller,
+                                                   self.cachembw_controller)
+        if self.interference_analyzer.enabled:
+            self.data_collector.update_vm_perf_info()
+            self.interference_analyzer.interference_analysis(self.data_collector.guest_info, self.cpu_controller,
+                                                             self.cachembw_controller)
+        if self.smt_analyzer.enabled:
+            self.smt_analyzer.smt_analysis(self.data_collector.guest_info, self.cpu_controller)
+            self.cpuset_controller.report_hot_cpus(self.smt_analyzer.shared_cpus)
+
     def __do_power_manage(self):
         self.data_collector.update_base_info(self.vir_conn)
         self.data_collector.update_power_info()
-        self.power_analyzer.power_manage(self.data_collector, self.cpu_controller)
+        self.__analyze_interference()
+        self.power_analyzer.power_manage(self.data_collector, self.cpu_controller, self.cpuset_controller)
+
+    def __do_cpu_manage(self):
+        """Used when power QoS management, which limits the selected VMs, is disabled."""
+        analyzer = next((analyzer for analyzer in self.__get_cpu_analyzers() if analyzer.enabled), None)
+        if analyzer is None:
+            # e.g. SMT QoS management on a host without SMT.
+            return
+        self.data_collector.update_base_info(self.vir_conn)
+        self.__analyze_interference()
+        self.cpuset_controller.place_low_domains(self.data_collector.guest_info,
+                                                 self.data_collector.host_info.host_topo, self.cpu_controller)
+        self.cpu_controller.control_step(self.data_collector.guest_info,
+                                         analyzer.quota_threshold, analyzer.abnormal_threshold)
+
+    def __do_power_sample(self):
+        self.data_collector.sample_power_info()
+
+    def __do_resctrl_monitor(self):
+        self.data_collector.update_resctrl_monitor_info()
+        self.cachembw_controller.adjust_low_alloc(self.data_collector.host_info.resctrl_info,
+                                                  self.data_collector.resctrl_monitor)
+
+    def __do_psi_monitor(self):
+        self.data_collector.update_psi_info()
+
+    def __wake_on_stall(self, resource):
+        """Called from the PSI trigger thread, runs the monitor and control jobs now."""
+        LOGGER.info("High priority VMs stall on %s, wake up the controllers" % resource)
+        for job_id in ("do_psi_monitor", "do_power_manage", "do_cpu_manage", "do_resctrl_monitor"):
+            if self.scheduler.get_job(job_id) is not None:
+                self.scheduler.modify_job(job_id, next_run_time=datetime.now())
 
     def __do_resctrl_sync(self):
-        with os.scandir(LOW_VMS_PID_CGRP_PATH) as it:
-            for entry in it:
-                if entry.is_file():
-                    continue
-                tasks_path = os.path.join(LOW_VMS_PID_CGRP_PATH, entry.name, "tasks")
-                self.cachembw_controller.add_vm_pids(tasks_path)
+        self.resctrl_sync.sync_all_vm_pids()
 
 
 def create_pid_file():
@@ -158,6 +241,7 @@ def func_daemon():
 
     LOGGER.info("Try to open libvirtd connection")
     try:
+        start_event_loop()
         LIBVIRT_CONN = libvirt.open(LIBVIRT_URI)
     except libvirt.libvirtError:
         LIBVIRT_CONN = None
@@ -224,6 +308,8 @@ def setup_vm_env():
 def check_dev_msr():
     if os.getenv("POWER_QOS_MANAGEMENT", "false").lower() != "true":
         return
+    if get_power_collector() == "powercap":
+        return
 
     try:
         os.stat(MSR_PATH)
@@ -262,6 +348,12 @@ def check_cpu_arch():
         LOGGER.warning("Skylark only supports x86 architecture.")
         os._exit(0)
 
+    try:
+        if get_power_collector() == "powercap":
+            return
+    except ValueError:
+        os._exit(1)
+
     try:
         extern_lib = MsrLibrary()
     except OSError as error:
@@ -0,0 +1,158 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for benchmarking the guest info update against a fake libvirt connection
+"""
+# @code
+
+"""
+Usage: python3 tools/bench_guestinfo.py [--ticks N] [--cpus N]
+
+Times GuestInfo.update_guest_info for 50, 200 and 500 domains with each stats
+collector that needs no kernel support, against a fake connection whose
+domains burn random CPU time on random CPUs. It also counts the domains whose
+usage matrix row does not add up to their usage, which catches a per-CPU split
+stuck at zero in bulk mode. Run it from the top of the source tree.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_collector import guestinfo
+
+DOMAIN_NUMS_LIST = (50, 200, 500)
+COLLECTOR_LIST = (guestinfo.STATS_COLLECTOR_LIBVIRT, guestinfo.STATS_COLLECTOR_BULK)
+TICK_NS = 1000000000
+CPUS_PER_PACKAGE = 32
+
+
+class FakeTopology:
+    def __init__(self, cpu_nums):
+        self.max_cpu_nums = cpu_nums
+        self.package_cpus_dict = {package: list(range(first_cpu, min(first_cpu + CPUS_PER_PACKAGE, cpu_nums)))
+                                  for package, first_cpu in enumerate(range(0, cpu_nums, CPUS_PER_PACKAGE))}
+        self.package_set = set(self.package_cpus_dict)
+
+
+class FakeDomain:
+    def __init__(self, domain_id, priority, cpu_nums, rand):
+        self.domain_id = domain_id
+        self.priority = priority
+        self.uuid = "00000000-0000-0000-0000-%012d" % domain_id
+        self.rand = rand
+        # Every domain runs on a few CPUs, and is idle now and then.
+        self.cpus = rand.sample(range(cpu_nums), min(4, cpu_nums))
+        self.cpu_time = [0] * cpu_nums
+
+    def name(self):
+        return "bench-%d" % self.domain_id
+
+    def ID(self):
+        return self.domain_id
+
+    def UUIDString(self):
+        return self.uuid
+
+    def XMLDesc(self):
+        partition = guestinfo.LOW_PRIORITY if self.priority else guestinfo.HIGH_PRIORITY
+        return "<domain><resource><partition>/%s</partition></resource></domain>" % partition
+
+    def getCPUStats(self, total=False):
+        return [{"cpu_time": cpu_time} for cpu_time in self.cpu_time]
+
+    def run(self):
+        if self.rand.random() < 0.2:
+            return
+        for cpu in self.cpus:
+            self.cpu_time[cpu] += self.rand.randrange(TICK_NS)
+
+
+class FakeConnection:
+    def __init__(self, domain_nums, cpu_nums, seed):
+        rand = random.Random(seed)
+        self.domain_list = [FakeDomain(domain_id, domain_id % 2, cpu_nums, rand)
+                            for domain_id in range(1, domain_nums + 1)]
+
+    def listAllDomains(self, flags=0):
+        return self.domain_list
+
+    def getAllDomainStats(self, stats=0, flags=0):
+        return [(domain, {"cpu.time": sum(domain.cpu_time)}) for domain in self.domain_list]
+
+    def run(self):
+        for domain in self.domain_list:
+            domain.run()
+
+
+def make_cgroup_tree(root, conn):
+    for slice_name in (guestinfo.HIGH_PRIORITY, guestinfo.LOW_PRIORITY):
+        os.makedirs(os.path.join(root, slice_name + ".slice"))
+    for domain in conn.domain_list:
+        slice_name = guestinfo.LOW_PRIORITY if domain.priority else guestinfo.HIGH_PRIORITY
+        os.makedirs(os.path.join(root, slice_name + ".slice",
+                                 "machine-qemu\\x2d%d\\x2dbench.scope" % domain.domain_id))
+
+
+def count_unbalanced_domains(guest_info):
+    unbalanced_nums = 0
+    for domain in guest_info.vm_dict.values():
+        if abs(sum(domain.cpu_usage) - domain.domain_usage) > 1e-6 * max(domain.domain_usage, 1):
+            unbalanced_nums += 1
+    return unbalanced_nums
+
+
+def run_bench(collector, domain_nums, cpu_nums, ticks):
+    conn = FakeConnection(domain_nums, cpu_nums, domain_nums)
+    host_topo = FakeTopology(cpu_nums)
+    os.environ["GUEST_STATS_COLLECTOR"] = collector
+    with tempfile.TemporaryDirectory() as cgroup_root:
+        make_cgroup_tree(cgroup_root, conn)
+        # Where parse_domain_xml looks for the scopes with cgroup v1 and v2.
+        guestinfo.PIDS_CGRP_PATH = cgroup_root
+        guestinfo.CGRP_ROOT_PATH = cgroup_root
+        guest_info = guestinfo.GuestInfo()
+        guest_info.set_stats_collector(host_topo)
+        guest_info.set_usage_history(host_topo)
+        guest_info.update_guest_info(conn, host_topo)
+
+        elapsed_ns = 0
+        unbalanced_nums = 0
+        for _ in range(ticks):
+            conn.run()
+            start = time.perf_counter_ns()
+            guest_info.update_guest_info(conn, host_topo)
+            elapsed_ns += time.perf_counter_ns() - start
+            unbalanced_nums = max(unbalanced_nums, count_unbalanced_domains(guest_info))
+    print("%-8s %4d domains: %8.3f ms/tick, %d unbalanced domains"
+          % (collector, domain_nums, elapsed_ns / ticks / 1000000, unbalanced_nums))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the guest info update with a fake connection.")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--cpus", type=int, default=128)
+    args = parser.parse_args()
+    for collector in COLLECTOR_LIST:
+        for domain_nums in DOMAIN_NUMS_LIST:
+            run_bench(collector, domain_nums, args.cpus, args.ticks)
+
+
+if __name__ == "__main__":
+    main()
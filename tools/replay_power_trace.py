@@ -0,0 +1,221 @@
+#! /usr/bin/python
+# coding=UTF-8
+"""
+Copyright (c) Huawei Technologies Co., Ltd. 2022. All rights reserved.
+skylark licensed under the Mulan PSL v2.
+You can use this software according to the terms and conditions of the Mulan PSL v2.
+You may obtain a copy of Mulan PSL v2 at:
+    http://license.coscl.org.cn/MulanPSL2
+THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+PURPOSE.
+See the Mulan PSL v2 for more details.
+Author: Jinhao Gao
+Create: 2026-10-18
+Description: This file is used for replaying a power trace through the step and pid cpu control modes
+"""
+# @code
+
+"""
+Usage: python3 tools/replay_power_trace.py [--trace FILE] [--vms N] [--verbose]
+
+Replays a package power trace through PowerAnalyzer.power_manage and
+CpuController in the step and the pid CPU_CONTROL_MODE, against a fake cgroup
+tree, and prints how long and how far the package stayed over its TDP
+threshold and how much CPU time the low priority VMs got in each mode.
+
+The trace is a CSV file with one line per second: the power drawn by
+everything but the low priority VMs in watts, and the CPUs the low priority
+VMs want in total, e.g. "180,24". Without --trace a synthetic trace with a
+step, a ramp and a spike of the high priority load is used. The low priority
+VMs draw WATT_PER_CPU per CPU they get within their quota. Run it from the
+top of the source tree.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cgroupio import CGROUP_IO
+from data_collector.usagematrix import UsageMatrix
+from qos_analyzer.poweranalyzer import PowerAnalyzer
+from qos_controller import cpucontroller
+
+PACKAGE_TDP_WATT = 250
+PACKAGE_CPUS = 64
+TURBO_FREQ_MHZ = 3000
+WATT_PER_CPU = 3
+CFS_PERIOD_US = 100000
+CONTROL_MODE_LIST = (cpucontroller.CPU_CONTROL_MODE_STEP, cpucontroller.CPU_CONTROL_MODE_PID)
+
+
+def synthetic_trace():
+    """(high_watt, low_cpus) per second: calm, a step over TDP, a slow ramp, and a short spike."""
+    trace = [(150, 24)] * 10
+    trace += [(200, 24)] * 30
+    trace += [(150 + ramp, 24) for ramp in range(0, 60, 2)]
+    trace += [(150, 24)] * 10
+    trace += [(230, 24)] * 3
+    trace += [(150, 24)] * 20
+    return trace
+
+
+def load_trace(trace_path):
+    with open(trace_path) as trace_file:
+        return [(float(row[0]), float(row[1])) for row in csv.reader(trace_file)
+                if row and not row[0].startswith("#")]
+
+
+class FakeTopology:
+    def __init__(self):
+        self.max_cpu_nums = PACKAGE_CPUS
+        self.package_set = {0}
+        self.package_cpus_dict = {0: list(range(PACKAGE_CPUS))}
+
+
+class FakePackageData:
+    def __init__(self):
+        self.package_id = 0
+        self.energy_watt = 0
+
+
+class FakeHostStatusData:
+    def __init__(self):
+        self.package_data_dict = {0: FakePackageData()}
+        # Frequencies stay above FREQ_THRESHOLD, the power decides alone.
+        self.curr_freq = [TURBO_FREQ_MHZ] * PACKAGE_CPUS
+
+
+class FakeHostInfo:
+    def __init__(self):
+        self.host_topo = FakeTopology()
+        self.host_status_data = FakeHostStatusData()
+        self.cpu_turbofreq_mhz = TURBO_FREQ_MHZ
+        self.cpu_tdp_watt = {0: PACKAGE_TDP_WATT}
+
+
+class FakePowerAccount:
+    @staticmethod
+    def get_power(package, energy_domain=None):
+        return None
+
+
+class FakeVmMonGroups:
+    def __init__(self):
+        self.enabled = False
+
+
+class FakeDomain:
+    def __init__(self, domain_id, usage_matrix):
+        self.domain_id = domain_id
+        self.domain_name = "low-%d" % domain_id
+        self.cgroup_name = "machine-qemu\\x2d%d\\x2dlow.scope" % domain_id
+        self.global_quota_config = -1
+        self.cpu_stat = None
+        self.mbm_bandwidth = 0
+        self.usage_matrix = usage_matrix
+        self.matrix_row = usage_matrix.acquire_row(domain_id, 1)
+        self.domain_usage = 0
+        self.package_usage_dict = {0: 0}
+
+    def run(self, usage):
+        cpus = max(1, int(usage + 0.999))
+        self.usage_matrix.write_row(self.matrix_row, [usage / cpus] * cpus + [0] * (PACKAGE_CPUS - cpus))
+        self.domain_usage = usage
+        self.package_usage_dict = {0: usage}
+
+
+class FakeGuestInfo:
+    def __init__(self, vm_nums):
+        self.usage_matrix = UsageMatrix()
+        self.usage_matrix.set_cpu_topo(FakeTopology())
+        self.low_prio_vm_dict = {domain_id: FakeDomain(domain_id, self.usage_matrix)
+                                 for domain_id in range(1, vm_nums + 1)}
+        self.vm_dict = dict(self.low_prio_vm_dict)
+
+    def get_domain_usage(self, domain_id, package=None):
+        domain = self.vm_dict.get(domain_id)
+        return domain.domain_usage if package is None else domain.package_usage_dict.get(package, 0)
+
+
+class FakeDataCollector:
+    def __init__(self, vm_nums):
+        self.host_info = FakeHostInfo()
+        self.guest_info = FakeGuestInfo(vm_nums)
+        self.power_account = FakePowerAccount()
+        self.vm_mon_groups = FakeVmMonGroups()
+
+
+def get_quota_cpus(slice_path, domain):
+    # pwrite leaves the tail of a longer old value in a regular file, take what was written.
+    quota_us = CGROUP_IO.written_dict.get(os.path.join(slice_path, domain.cgroup_name, "cpu.cfs_quota_us"))
+    if quota_us is None or int(quota_us) < 0:
+        return None
+    return int(quota_us) / CFS_PERIOD_US
+
+
+def replay(control_mode, trace, vm_nums, verbose):
+    os.environ["CPU_CONTROL_MODE"] = control_mode
+    with tempfile.TemporaryDirectory() as slice_path:
+        with open(os.path.join(slice_path, "cpu.cfs_period_us"), "w") as period_file:
+            period_file.write("%d\n" % CFS_PERIOD_US)
+        cpucontroller.LOW_PRIORITY_SLICES_PATH = slice_path
+        data_collector = FakeDataCollector(vm_nums)
+        guest_info = data_collector.guest_info
+        for domain in guest_info.low_prio_vm_dict.values():
+            os.makedirs(os.path.join(slice_path, domain.cgroup_name))
+            with open(os.path.join(slice_path, domain.cgroup_name, "cpu.cfs_quota_us"), "w") as quota_file:
+                quota_file.write("-1\n")
+
+        power_analyzer = PowerAnalyzer()
+        power_analyzer.set_hotspot_threshold(data_collector)
+        cpu_controller = cpucontroller.CpuController()
+        cpu_controller.init_cpu_controller()
+        tdp_threshold = power_analyzer.package_tdp_threshold.get(0)
+
+        over_seconds = 0
+        over_joules = 0
+        low_cpu_seconds = 0
+        for second, (high_watt, low_cpus) in enumerate(trace):
+            low_watt = 0
+            for domain in guest_info.low_prio_vm_dict.values():
+                quota_cpus = get_quota_cpus(slice_path, domain)
+                usage = low_cpus / vm_nums if quota_cpus is None else min(low_cpus / vm_nums, quota_cpus)
+                domain.run(usage)
+                low_watt += WATT_PER_CPU * usage
+                low_cpu_seconds += usage
+            package_power = high_watt + low_watt
+            data_collector.host_info.host_status_data.package_data_dict.get(0).energy_watt = package_power
+            if package_power > tdp_threshold:
+                over_seconds += 1
+                over_joules += package_power - tdp_threshold
+            power_analyzer.power_manage(data_collector, cpu_controller)
+            if verbose:
+                print("%-4s %4d %7.1fW %s" % (control_mode, second, package_power,
+                                              ["%.2f" % domain.domain_usage
+                                               for domain in guest_info.low_prio_vm_dict.values()]))
+        CGROUP_IO.evict(slice_path)
+
+    print("%-4s: %3ds over the %.1fW threshold by %7.1fJ, low priority VMs got %7.1f cpu seconds"
+          " (%.1f without control)"
+          % (control_mode, over_seconds, tdp_threshold, over_joules, low_cpu_seconds,
+             sum(low_cpus for _, low_cpus in trace)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a power trace through the step and pid cpu control.")
+    parser.add_argument("--trace", help="CSV of high priority watts and low priority cpus per second")
+    parser.add_argument("--vms", type=int, default=4, help="number of low priority VMs")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    trace = load_trace(args.trace) if args.trace else synthetic_trace()
+    for control_mode in CONTROL_MODE_LIST:
+        replay(control_mode, trace, args.vms, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,6 +42,26 @@ def file_write(file_path, value, log=True):
         raise
 
 
+def parse_cpu_list(cpu_list):
+    cpus = []
+    for cpu_range in cpu_list.strip().split(","):
+        if not cpu_range:
+            continue
+        bounds = cpu_range.split("-")
+        cpus.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    cpu_ranges = []
+    for cpu in sorted(cpus):
+        if cpu_ranges and cpu == cpu_ranges[-1][1] + 1:
+            cpu_ranges[-1][1] = cpu
+        else:
+            cpu_ranges.append([cpu, cpu])
+    return ",".join("%d-%d" % (first, last) if first != last else "%d" % first for first, last in cpu_ranges)
+
+
 def remove_file(file_path):
     try:
         os.remove(file_path)